@@ -0,0 +1,93 @@
+import asyncio
+import atexit
+import threading
+import concurrent.futures
+import logging
+from typing import Any, AsyncIterator, Coroutine, Iterator, Optional
+
+logging.getLogger(__name__)
+
+# WHY: Streamlit runs each session's script on its own thread and reruns it on every interaction.
+# A single long-lived event loop per server process lets those threads share async clients and connection
+# pools, run LLM calls concurrently, and skip building/tearing down a loop on every turn.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_thread: Optional[threading.Thread] = None
+_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Return the process-wide background event loop, starting its thread on first use.
+    """
+    global _loop, _thread
+    if _loop is None or _loop.is_closed():
+        with _lock:
+            if _loop is None or _loop.is_closed():
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def _run():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                _thread = threading.Thread(target=_run, name="async-runner", daemon=True)
+                _thread.start()
+                ready.wait()
+                _loop = loop
+                logging.debug("Started background asyncio event loop")
+    return _loop
+
+
+def submit(coro: Coroutine) -> concurrent.futures.Future:
+    """
+    Schedule a coroutine on the background loop and return a concurrent.futures.Future for its result.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def run(coro: Coroutine, timeout: Optional[float] = None) -> Any:
+    """
+    Run a coroutine on the background loop and block the calling thread until it finishes.
+    """
+    future = submit(coro)
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise
+
+
+def iterate(async_gen: AsyncIterator, step_timeout: Optional[float] = None) -> Iterator:
+    """
+    Consume an async generator from synchronous code (e.g. st.write_stream), one item at a time,
+    with every step running on the background loop. A step taking longer than step_timeout raises
+    concurrent.futures.TimeoutError in the caller.
+    """
+    try:
+        while True:
+            try:
+                yield run(async_gen.__anext__(), step_timeout)
+            except StopAsyncIteration:
+                break
+    finally:
+        aclose = getattr(async_gen, "aclose", None)
+        if aclose is not None:
+            run(aclose())
+
+
+def shutdown(timeout: float = 5.0):
+    global _loop, _thread
+    with _lock:
+        loop, thread = _loop, _thread
+        _loop, _thread = None, None
+    if loop is None or loop.is_closed():
+        return
+    loop.call_soon_threadsafe(loop.stop)
+    if thread is not None:
+        thread.join(timeout)
+    if not loop.is_running():
+        loop.close()
+
+
+atexit.register(shutdown)
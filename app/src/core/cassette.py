@@ -0,0 +1,282 @@
+import os
+import json
+import gzip
+import time
+import asyncio
+import hashlib
+import threading
+from pathlib import Path
+from datetime import datetime, timezone
+import logging
+
+logging.getLogger(__name__)
+
+# WHY: Profiling the pipeline or re-running a regression conversation used to cost real tokens and gateway
+# latency on every run. With GEMINI_CASSETTE_MODE=record, every Gemini call the pipeline makes (generation,
+# streaming, count_tokens, history summaries) is stored with its raw response; replay serves the same
+# requests from disk without touching the network, optionally with the originally observed latency.
+#   off     talk to Gemini as usual
+#   record  call Gemini and (over)write the cassette for each request
+#   replay  serve every request from the cassette; a request that was never recorded is an error
+#   auto    replay when a recording exists, otherwise call Gemini and record it (a stream recorded after its
+#           consumer stopped early counts as missing, so it is recorded again in full)
+CASSETTE_MODE = os.getenv("GEMINI_CASSETTE_MODE", "off").lower()
+CASSETTE_DIR = Path(
+    os.getenv("GEMINI_CASSETTE_DIR")
+    or Path(__file__).parent.parent.parent / "data" / "cassettes"
+)
+# off = replay instantly; original = sleep as long as the recorded call took; a number scales that time
+CASSETTE_LATENCY = os.getenv("GEMINI_CASSETTE_LATENCY", "off").lower()
+CASSETTE_VERSION = 1
+MODES = ("off", "record", "replay", "auto")
+
+
+class CassetteMissError(LookupError):
+    """Raised in replay mode for a request that has no recording."""
+
+
+def _jsonable(value):
+    # SDK types (tools, thinking config...) dump to plain JSON; functions passed as tools hash by name,
+    # so the key doesn't change with their address.
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json", exclude_none=True)
+    if callable(value):
+        return f"{getattr(value, '__module__', '')}.{getattr(value, '__qualname__', repr(value))}"
+    return str(value)
+
+
+def request_key(kind, model, contents, config):
+    """Hash of the call kind and its (model, contents, config) arguments."""
+    payload = json.dumps(
+        {"kind": kind, "model": model, "contents": contents, "config": config},
+        sort_keys=True,
+        default=_jsonable,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _dump(response):
+    return response.model_dump(mode="json", exclude_none=True) if hasattr(response, "model_dump") else response
+
+
+class _CassetteStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {"replayed": 0, "recorded": 0, "misses": 0, "errors": 0}
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+class CassetteStore:
+    """
+    One gzipped JSON file per request, named by its request_key, so recordings can be diffed, pruned and
+    committed individually. An entry holds the request, the raw responses (one per streamed chunk) and when
+    each arrived relative to the call.
+    """
+
+    def __init__(self, path=CASSETTE_DIR):
+        self.path = Path(path)
+        self.stats = _CassetteStats()
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _file(self, key):
+        return self.path / f"{key}.json.gz"
+
+    def load(self, key):
+        try:
+            with gzip.open(self._file(key), "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        if entry.get("version") != CASSETTE_VERSION:
+            logging.warning(f"Ignoring cassette {key} with unsupported version {entry.get('version')}")
+            return None
+        return entry
+
+    def save(self, key, kind, model, contents, config, responses, offsets, complete=True):
+        entry = {
+            "version": CASSETTE_VERSION,
+            "kind": kind,
+            "recorded_at": datetime.now(timezone.utc).isoformat(),
+            "request": json.loads(json.dumps({"model": model, "contents": contents, "config": config}, default=_jsonable)),
+            "responses": [_dump(response) for response in responses],
+            "offsets": [round(offset, 4) for offset in offsets],
+            "complete": complete,
+        }
+        # Written to a temporary file and renamed, so a concurrent replay never reads half an entry
+        tmp = self._file(key).with_suffix(f".{threading.get_ident()}.tmp")
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(entry, f, separators=(",", ":"))
+        os.replace(tmp, self._file(key))
+        self.stats.incr("recorded")
+
+    def __len__(self):
+        return sum(1 for _ in self.path.glob("*.json.gz"))
+
+
+def _latency_scale():
+    if CASSETTE_LATENCY in ("", "off", "false", "0"):
+        return 0.0
+    if CASSETTE_LATENCY in ("original", "true"):
+        return 1.0
+    return float(CASSETTE_LATENCY)
+
+
+class _CassetteModels:
+    """client.aio.models with generate_content, generate_content_stream and count_tokens going through the store."""
+
+    def __init__(self, models, store, mode):
+        self._models = models
+        self._store = store
+        self._mode = mode
+        self._scale = _latency_scale()
+
+    def __getattr__(self, name):
+        if self._models is None:
+            raise CassetteMissError(f"client.aio.models.{name} is not available in cassette replay mode")
+        return getattr(self._models, name)
+
+    def _lookup(self, kind, model, contents, config):
+        key = request_key(kind, model, contents, config)
+        if self._mode in ("replay", "auto"):
+            entry = self._store.load(key)
+            if entry is not None and self._mode == "auto" and not entry.get("complete", True):
+                entry = None  # A stream the consumer closed early; record it again from the live API
+            if entry is not None:
+                self._store.stats.incr("replayed")
+                return key, entry
+            if self._mode == "replay":
+                self._store.stats.incr("misses")
+                raise CassetteMissError(f"No cassette recording for {kind} request {key[:12]} on {model}")
+        if self._models is None:
+            raise CassetteMissError("Recording requires GOOGLE_API_KEY")
+        return key, None
+
+    async def _sleep_until(self, started, offset):
+        if self._scale:
+            await asyncio.sleep(max(0.0, started + offset * self._scale - time.monotonic()))
+
+    async def _replay_one(self, entry, response_type):
+        await self._sleep_until(time.monotonic(), entry["offsets"][0])
+        return response_type.model_validate(entry["responses"][0])
+
+    async def generate_content(self, *, model, contents, config=None, **kwargs):
+        from google.genai import types
+        key, entry = self._lookup("generate", model, contents, config)
+        if entry is not None:
+            return await self._replay_one(entry, types.GenerateContentResponse)
+        started = time.monotonic()
+        response = await self._models.generate_content(model=model, contents=contents, config=config, **kwargs)
+        self._save(key, "generate", model, contents, config, [response], [time.monotonic() - started])
+        return response
+
+    async def count_tokens(self, *, model, contents, config=None, **kwargs):
+        from google.genai import types
+        key, entry = self._lookup("count_tokens", model, contents, config)
+        if entry is not None:
+            return await self._replay_one(entry, types.CountTokensResponse)
+        started = time.monotonic()
+        response = await self._models.count_tokens(model=model, contents=contents, config=config, **kwargs)
+        self._save(key, "count_tokens", model, contents, config, [response], [time.monotonic() - started])
+        return response
+
+    async def generate_content_stream(self, *, model, contents, config=None, **kwargs):
+        from google.genai import types
+        key, entry = self._lookup("stream", model, contents, config)
+        if entry is not None:
+            return self._replay_stream(entry, types.GenerateContentResponse)
+        started = time.monotonic()
+        stream = await self._models.generate_content_stream(model=model, contents=contents, config=config, **kwargs)
+        return self._record_stream(stream, started, key, model, contents, config)
+
+    async def _replay_stream(self, entry, response_type):
+        started = time.monotonic()
+        for response, offset in zip(entry["responses"], entry["offsets"]):
+            await self._sleep_until(started, offset)
+            yield response_type.model_validate(response)
+
+    async def _record_stream(self, stream, started, key, model, contents, config):
+        chunks, offsets = [], []
+        try:
+            async for chunk in stream:
+                chunks.append(chunk)
+                offsets.append(time.monotonic() - started)
+                yield chunk
+        except GeneratorExit:
+            # A consumer that stops early (e.g. on a safety block) still leaves a replayable recording; a stream
+            # that failed is not recorded at all
+            if chunks:
+                self._save(key, "stream", model, contents, config, chunks, offsets, complete=False)
+            raise
+        self._save(key, "stream", model, contents, config, chunks, offsets)
+
+    def _save(self, key, kind, model, contents, config, responses, offsets, complete=True):
+        try:
+            self._store.save(key, kind, model, contents, config, responses, offsets, complete=complete)
+        except Exception as e:
+            self._store.stats.incr("errors")
+            logging.error(f"Failed to record cassette {key[:12]}: {e}")
+
+
+class _CassetteAio:
+    def __init__(self, aio, store, mode):
+        self._aio = aio
+        self.models = _CassetteModels(getattr(aio, "models", None), store, mode)
+
+    def __getattr__(self, name):
+        if self._aio is None:
+            raise CassetteMissError(f"client.aio.{name} is not available in cassette replay mode")
+        return getattr(self._aio, name)
+
+
+class CassetteClient:
+    """
+    Wraps a genai.Client so its async model calls are recorded or replayed; everything else is passed through.
+    client may be None in replay mode, when there is no API key.
+    """
+
+    def __init__(self, client, store, mode):
+        self._client = client
+        self.aio = _CassetteAio(getattr(client, "aio", None), store, mode)
+
+    def __getattr__(self, name):
+        if self._client is None:
+            raise CassetteMissError(f"client.{name} is not available in cassette replay mode")
+        return getattr(self._client, name)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def enabled():
+    return CASSETTE_MODE not in ("", "off", "false", "none")
+
+
+def get_store():
+    """Return the process-wide store for GEMINI_CASSETTE_DIR, or None when cassettes are off."""
+    global _store
+    if not enabled():
+        return None
+    if CASSETTE_MODE not in MODES:
+        raise ValueError(f"Unknown GEMINI_CASSETTE_MODE: {CASSETTE_MODE!r}; expected one of {', '.join(MODES)}")
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = CassetteStore()
+                logging.info(f"Gemini cassettes in {CASSETTE_MODE} mode at {_store.path}")
+    return _store
+
+
+def wrap_client(client):
+    """Return client wrapped for recording/replay, or client itself when cassettes are off."""
+    store = get_store()
+    if store is None:
+        return client
+    return CassetteClient(client, store, CASSETTE_MODE)
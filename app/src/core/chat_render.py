@@ -0,0 +1,71 @@
+import os
+import re
+import html
+import hashlib
+from functools import lru_cache
+import logging
+
+logging.getLogger(__name__)
+
+# Pre-rendered messages kept per process; a long assistant reply is rendered once, not on every rerun.
+RENDER_CACHE_SIZE = int(os.getenv("CHAT_RENDER_CACHE_SIZE", 2048))
+
+USER_MESSAGE_HTML = (
+    "<div style='background:#e3f2fd; color:#17416b; border-radius:8px; padding:16px 18px; margin-bottom:8px; "
+    "font-size:1.05em; width:100%; max-width:648px; box-sizing:border-box; word-break:break-word; "
+    "overflow-wrap:break-word;'>{content}</div>"
+)
+_CODE_RE = re.compile(r'`([^`]+)`')
+
+
+def message_key(msg):
+    """Stable id for a chat message, used for deduplication and as the render cache key."""
+    digest = hashlib.sha1(f"{msg.get('role')}\x00{msg.get('content')}".encode("utf-8")).hexdigest()
+    return digest
+
+
+def style_code(text):
+    # Replace `code` with styled span
+    return _CODE_RE.sub(r"<span style='color:#8c3f1a; font-weight:400;'>\1</span>", text)
+
+
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def _render(key, role, content):
+    if role == "user":
+        return USER_MESSAGE_HTML.format(content=html.escape(content))
+    if role == "assistant":
+        return style_code(content.replace('\n', '  \n'))
+    return None
+
+
+def render_message(msg):
+    """Return the markdown/HTML for a chat message, from the cache when it has been rendered before."""
+    key = msg.get("_key") or message_key(msg)
+    return _render(key, msg.get("role"), msg.get("content", ""))
+
+
+def dedupe_new_messages(state):
+    """
+    Drop repeated (role, content) messages from state["chat_messages"], only looking at messages added since
+    the previous call. The seen-set and the checked position are kept in `state` between reruns.
+    """
+    messages = state["chat_messages"]
+    seen = state.get("_chat_seen_keys")
+    checked = state.get("_chat_checked_upto", 0)
+    if seen is None or checked > len(messages):
+        # First run, or the history was replaced (new/loaded session): start over
+        seen, checked = set(), 0
+
+    kept = []
+    for msg in messages[checked:]:
+        key = msg.get("_key") or message_key(msg)
+        if key in seen:
+            continue
+        msg["_key"] = key
+        seen.add(key)
+        kept.append(msg)
+    if len(kept) != len(messages) - checked:
+        state["chat_messages"] = messages[:checked] + kept
+    state["_chat_seen_keys"] = seen
+    state["_chat_checked_upto"] = len(state["chat_messages"])
+    return state["chat_messages"]
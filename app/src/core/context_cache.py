@@ -0,0 +1,156 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from typing import Dict, Optional, Tuple
+
+from google.genai import types
+
+import history_window
+
+logging.getLogger(__name__)
+
+# WHY: Every turn resends the ~5.5 KB level system prompt. With GEMINI_CONTEXT_CACHE=true the rendered prompt is
+# uploaded once per (model, prompt version) as server-side cached content and requests reference it by name.
+CONTEXT_CACHE_ENABLED = os.getenv("GEMINI_CONTEXT_CACHE", "false").lower() == "true"
+CONTEXT_CACHE_TTL = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL", 3600))
+# Extend (or recreate) a cache entry when it has less than this many seconds left.
+CONTEXT_CACHE_REFRESH_MARGIN = int(os.getenv("GEMINI_CONTEXT_CACHE_REFRESH_MARGIN", 300))
+# After a model or the gateway rejects caching, don't try again for this long.
+CONTEXT_CACHE_RETRY_AFTER = int(os.getenv("GEMINI_CONTEXT_CACHE_RETRY_AFTER", 3600))
+# Gemini rejects cached content smaller than a per-model minimum, and the level prompts (~1.4k tokens) are below
+# gemini-2.5-pro's, so prompts are counted before creating a cache and sent inline when too small.
+# GEMINI_CONTEXT_CACHE_MIN_TOKENS overrides the table for every model (0 = use the table).
+MIN_CACHE_TOKENS = {
+    "gemini-2.5-pro": 4096,
+    "gemini-2.5-flash": 1024,
+}
+DEFAULT_MIN_CACHE_TOKENS = 1024
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_TOKENS", 0))
+
+
+def min_cache_tokens(model_id: str) -> int:
+    """Smallest cached content (in tokens) the model accepts; model ids may carry a models/ prefix or a suffix."""
+    if CONTEXT_CACHE_MIN_TOKENS:
+        return CONTEXT_CACHE_MIN_TOKENS
+    name = model_id.split("/")[-1]
+    for prefix, minimum in sorted(MIN_CACHE_TOKENS.items(), key=lambda item: -len(item[0])):
+        if name.startswith(prefix):
+            return minimum
+    return DEFAULT_MIN_CACHE_TOKENS
+
+
+class ContextCacheManager:
+    """
+    Creates, refreshes and reuses cached content for system instructions. All methods run on the
+    background event loop (see async_runner), so plain dicts and asyncio locks are enough.
+    """
+
+    def __init__(self, ttl=CONTEXT_CACHE_TTL, refresh_margin=CONTEXT_CACHE_REFRESH_MARGIN,
+                 retry_after=CONTEXT_CACHE_RETRY_AFTER):
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.retry_after = retry_after
+        self._entries: Dict[Tuple[str, str], Tuple[str, float]] = {}  # key -> (cache name, expires monotonic)
+        self._unsupported: Dict[str, float] = {}  # model -> monotonic time to try again
+        self._too_small: Dict[Tuple[str, str], int] = {}  # key -> prompt tokens, below the model's minimum
+        self._locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+
+    @staticmethod
+    def _key(model_id: str, system_instruction: str) -> Tuple[str, str]:
+        return model_id, hashlib.sha256(system_instruction.encode("utf-8")).hexdigest()
+
+    async def cached_content_for(self, client, model_id: str, system_instruction: str) -> Optional[str]:
+        """
+        Return the cached content name for this model/system prompt, creating or refreshing it as needed,
+        or None when caching isn't available (the caller then sends the system instruction inline).
+        """
+        now = time.monotonic()
+        if self._unsupported.get(model_id, 0) > now:
+            return None
+        key = self._key(model_id, system_instruction)
+        if key in self._too_small:
+            return None
+        entry = self._entries.get(key)
+        if entry and entry[1] - now > self.refresh_margin:
+            return entry[0]
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry and entry[1] - now > self.refresh_margin:
+                return entry[0]
+            if key in self._too_small:
+                return None
+            if not entry and not await self._large_enough(client, model_id, system_instruction, key):
+                return None
+            try:
+                if entry and entry[1] > now:
+                    name = await self._refresh(client, entry[0])
+                else:
+                    name = await self._create(client, model_id, system_instruction, key[1])
+            except Exception as e:
+                logging.warning(f"Context caching unavailable for {model_id}, sending system prompt inline: {e}")
+                self._entries.pop(key, None)
+                self.mark_unsupported(model_id)
+                return None
+            self._entries[key] = (name, time.monotonic() + self.ttl)
+            return name
+
+    async def _large_enough(self, client, model_id: str, system_instruction: str, key: Tuple[str, str]) -> bool:
+        # Counted once per model/prompt version; a prompt below the minimum is remembered and logged once
+        try:
+            tokens = await history_window.count_tokens(client, model_id, [], system_instruction)
+        except Exception as e:
+            tokens = history_window.estimate_tokens(len(system_instruction))
+            logging.debug(f"Could not count system prompt tokens for {model_id}, using estimate {tokens}: {e}")
+        minimum = min_cache_tokens(model_id)
+        if tokens >= minimum:
+            return True
+        self._too_small[key] = tokens
+        logging.info(
+            f"Context caching not applicable for {model_id}: the system prompt is {tokens} tokens, below the "
+            f"{minimum}-token minimum for cached content; sending it inline"
+        )
+        return False
+
+    async def _create(self, client, model_id: str, system_instruction: str, digest: str) -> str:
+        cached = await client.aio.caches.create(
+            model=model_id,
+            config=types.CreateCachedContentConfig(
+                system_instruction=system_instruction,
+                display_name=f"digital-latin-{digest[:12]}",
+                ttl=f"{self.ttl}s",
+            ),
+        )
+        logging.debug(f"Created context cache {cached.name} for {model_id}")
+        return cached.name
+
+    async def _refresh(self, client, name: str) -> str:
+        await client.aio.caches.update(name=name, config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s"))
+        logging.debug(f"Extended context cache {name}")
+        return name
+
+    def mark_unsupported(self, model_id: str):
+        """Send this model's system prompts inline for retry_after seconds instead of caching them."""
+        self._unsupported[model_id] = time.monotonic() + self.retry_after
+
+    def invalidate(self, name: str):
+        """Forget a cache entry the server no longer knows about (expired or deleted)."""
+        for key, entry in list(self._entries.items()):
+            if entry[0] == name:
+                self._entries.pop(key, None)
+
+
+_manager: Optional[ContextCacheManager] = None
+
+
+def get_manager() -> Optional[ContextCacheManager]:
+    global _manager
+    if not CONTEXT_CACHE_ENABLED:
+        return None
+    if _manager is None:
+        _manager = ContextCacheManager()
+    return _manager
@@ -1,23 +1,46 @@
 import os
 import json
 import requests
-from typing import Any, Callable, List, Dict, Tuple, Optional
+from typing import Any, AsyncIterator, Callable, List, Dict, Tuple, Optional
 import logging
 from google.genai.errors import ClientError, ServerError, APIError
 from google.genai import types
 import google.genai
 import re
 import time
-import inspect
 import asyncio
+import threading
+import httpx
+import async_runner
+import response_cache
+import context_cache
+import cassette
+import history_window
+import turn_tracing
+from retry_policy import CircuitBreaker, CircuitOpenError, RetryMetrics, RetryPolicy, call_with_retry
 
 logging.getLogger(__name__)
 
+DEFAULT_GOOGLE_API_BASE_URL = "https://go.apis.huit.harvard.edu/ais-google-gemini"
+# Shown when Gemini returns no usable text; never stored in the response cache
+NO_CONTENT_MESSAGE = "[No content generated or unexpected response structure]"
+
 class GeminiPipeline:
+    # WHY: genai clients are shared by every GeminiPipeline in the process (Streamlit builds a new pipeline on
+    # each rerun), keyed on (api_key, base_url), so HTTP keep-alive connections to the gateway are reused across turns.
+    _clients: Dict[Tuple[str, str], google.genai.Client] = {}
+    _clients_lock = threading.Lock()
+    # Gateway health and retry counters are shared by all pipelines in the process as well.
+    _circuit_breaker = CircuitBreaker.from_env()
+    _retry_metrics = RetryMetrics()
+
     def __init__(self, input_data):
         self.input_data = input_data
         self.api_url = os.getenv('GEMINI_API_URL')
         self.api_key = os.getenv('GEMINI_API_KEY')
+        self.google_api_key = os.getenv("GOOGLE_API_KEY")
+        self.google_base_url = os.getenv("GOOGLE_API_BASE_URL") or DEFAULT_GOOGLE_API_BASE_URL
+        self.retry_policy = RetryPolicy.from_env()
 
         # Initialize logging
         self.log = logging.getLogger("gemini_pipeline")
@@ -66,72 +89,354 @@ class GeminiPipeline:
     ) -> str:
         """
         Main method for sending requests to the Google Gemini endpoint.
-        Now explicitly non-streaming.
+        Non-streaming: returns the full response text. See pipe_stream() for the streaming variant.
+        """
+        try:
+            return await self.complete(body, __metadata__, __tools__)
+        except Exception as e:
+            return self._format_error(e)
+
+    async def complete(
+        self,
+        body: dict,
+        __metadata__: dict[str, Any] | None = None,
+        __tools__: dict[str, Any] | None = None,
+    ) -> str:
+        """
+        pipe() without the error handling: API and configuration errors are raised instead of being
+        turned into chat messages, for callers (like the batch tools) that need to tell them apart.
         """
         request_id = id(body)
         self.log.debug(f"Processing request {request_id}")
 
+        request = self._prepare_request(body, __metadata__ or {}, __tools__)
+        if isinstance(request, str):
+            return request
+        client, model_id, contents, gen_config = request
+        contents = await self._window_history(client, model_id, contents, gen_config, request_id)
+
+        cache, key = self._response_cache_for(body, model_id, contents, gen_config)
+        if cache is not None:
+            with turn_tracing.span("llm.response_cache") as span:
+                cached = await self._cache_call(cache.get, key)
+                span.set_data("hit", cached is not None)
+            if cached is not None:
+                self.log.debug(f"Response cache hit for request {request_id}")
+                return cached
+
+        # Log the request details before sending
+        self.log.debug(f"About to send request to Gemini API with model: {model_id}")
+        self.log.debug(f"Calling generate_content (non-streaming) on client.aio.models with model {model_id}")
+        with turn_tracing.span("llm.request", model_id, stream=False, messages=len(contents)) as span:
+            response = await self._send(
+                client.aio.models.generate_content,
+                client=client,
+                model=model_id,
+                contents=contents,
+                config=gen_config,
+            )
+            self._record_usage(span, response)
+
+        # Log the response after receiving
+        self.log.debug(f"Response received from Gemini API: {response}")
+
+        text = self._handle_standard_response(response)
+        if (cache is not None and self._cacheable(text) and self._blocked_message(response) is None
+                and getattr(response, 'candidates', None)):
+            await self._cache_call(cache.put, key, text)
+        return text
+
+    async def pipe_stream(
+        self,
+        body: dict,
+        __metadata__: dict[str, Any],
+        __event_emitter__: Callable,
+        __tools__: dict[str, Any] | None,
+    ) -> AsyncIterator[str]:
+        """
+        Streaming variant of pipe(): yields text chunks as the model produces them.
+        Safety blocks and errors are yielded as the same bracketed/error strings pipe() returns.
+        """
+        request_id = id(body)
+        self.log.debug(f"Processing streaming request {request_id}")
+
         try:
-            model_id = body.get("model", "")
-            try:
-                model_id = self._prepare_model_id(model_id)
-                self.log.debug(f"Using model: {model_id}")
-            except ValueError as ve:
-                return f"Model Error: {ve}"
+            request = self._prepare_request(body, __metadata__, __tools__)
+            if isinstance(request, str):
+                yield request
+                return
+            client, model_id, contents, gen_config = request
+            contents = await self._window_history(client, model_id, contents, gen_config, request_id)
+
+            cache, key = self._response_cache_for(body, model_id, contents, gen_config)
+            if cache is not None:
+                with turn_tracing.span("llm.response_cache") as span:
+                    cached = await self._cache_call(cache.get, key)
+                    span.set_data("hit", cached is not None)
+                if cached is not None:
+                    self.log.debug(f"Response cache hit for streaming request {request_id}")
+                    yield cached
+                    return
+
+            self.log.debug(f"Calling generate_content_stream on client.aio.models with model {model_id}")
+            # The request is only sent when the first chunk is pulled, so that is what gets retried.
+            sentinel = object()
+            produced = []
+            with turn_tracing.span("llm.request", model_id, stream=True, messages=len(contents)) as span:
+                started = time.perf_counter()
+                deadline = time.monotonic() + self.retry_policy.total_timeout
+                chunk, stream = await self._send(
+                    self._open_stream,
+                    client,
+                    sentinel,
+                    client=client,
+                    model=model_id,
+                    contents=contents,
+                    config=gen_config,
+                )
+                span.set_data("first_chunk_ms", round((time.perf_counter() - started) * 1000, 1))
+
+                chunks = 0
+                while chunk is not sentinel:
+                    chunks += 1
+                    self._record_usage(span, chunk)  # The last chunk carries the totals
+                    text, blocked = self._handle_stream_chunk(chunk)
+                    if text:
+                        produced.append(text)
+                        yield text
+                    if blocked:
+                        yield f"\n\n{blocked}" if produced else blocked
+                        return
+                    chunk = await self._next_chunk(stream, sentinel, deadline)
+                span.set_data("chunks", chunks)
+            if not produced:
+                yield NO_CONTENT_MESSAGE
+            elif cache is not None and self._cacheable("".join(produced)):
+                await self._cache_call(cache.put, key, "".join(produced))
+
+        except Exception as e:
+            yield self._format_error(e)
 
-            stream = False
-            messages = body.get("messages", [])
+    def _prepare_request(self, body: dict, __metadata__, __tools__):
+        """
+        Build (client, model_id, contents, gen_config) for a request, or return a user-facing message
+        when there is nothing to send.
+        """
+        model_id = body.get("model", "")
+        try:
+            model_id = self._prepare_model_id(model_id)
+            self.log.debug(f"Using model: {model_id}")
+        except ValueError as ve:
+            return f"Model Error: {ve}"
 
+        messages = body.get("messages", [])
+
+        with turn_tracing.span("llm.prepare_content", messages=len(messages)):
             contents, system_instruction = self._prepare_content(messages)
-            if not contents:
-                return "No content provided for generation."
-            if not system_instruction:
-                self.log.debug("No system instruction provided, proceeding without it.")
+        if not contents:
+            return "No content provided for generation."
+        if not system_instruction:
+            self.log.debug("No system instruction provided, proceeding without it.")
+        else:
             self.log.debug(f"System instruction included: {system_instruction[:100]}")  # Log first 100 characters
 
+        with turn_tracing.span("llm.get_client"):
             client = self._get_client()
 
-            gen_config = self._configure_generation(
-                body, system_instruction, model_id, __metadata__, __tools__
-            )
+        gen_config = self._configure_generation(
+            body, system_instruction, model_id, __metadata__, __tools__
+        )
+        return client, model_id, contents, gen_config
 
-            # Log the request details before sending
-            self.log.debug(f"About to send request to Gemini API with model: {model_id}")
-            self.log.debug(f"Calling generate_content (non-streaming) on client.models with model {model_id}")
-            response = await self._retry_with_backoff(
-                client.models.generate_content,
-                model=model_id,
-                contents=contents,
-                config=gen_config,
-            )
+    async def _window_history(self, client, model_id: str, contents, gen_config: dict, request_id) -> list:
+        """
+        Fit the conversation into HISTORY_TOKEN_BUDGET (see history_window) and log the request's token count.
+        """
+        try:
+            with turn_tracing.span("llm.history_window") as span:
+                # count_tokens shares the retry policy and circuit breaker with generation
+                windowed, stats = await history_window.fit_history(
+                    client, model_id, contents, gen_config.get("system_instruction"), call=self._retry_with_backoff
+                )
+                span.set_data("input_tokens", stats["input_tokens"])
+                span.set_data("token_source", stats["source"])
+                span.set_data("dropped_messages", stats["dropped"])
+        except Exception as e:
+            self.log.error(f"History windowing failed for request {request_id}, sending full history: {e}")
+            return contents
+        self.log.info(
+            f"Request {request_id}: ~{stats['input_tokens']} input tokens ({stats['source']}), "
+            f"budget {stats['budget'] or 'unlimited'}, {len(windowed)}/{stats['messages']} messages"
+            + (f", {stats['dropped']} older messages {'summarized' if stats['summarized'] else 'dropped'}" if stats["dropped"] else "")
+        )
+        return windowed
+
+    @staticmethod
+    def _record_usage(span, response):
+        """Copy Gemini's token counts from a response (or stream chunk) onto a trace span."""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        for field in ("prompt_token_count", "candidates_token_count", "cached_content_token_count", "total_token_count"):
+            value = getattr(usage, field, None)
+            if value is not None:
+                span.set_data(field, value)
+
+    def _response_cache_for(self, body: dict, model_id: str, contents, gen_config):
+        """
+        Return (cache, key) when this request may be served from the response cache, else (None, None).
+        Callers can bypass it with body["cache"] = False; sampled requests bypass it when
+        GEMINI_RESPONSE_CACHE_SKIP_SAMPLED=true.
+        """
+        if body.get("cache") is False:
+            return None, None
+        if response_cache.SKIP_SAMPLED and gen_config.get("temperature", 0) > 0:
+            return None, None
+        try:
+            cache = response_cache.get_response_cache()
+        except Exception as e:
+            self.log.error(f"Response cache unavailable: {e}")
+            return None, None
+        if cache is None:
+            return None, None
+        return cache, response_cache.cache_key(model_id, contents, gen_config)
+
+    async def _cache_call(self, func, *args):
+        # Cache I/O is blocking (SQLite/psycopg2); keep it off the event loop and never fail the turn over it.
+        try:
+            return await asyncio.to_thread(func, *args)
+        except Exception as e:
+            self.log.error(f"Response cache error: {e}")
+            return None
+
+    @staticmethod
+    def _cacheable(text: str) -> bool:
+        # An empty answer or the no-content placeholder would otherwise be replayed for every later identical request
+        return bool(text and text.strip()) and text != NO_CONTENT_MESSAGE
 
-            # Log the response after receiving
-            self.log.debug(f"Response received from Gemini API: {response}")
+    @staticmethod
+    def response_cache_metrics() -> Optional[Dict[str, Any]]:
+        cache = response_cache._cache
+        return cache.stats.snapshot() if cache is not None else None
 
-            return self._handle_standard_response(response)
+    @staticmethod
+    def cassette_metrics() -> Optional[Dict[str, Any]]:
+        return cassette._store.stats.snapshot() if cassette._store is not None else None
 
-        except ClientError as e:
+    def _format_error(self, e: Exception) -> str:
+        """
+        Log an exception raised while talking to Gemini and turn it into the message shown in the chat.
+        """
+        if isinstance(e, CircuitOpenError):
+            self.log.error(f"Gemini circuit open: {e}")
+            return f"The Gemini service is temporarily unavailable. Please try again in {max(1, round(e.retry_in))} seconds."
+        if isinstance(e, asyncio.TimeoutError):
+            self.log.error("Gemini request timed out")
+            return "The Gemini service did not respond in time. Please try again."
+        if isinstance(e, cassette.CassetteMissError):
+            self.log.error(f"Cassette replay error: {e}")
+            return f"Cassette Error: {e}"
+        if isinstance(e, ClientError):
             self.log.error(f"Google API Client Error: {e.message}")
             return f"Google API Client Error: {e.message}"
-        except ServerError as e:
-            self.log.error(f"Google API Server Error: {e.status_code} {e.message}")
-            return f"Google API Server Error: {e.status_code} {e.message}"
-        except APIError as e:
+        if isinstance(e, ServerError):
+            self.log.error(f"Google API Server Error: {e.code} {e.message}")
+            return f"Google API Server Error: {e.code} {e.message}"
+        if isinstance(e, APIError):
             self.log.error(f"Google API Error: {e.message}")
             return f"Google API Error: {e.message}"
-        except ValueError as e:
+        if isinstance(e, ValueError):
             self.log.error(f"Configuration Error: {e}")
             return f"Configuration Error: {e}"
-        except Exception as e:
-            self.log.exception(f"An unexpected error occurred in pipe: {e}")
-            return f"An unexpected error occurred: {e}"
+        self.log.exception(f"An unexpected error occurred in pipe: {e}")
+        return f"An unexpected error occurred: {e}"
 
     async def _retry_with_backoff(self, func, *args, **kwargs):
-        # Only try once, no retry or timeout, just wait for the response
-        if inspect.iscoroutinefunction(func):
-            return await func(*args, **kwargs)
-        else:
-            return await asyncio.to_thread(func, *args, **kwargs)
+        """
+        Call func under the pipeline's RetryPolicy: per-attempt and overall deadlines, jittered exponential
+        backoff for 408/429/5xx and transport errors (honouring Retry-After), and a shared circuit breaker.
+        """
+        return await call_with_retry(
+            func,
+            *args,
+            policy=self.retry_policy,
+            breaker=self._circuit_breaker,
+            metrics=self._retry_metrics,
+            **kwargs,
+        )
+
+    async def _send(self, func, *args, client, model: str, contents, config: dict):
+        """
+        Call func(*args, model=..., contents=..., config=...) with retries. If context caching is enabled, the
+        system instruction is replaced by a reference to server-side cached content; a request the server
+        rejects because of the cache reference is resent once with the system instruction inline.
+        """
+        cached_config = await self._context_cached_config(client, model, config)
+        if cached_config is not config:
+            try:
+                return await self._retry_with_backoff(func, *args, model=model, contents=contents, config=cached_config)
+            except ClientError as e:
+                if e.code not in (400, 403, 404):  # e.g. 429 after retries: resending inline won't help
+                    raise
+                self.log.warning(f"Request with cached content {cached_config['cached_content']} failed ({e.code}); resending inline")
+                # Like a failed cache create: don't keep sending this model's requests with a cache reference
+                manager = context_cache.get_manager()
+                manager.invalidate(cached_config["cached_content"])
+                manager.mark_unsupported(model)
+        return await self._retry_with_backoff(func, *args, model=model, contents=contents, config=config)
+
+    async def _context_cached_config(self, client, model_id: str, gen_config: dict) -> dict:
+        """
+        Return gen_config with system_instruction swapped for cached_content, or gen_config itself when
+        context caching is off, unsupported or not applicable (no system prompt, or tools that would also
+        have to live in the cache).
+        """
+        manager = context_cache.get_manager()
+        system_instruction = gen_config.get("system_instruction")
+        # With cassettes on, requests keep the inline prompt so recordings don't depend on a cache name
+        if manager is None or not system_instruction or gen_config.get("tools") or cassette.enabled():
+            return gen_config
+        name = await manager.cached_content_for(client, model_id, system_instruction)
+        if name is None:
+            return gen_config
+        cached_config = {k: v for k, v in gen_config.items() if k != "system_instruction"}
+        cached_config["cached_content"] = name
+        return cached_config
+
+    @staticmethod
+    async def _open_stream(client, sentinel, **kwargs):
+        stream = await client.aio.models.generate_content_stream(**kwargs)
+        return await anext(stream, sentinel), stream
+
+    async def _next_chunk(self, stream, sentinel, deadline: float):
+        """
+        Pull the next chunk of an open stream within the per-attempt timeout, cut short by the overall
+        deadline. Chunks after the first aren't retried (the reply is already partly shown), but a stream
+        that stalls must not hold the script thread.
+        """
+        timeout = min(self.retry_policy.attempt_timeout, deadline - time.monotonic())
+        try:
+            if timeout <= 0:
+                raise asyncio.TimeoutError()
+            return await asyncio.wait_for(anext(stream, sentinel), timeout=timeout)
+        except asyncio.TimeoutError:
+            self._retry_metrics.incr("stream_timeouts")
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                try:
+                    await aclose()
+                except Exception as e:
+                    self.log.debug(f"Error closing stalled stream: {e}")
+            raise
+
+    @classmethod
+    def retry_metrics(cls) -> Dict[str, Any]:
+        """
+        Attempt counts, backoff wait time and circuit breaker state for calls made by any pipeline.
+        """
+        metrics = cls._retry_metrics.snapshot()
+        metrics["circuit_state"] = cls._circuit_breaker.state
+        return metrics
 
     def _prepare_model_id(self, model_id: str) -> str:
         # # print(f"[GeminiPipeline] Allowed models list before model lookup: {self._allowed_models_list}")
@@ -267,18 +572,81 @@ class GeminiPipeline:
 
     def _get_client(self):
         """
-        Validates API credentials and returns a genai.Client instance.
+        Validates API credentials and returns the shared genai.Client for (api_key, base_url),
+        creating it on first use.
         """
-        api_key = os.getenv("GOOGLE_API_KEY")
-        base_url = os.getenv("GOOGLE_API_BASE_URL") or "https://go.apis.huit.harvard.edu/ais-google-gemini"
-        self.log.debug(f"_get_client: Using base_url: {base_url}")
+        api_key = self.google_api_key
+        base_url = self.google_base_url
+        if not api_key and cassette.CASSETTE_MODE == "replay":
+            return cassette.wrap_client(None)  # Replay needs no credentials or network
         if not api_key:
             raise ValueError("GOOGLE_API_KEY is not set. Please provide the API key in the environment variables.")
+        key = (api_key, base_url)
+        client = self._clients.get(key)
+        if client is None:
+            with self._clients_lock:
+                client = self._clients.get(key)
+                if client is None:
+                    self.log.debug(f"_get_client: Creating client for base_url: {base_url}")
+                    client = self._new_client(api_key, base_url)
+                    self._clients[key] = client
+        return cassette.wrap_client(client)
+
+    @staticmethod
+    def _new_client(api_key: str, base_url: str) -> google.genai.Client:
+        """
+        Build a genai.Client whose underlying httpx clients keep connections to the gateway alive.
+        """
+        limits = httpx.Limits(
+            max_connections=int(os.getenv("GEMINI_HTTP_MAX_CONNECTIONS", 50)),
+            max_keepalive_connections=int(os.getenv("GEMINI_HTTP_MAX_KEEPALIVE", 20)),
+            keepalive_expiry=float(os.getenv("GEMINI_HTTP_KEEPALIVE_EXPIRY", 120)),
+        )
         return google.genai.Client(
             api_key=api_key,
-            http_options=types.HttpOptions(base_url=base_url),
+            http_options=types.HttpOptions(
+                base_url=base_url,
+                client_args={"limits": limits},
+                async_client_args={"limits": limits},
+            ),
         )
 
+    def refresh_client(self):
+        """
+        Drop the cached client for this pipeline's credentials (e.g. after a key rotation) and build a new one.
+        """
+        with self._clients_lock:
+            client = self._clients.pop((self.google_api_key, self.google_base_url), None)
+        if client is not None:
+            self._close(client)
+        self.google_api_key = os.getenv("GOOGLE_API_KEY")
+        self.google_base_url = os.getenv("GOOGLE_API_BASE_URL") or DEFAULT_GOOGLE_API_BASE_URL
+        return self._get_client()
+
+    @classmethod
+    def close_clients(cls):
+        """
+        Close every cached client and its pooled HTTP connections.
+        """
+        with cls._clients_lock:
+            clients = list(cls._clients.values())
+            cls._clients.clear()
+        for client in clients:
+            cls._close(client)
+
+    @staticmethod
+    def _close(client):
+        try:
+            close = getattr(client, "close", None)
+            if close is not None:
+                close()
+            # The async client's connections live on the background loop, so close them there.
+            aclose = getattr(getattr(client, "aio", None), "aclose", None)
+            if aclose is not None:
+                async_runner.run(aclose())
+        except Exception as e:
+            logging.warning(f"Error closing genai client: {e}")
+
     def _prepare_content(
         self, messages: List[Dict[str, Any]]
     ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
@@ -346,26 +714,54 @@ class GeminiPipeline:
         """
         Handle non-streaming response from Gemini API.
         """
-        if hasattr(response, 'prompt_feedback') and response.prompt_feedback and getattr(response.prompt_feedback, 'block_reason', None):
-            return f"[Blocked due to Prompt Safety: {response.prompt_feedback.block_reason.name}]"
+        blocked = self._blocked_message(response)
+        if blocked:
+            return blocked
 
         if not hasattr(response, 'candidates') or not response.candidates:
             return "[Blocked by safety settings or no candidates generated]"
 
-        candidate = response.candidates[0]
+        text = self._candidate_text(response.candidates[0])
+        if text is None:
+            return NO_CONTENT_MESSAGE
+        return text
+
+    def _handle_stream_chunk(self, chunk: Any) -> Tuple[str, Optional[str]]:
+        """
+        Handle one chunk of a streaming response.
+        Returns (text, blocked_message); blocked_message is set when the stream was stopped for safety.
+        Chunks without candidates (e.g. trailing usage metadata) are not treated as blocks.
+        """
+        blocked = self._blocked_message(chunk)
+        if not getattr(chunk, 'candidates', None):
+            return "", blocked
+        return self._candidate_text(chunk.candidates[0]) or "", blocked
+
+    def _blocked_message(self, response: Any) -> Optional[str]:
+        """
+        Return the safety-block message for a response or stream chunk, or None if it was not blocked.
+        """
+        if hasattr(response, 'prompt_feedback') and response.prompt_feedback and getattr(response.prompt_feedback, 'block_reason', None):
+            return f"[Blocked due to Prompt Safety: {response.prompt_feedback.block_reason.name}]"
+
+        candidates = getattr(response, 'candidates', None)
+        if not candidates:
+            return None
+        candidate = candidates[0]
         if hasattr(candidate, 'finish_reason') and candidate.finish_reason == 'SAFETY':
             blocking_rating = next(
-                (r for r in getattr(candidate, 'safety_ratings', []) if getattr(r, 'blocked', False)), None
+                (r for r in (getattr(candidate, 'safety_ratings', None) or []) if getattr(r, 'blocked', False)), None
             )
             reason = f" ({blocking_rating.category.name})" if blocking_rating else ""
             return f"[Blocked by safety settings{reason}]"
+        return None
 
+    def _candidate_text(self, candidate: Any) -> Optional[str]:
         if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts') and candidate.content.parts:
             return "".join(
-                part.text for part in candidate.content.parts if hasattr(part, "text")
+                part.text for part in candidate.content.parts if getattr(part, "text", None)
             )
-        else:
-            return "[No content generated or unexpected response structure]"
+        return None
 
 # Example usage:
 # pipeline = GeminiPipeline(input_data)
@@ -0,0 +1,172 @@
+import os
+import json
+import math
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+logging.getLogger(__name__)
+
+# WHY: Every message in chat_messages used to be sent on every turn, so request size, latency and cost grew
+# without bound over a session. History is now fitted into a token budget: the system prompt, the opening
+# exchange (the passage being simplified) and the most recent turns are kept; older turns are dropped or
+# replaced by a short summary.
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 0))  # 0 = off, send the full history
+HISTORY_POLICY = os.getenv("HISTORY_POLICY", "drop").lower()  # drop | summarize
+HISTORY_MIN_RECENT_MESSAGES = int(os.getenv("HISTORY_MIN_RECENT_MESSAGES", 4))
+HISTORY_KEEP_FIRST_EXCHANGE = os.getenv("HISTORY_KEEP_FIRST_EXCHANGE", "true").lower() == "true"
+# Older turns are cut in blocks of this many messages so the cut point (and a summary of what is before it)
+# stays the same for several turns instead of moving every turn.
+HISTORY_DROP_CHUNK = max(1, int(os.getenv("HISTORY_DROP_CHUNK", 6)))
+# `api` asks the count_tokens endpoint once the local estimate reaches HISTORY_COUNT_THRESHOLD of the budget;
+# `local` only uses the chars/4 estimate.
+HISTORY_TOKEN_COUNTER = os.getenv("HISTORY_TOKEN_COUNTER", "api").lower()
+HISTORY_COUNT_THRESHOLD = float(os.getenv("HISTORY_COUNT_THRESHOLD", 0.75))
+HISTORY_SUMMARY_MODEL = os.getenv("HISTORY_SUMMARY_MODEL", "gemini-2.5-flash")
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", 512))
+HISTORY_SUMMARY_TIMEOUT = float(os.getenv("HISTORY_SUMMARY_TIMEOUT", 30))
+
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 258  # Gemini's fixed cost for an image part
+SUMMARY_PROMPT = (
+    "Summarize the earlier part of this tutoring conversation about simplifying a Latin passage in at most "
+    "150 words. Keep the passage details, the instructor's requests and any decisions already made."
+)
+
+_summaries: "OrderedDict[str, str]" = OrderedDict()
+_SUMMARY_CACHE_SIZE = 128
+
+
+def _parts_chars(content: Dict[str, Any]) -> int:
+    chars = 0
+    for part in content.get("parts", []):
+        if "text" in part:
+            chars += len(part["text"] or "")
+        else:
+            chars += IMAGE_TOKENS * CHARS_PER_TOKEN
+    return chars
+
+
+def estimate_tokens(chars: int) -> int:
+    return math.ceil(chars / CHARS_PER_TOKEN)
+
+
+async def count_tokens(
+    client, model_id: str, contents: List[Dict[str, Any]], system_instruction: Optional[str], call=None
+) -> int:
+    """
+    Count input tokens with the SDK. The Gemini API's count endpoint does not take a system instruction,
+    so it is counted as a leading user turn, which is close enough for budgeting. `call(func, **kwargs)`, if
+    given, makes the request (e.g. the pipeline's retry policy and circuit breaker).
+    """
+    to_count = contents
+    if system_instruction:
+        to_count = [{"role": "user", "parts": [{"text": system_instruction}]}] + contents
+    func = client.aio.models.count_tokens
+    if call is not None:
+        response = await call(func, model=model_id, contents=to_count)
+    else:
+        response = await func(model=model_id, contents=to_count)
+    return response.total_tokens
+
+
+def _first_exchange_len(contents: List[Dict[str, Any]]) -> int:
+    # The opening user turn plus the model's first reply
+    if HISTORY_KEEP_FIRST_EXCHANGE and len(contents) >= 2 and contents[0]["role"] == "user" and contents[1]["role"] == "model":
+        return 2
+    return 0
+
+
+def _choose_cut(contents, msg_tokens, head: int, available: float) -> int:
+    """Index of the first message kept after the pinned head, so contents[head:cut] are the ones dropped."""
+    last_user = max((i for i, c in enumerate(contents) if c["role"] == "user"), default=len(contents) - 1)
+    start, used = len(contents), 0.0
+    while start > head and used + msg_tokens[start - 1] <= available:
+        start -= 1
+        used += msg_tokens[start]
+    start = min(start, max(head, len(contents) - HISTORY_MIN_RECENT_MESSAGES))
+    if start <= head:
+        return head
+    cut = head + math.ceil((start - head) / HISTORY_DROP_CHUNK) * HISTORY_DROP_CHUNK
+    cut = min(cut, last_user)
+    # The kept window has to open on a user turn
+    while cut < last_user and contents[cut]["role"] != "user":
+        cut += 1
+    while cut > head and contents[cut]["role"] != "user":
+        cut -= 1
+    return max(cut, head)
+
+
+async def _summarize(client, dropped: List[Dict[str, Any]]) -> Optional[str]:
+    key = hashlib.sha256(json.dumps(dropped, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    if key in _summaries:
+        _summaries.move_to_end(key)
+        return _summaries[key]
+    response = await asyncio.wait_for(
+        client.aio.models.generate_content(
+            model=HISTORY_SUMMARY_MODEL,
+            contents=dropped + [{"role": "user", "parts": [{"text": SUMMARY_PROMPT}]}],
+            config={"temperature": 0.0, "max_output_tokens": HISTORY_SUMMARY_MAX_TOKENS},
+        ),
+        HISTORY_SUMMARY_TIMEOUT,
+    )
+    summary = (getattr(response, "text", None) or "").strip()
+    if not summary:
+        return None
+    _summaries[key] = summary
+    if len(_summaries) > _SUMMARY_CACHE_SIZE:
+        _summaries.popitem(last=False)
+    return summary
+
+
+async def fit_history(
+    client, model_id: str, contents: List[Dict[str, Any]], system_instruction: Optional[str], call=None
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Return (contents to send, stats). stats has the estimated or counted input tokens, where the count came
+    from, how many messages were dropped and whether a summary replaced them. `call` is passed to count_tokens.
+    """
+    system_chars = len(system_instruction) if isinstance(system_instruction, str) else 0
+    msg_chars = [_parts_chars(c) for c in contents]
+    total_chars = system_chars + sum(msg_chars)
+    tokens, source = estimate_tokens(total_chars), "estimate"
+    budget = HISTORY_TOKEN_BUDGET
+
+    if budget and HISTORY_TOKEN_COUNTER == "api" and tokens >= budget * HISTORY_COUNT_THRESHOLD:
+        try:
+            tokens, source = await count_tokens(client, model_id, contents, system_instruction, call=call), "api"
+        except Exception as e:
+            logging.debug(f"count_tokens failed, using the local estimate: {e}")
+
+    stats = {"input_tokens": tokens, "source": source, "budget": budget, "messages": len(contents), "dropped": 0, "summarized": False}
+    if not budget or tokens <= budget:
+        return contents, stats
+
+    # Spread the (possibly counted) total over messages in proportion to their size.
+    tokens_per_char = tokens / max(1, total_chars)
+    msg_tokens = [chars * tokens_per_char for chars in msg_chars]
+    head = _first_exchange_len(contents)
+    reserve = HISTORY_SUMMARY_MAX_TOKENS if HISTORY_POLICY == "summarize" else 0
+    available = budget - system_chars * tokens_per_char - sum(msg_tokens[:head]) - reserve
+    cut = _choose_cut(contents, msg_tokens, head, available)
+    if cut <= head:
+        return contents, stats
+
+    dropped = contents[head:cut]
+    kept = contents[:head] + contents[cut:]
+    stats["dropped"] = len(dropped)
+    if HISTORY_POLICY == "summarize":
+        try:
+            summary = await _summarize(client, dropped)
+        except Exception as e:
+            logging.warning(f"Summarizing {len(dropped)} older messages failed, dropping them instead: {e}")
+            summary = None
+        if summary:
+            first = kept[head]
+            kept[head] = {**first, "parts": [{"text": f"[Summary of the earlier conversation]\n{summary}\n\n"}] + first["parts"]}
+            stats["summarized"] = True
+    stats["input_tokens"] = round(tokens - sum(msg_tokens[head:cut]) + (reserve if stats["summarized"] else 0))
+    stats["source"] = f"{source}, windowed"
+    return kept, stats
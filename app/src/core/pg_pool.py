@@ -0,0 +1,254 @@
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+import logging
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+logging.getLogger(__name__)
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """Raised when no pooled connection becomes available within the checkout timeout."""
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """
+    Thread-safe PostgreSQL connection pool shared by every Streamlit session in the process.
+
+    Connections are handed out LIFO so that a small set stays warm, health checked with
+    `SELECT 1` when they have been idle for a while, and recycled once they exceed max_age.
+    Checkout latency and saturation counters are available from stats().
+    """
+
+    def __init__(self, connect, minconn=1, maxconn=10, max_age=1800.0,
+                 health_check_interval=30.0, checkout_timeout=10.0):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Invalid pool size: minconn={minconn}, maxconn={maxconn}")
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.max_age = max_age
+        self.health_check_interval = health_check_interval
+        self.checkout_timeout = checkout_timeout
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._in_use = {}
+        self._size = 0
+        self._closed = False
+        self._stats = {
+            "checkouts": 0,
+            "checkout_wait_total_ms": 0.0,
+            "checkout_wait_max_ms": 0.0,
+            "saturated_checkouts": 0,
+            "checkout_timeouts": 0,
+            "connections_created": 0,
+            "connections_recycled": 0,
+            "health_check_failures": 0,
+            "peak_in_use": 0,
+        }
+
+        for _ in range(minconn):
+            with self._cond:
+                self._size += 1
+            try:
+                entry = self._open()
+            except psycopg2.Error as e:
+                logging.error(f"Could not prefill connection pool: {e}")
+                break
+            with self._cond:
+                self._idle.append(entry)
+
+    def _open(self):
+        # Callers reserve the slot (self._size += 1) under the lock before opening.
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats["connections_created"] += 1
+        return _PooledConnection(conn)
+
+    def _discard(self, entry):
+        try:
+            entry.conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _is_usable(self, entry):
+        now = time.monotonic()
+        if entry.conn.closed:
+            return False
+        if self.max_age and now - entry.created_at > self.max_age:
+            with self._cond:
+                self._stats["connections_recycled"] += 1
+            return False
+        if self.health_check_interval is not None and now - entry.last_used > self.health_check_interval:
+            try:
+                with entry.conn.cursor() as c:
+                    c.execute("SELECT 1")
+                entry.conn.rollback()
+            except psycopg2.Error as e:
+                logging.warning(f"Discarding pooled connection that failed health check: {e}")
+                with self._cond:
+                    self._stats["health_check_failures"] += 1
+                return False
+        return True
+
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout
+        waited = False
+        while True:
+            entry = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise psycopg2.pool.PoolError("connection pool is closed")
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        break
+                    if not waited:
+                        waited = True
+                        self._stats["saturated_checkouts"] += 1
+                        logging.debug(f"Connection pool saturated ({self._size}/{self.maxconn} in use), waiting")
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["checkout_timeouts"] += 1
+                        raise PoolTimeout(
+                            f"Timed out after {self.checkout_timeout}s waiting for a database connection "
+                            f"(pool size {self.maxconn})"
+                        )
+                    self._cond.wait(remaining)
+
+            if entry is None:
+                entry = self._open()
+            elif not self._is_usable(entry):
+                self._discard(entry)
+                continue
+
+            elapsed_ms = (time.monotonic() - start) * 1000
+            with self._cond:
+                self._in_use[id(entry.conn)] = entry
+                self._stats["checkouts"] += 1
+                self._stats["checkout_wait_total_ms"] += elapsed_ms
+                self._stats["checkout_wait_max_ms"] = max(self._stats["checkout_wait_max_ms"], elapsed_ms)
+                self._stats["peak_in_use"] = max(self._stats["peak_in_use"], len(self._in_use))
+            return entry.conn
+
+    def putconn(self, conn, discard=False):
+        with self._cond:
+            entry = self._in_use.pop(id(conn), None)
+        if entry is None:
+            raise psycopg2.pool.PoolError("trying to put unkeyed connection")
+
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        if discard or conn.closed or self._closed:
+            self._discard(entry)
+            return
+
+        entry.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(entry)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of a with-block and always return it."""
+        conn = self.getconn()
+        try:
+            yield conn
+        except Exception:
+            broken = conn.closed
+            if not broken:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            self.putconn(conn, discard=broken)
+            raise
+        else:
+            self.putconn(conn)
+
+    def stats(self):
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot["size"] = self._size
+            snapshot["idle"] = len(self._idle)
+            snapshot["in_use"] = len(self._in_use)
+            snapshot["maxconn"] = self.maxconn
+        checkouts = snapshot["checkouts"]
+        snapshot["checkout_wait_avg_ms"] = snapshot["checkout_wait_total_ms"] / checkouts if checkouts else 0.0
+        return snapshot
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+        for entry in idle:
+            self._discard(entry)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(connect):
+    """Return the process-wide pool, creating it on first use with settings from DB_POOL_* env vars."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    connect,
+                    minconn=int(os.getenv("DB_POOL_MIN", 1)),
+                    maxconn=int(os.getenv("DB_POOL_MAX", 10)),
+                    max_age=float(os.getenv("DB_POOL_MAX_AGE", 1800)),
+                    health_check_interval=float(os.getenv("DB_POOL_HEALTH_CHECK_INTERVAL", 30)),
+                    checkout_timeout=float(os.getenv("DB_POOL_TIMEOUT", 10)),
+                )
+                logging.debug(f"Created PostgreSQL connection pool (min={_pool.minconn}, max={_pool.maxconn})")
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+atexit.register(close_pool)
@@ -0,0 +1,98 @@
+import os
+import json
+import hashlib
+import fnmatch
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+import logging
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+logging.getLogger(__name__)
+
+PROMPTS_DIR = Path(__file__).parent.parent.parent / "prompts"
+# Rendered prompts kept per (template, mtime, context hash); a handful of levels and contexts in practice.
+MAX_RENDERED_ENTRIES = 256
+
+
+class PromptRegistry:
+    """
+    Loads, compiles and renders the Jinja2 prompt templates in a prompts directory.
+
+    Templates are compiled once (with a bytecode cache on disk shared across processes) and rendered output is
+    memoized per (template, context hash). Both are invalidated when the template file's mtime changes.
+    """
+
+    def __init__(self, prompts_dir=PROMPTS_DIR, bytecode_cache_dir=None):
+        self.prompts_dir = Path(prompts_dir)
+        bytecode_cache_dir = Path(
+            bytecode_cache_dir
+            or os.getenv("PROMPT_BYTECODE_CACHE_DIR")
+            or Path(tempfile.gettempdir()) / "digital-latin-jinja-cache"
+        )
+        bytecode_cache_dir.mkdir(parents=True, exist_ok=True)
+        self.env = Environment(
+            loader=FileSystemLoader(str(self.prompts_dir)),
+            bytecode_cache=FileSystemBytecodeCache(str(bytecode_cache_dir)),
+            auto_reload=True,  # Re-check the file mtime on get_template so edits are picked up
+        )
+        self._lock = threading.Lock()
+        self._rendered = OrderedDict()
+        self._names = None
+
+    def template_names(self):
+        if self._names is None:
+            self._names = sorted(self.env.list_templates())
+        return self._names
+
+    def find(self, pattern):
+        """Return the first template name matching a glob pattern (e.g. "*level1*.jinja*"), or None."""
+        return next((name for name in self.template_names() if fnmatch.fnmatch(name, pattern)), None)
+
+    def path(self, name):
+        return self.prompts_dir / name
+
+    def version(self, name):
+        """Short content hash identifying the current revision of a template."""
+        return hashlib.sha256(self.path(name).read_bytes()).hexdigest()[:12]
+
+    def precompile(self, names=None):
+        for name in names or self.template_names():
+            self.env.get_template(name)
+        logging.debug(f"Precompiled prompt templates: {names or self.template_names()}")
+
+    def render(self, name, context=None):
+        context = context or {}
+        mtime = os.stat(self.path(name)).st_mtime_ns
+        context_hash = hashlib.sha256(json.dumps(context, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        key = (name, mtime, context_hash)
+        with self._lock:
+            rendered = self._rendered.get(key)
+            if rendered is not None:
+                self._rendered.move_to_end(key)
+                return rendered
+
+        rendered = self.env.get_template(name).render(context)
+        with self._lock:
+            self._rendered[key] = rendered
+            while len(self._rendered) > MAX_RENDERED_ENTRIES:
+                self._rendered.popitem(last=False)
+        return rendered
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Return the process-wide registry for app/prompts, precompiling every template on first use."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                registry = PromptRegistry()
+                registry.precompile()
+                _registry = registry
+    return _registry
@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+import logging
+
+logging.getLogger(__name__)
+
+# WHY: Instructors often simplify the same canonical passages at the same level. With the cache enabled
+# (GEMINI_RESPONSE_CACHE=local|postgres), an identical request is answered from storage in milliseconds
+# instead of a full gemini-2.5-pro generation.
+CACHE_BACKEND = os.getenv("GEMINI_RESPONSE_CACHE", "off").lower()
+CACHE_TTL = float(os.getenv("GEMINI_RESPONSE_CACHE_TTL", 7 * 24 * 3600))
+CACHE_MAX_ENTRIES = int(os.getenv("GEMINI_RESPONSE_CACHE_MAX_ENTRIES", 5000))
+CACHE_PATH = Path(
+    os.getenv("GEMINI_RESPONSE_CACHE_PATH")
+    or Path(__file__).parent.parent.parent / "data" / "response_cache.db"
+)
+# Sampled (temperature > 0) requests are cached too unless this is set, since instructors usually want the
+# same answer for the same passage; set it to always generate a fresh sample. It is opt-in because the chat
+# UI never sends a temperature (the pipeline defaults it to 0.7), so skipping by default disabled the cache.
+SKIP_SAMPLED = os.getenv("GEMINI_RESPONSE_CACHE_SKIP_SAMPLED", "false").lower() == "true"
+
+
+def cache_key(model_id, contents, gen_config):
+    """
+    Hash of everything that determines the response: model, system prompt (part of gen_config, so a new
+    prompt version is a new key), conversation contents and generation settings.
+    """
+    payload = json.dumps(
+        {"model": model_id, "contents": contents, "config": gen_config},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "errors": 0}
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = dict(self._counters)
+        lookups = snapshot["hits"] + snapshot["misses"]
+        snapshot["hit_rate"] = snapshot["hits"] / lookups if lookups else 0.0
+        return snapshot
+
+
+class LocalResponseCache:
+    """
+    SQLite-backed cache on local disk with TTL expiry and LRU eviction beyond max_entries.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = _CacheStats()
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._conn()
+        conn.execute('''CREATE TABLE IF NOT EXISTS response_cache (
+            key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )''')
+        conn.execute('CREATE INDEX IF NOT EXISTS response_cache_last_access_idx ON response_cache (last_access)')
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute('SELECT response, expires_at FROM response_cache WHERE key=?', (key,)).fetchone()
+        if row is None or row[1] < now:
+            if row is not None:
+                conn.execute('DELETE FROM response_cache WHERE key=?', (key,))
+                conn.commit()
+            self.stats.incr("misses")
+            return None
+        conn.execute('UPDATE response_cache SET last_access=? WHERE key=?', (now, key))
+        conn.commit()
+        self.stats.incr("hits")
+        return row[0]
+
+    def put(self, key, response):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            'INSERT OR REPLACE INTO response_cache (key, response, expires_at, last_access) VALUES (?, ?, ?, ?)',
+            (key, response, now + self.ttl, now),
+        )
+        conn.execute('DELETE FROM response_cache WHERE expires_at < ?', (now,))
+        evicted = conn.execute(
+            'DELETE FROM response_cache WHERE key IN ('
+            '  SELECT key FROM response_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,),
+        ).rowcount
+        conn.commit()
+        self.stats.incr("stores")
+        if evicted > 0:
+            self.stats.incr("evictions", evicted)
+
+
+class PostgresResponseCache:
+    """
+    Cache shared by every app process, stored in the response_cache table (see schema_migrations).
+    """
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        import session_db_postgres  # Only needed when this backend is selected
+        import schema_migrations
+        self._db = session_db_postgres
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = _CacheStats()
+        # Only the cache's own table: the session tables may live elsewhere (e.g. SESSION_DB_BACKEND=sqlite)
+        with self._db.pooled_conn() as conn:
+            c = conn.cursor()
+            for statement in schema_migrations.RESPONSE_CACHE_DDL:
+                c.execute(statement)
+            conn.commit()
+
+    def get(self, key):
+        with self._db.pooled_conn() as conn:
+            c = conn.cursor()
+            c.execute(
+                'UPDATE response_cache SET last_access=now() WHERE key=%s AND expires_at > now() RETURNING response',
+                (key,),
+            )
+            row = c.fetchone()
+            conn.commit()
+        self.stats.incr("hits" if row else "misses")
+        return row[0] if row else None
+
+    def put(self, key, response):
+        with self._db.pooled_conn() as conn:
+            c = conn.cursor()
+            c.execute(
+                '''INSERT INTO response_cache (key, response, expires_at, last_access)
+                   VALUES (%s, %s, now() + make_interval(secs => %s), now())
+                   ON CONFLICT (key) DO UPDATE
+                   SET response=EXCLUDED.response, expires_at=EXCLUDED.expires_at, last_access=EXCLUDED.last_access''',
+                (key, response, self.ttl),
+            )
+            c.execute('DELETE FROM response_cache WHERE expires_at < now()')
+            c.execute(
+                '''DELETE FROM response_cache WHERE key IN (
+                       SELECT key FROM response_cache ORDER BY last_access DESC OFFSET %s)''',
+                (self.max_entries,),
+            )
+            evicted = c.rowcount
+            conn.commit()
+        self.stats.incr("stores")
+        if evicted > 0:
+            self.stats.incr("evictions", evicted)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Return the process-wide cache for GEMINI_RESPONSE_CACHE, or None when caching is off."""
+    global _cache
+    if CACHE_BACKEND in ("", "off", "false", "none"):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                if CACHE_BACKEND == "postgres":
+                    _cache = PostgresResponseCache()
+                elif CACHE_BACKEND == "local":
+                    _cache = LocalResponseCache()
+                else:
+                    raise ValueError(f"Unknown GEMINI_RESPONSE_CACHE backend: {CACHE_BACKEND!r}")
+                logging.debug(f"Using {CACHE_BACKEND} Gemini response cache")
+    return _cache
@@ -0,0 +1,249 @@
+import os
+import time
+import random
+import asyncio
+import inspect
+import threading
+import logging
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+from google.genai.errors import APIError
+
+logging.getLogger(__name__)
+
+# WHY: 429 (rate limited), 408 and the 5xx gateway statuses are transient; other 4xx errors will fail again.
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# Failures that mean the gateway itself is unhealthy and should count towards opening the circuit.
+CIRCUIT_STATUS_CODES = {500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the API while the circuit breaker is open."""
+
+    def __init__(self, retry_in: float):
+        self.retry_in = retry_in
+        super().__init__(f"Gemini gateway circuit is open; retry in {retry_in:.0f}s")
+
+
+class RetryPolicy:
+    """
+    Deadlines and backoff settings for calls to the Gemini gateway.
+    """
+
+    def __init__(self, max_attempts=3, attempt_timeout=120.0, total_timeout=300.0,
+                 backoff_base=1.0, backoff_max=20.0):
+        self.max_attempts = max(1, max_attempts)
+        self.attempt_timeout = attempt_timeout
+        self.total_timeout = total_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_attempts=int(os.getenv("GEMINI_MAX_ATTEMPTS", 3)),
+            attempt_timeout=float(os.getenv("GEMINI_ATTEMPT_TIMEOUT", 120)),
+            total_timeout=float(os.getenv("GEMINI_TOTAL_TIMEOUT", 300)),
+            backoff_base=float(os.getenv("GEMINI_BACKOFF_BASE", 1)),
+            backoff_max=float(os.getenv("GEMINI_BACKOFF_MAX", 20)),
+        )
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff before retry number `attempt` (1-based)."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1))))
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive gateway failures and rejects calls for `reset_timeout`
+    seconds, then lets a single trial call through (half-open) to decide whether to close again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            failure_threshold=int(os.getenv("GEMINI_CIRCUIT_FAILURE_THRESHOLD", 5)),
+            reset_timeout=float(os.getenv("GEMINI_CIRCUIT_RESET_TIMEOUT", 30)),
+        )
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return "open"
+            return "half_open"
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            elapsed = time.monotonic() - self._opened_at
+            if elapsed < self.reset_timeout:
+                raise CircuitOpenError(self.reset_timeout - elapsed)
+            if self._trial_in_flight:
+                raise CircuitOpenError(0)
+            self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._trial_in_flight:
+                    logging.warning(f"Opening Gemini circuit breaker after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        # A non-gateway failure (e.g. a 400) says nothing about gateway health; let the next call try again.
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class RetryMetrics:
+    """
+    Process-wide counters for calls made through call_with_retry.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {
+            "calls": 0,
+            "attempts": 0,
+            "retries": 0,
+            "attempt_timeouts": 0,
+            "stream_timeouts": 0,
+            "failures": 0,
+            "circuit_rejections": 0,
+            "backoff_wait_seconds": 0.0,
+        }
+
+    def incr(self, name: str, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._counters)
+
+
+def status_code(e: BaseException) -> Optional[int]:
+    return getattr(e, "code", None) if isinstance(e, APIError) else None
+
+
+def is_retryable(e: BaseException) -> bool:
+    if isinstance(e, APIError):
+        return status_code(e) in RETRYABLE_STATUS_CODES
+    return isinstance(e, (asyncio.TimeoutError, httpx.TimeoutException, httpx.TransportError, ConnectionError))
+
+
+def counts_against_circuit(e: BaseException) -> bool:
+    if isinstance(e, APIError):
+        return status_code(e) in CIRCUIT_STATUS_CODES
+    return is_retryable(e)
+
+
+def retry_after(e: BaseException) -> Optional[float]:
+    """
+    Seconds the server asked us to wait, from a Retry-After header or a google.rpc.RetryInfo detail.
+    """
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    value = headers.get("retry-after") if headers is not None else None
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    details = getattr(e, "details", None)
+    if isinstance(details, dict):
+        for detail in (details.get("error") or {}).get("details") or []:
+            delay = detail.get("retryDelay") if isinstance(detail, dict) else None
+            if isinstance(delay, str) and delay.endswith("s"):
+                try:
+                    return max(0.0, float(delay[:-1]))
+                except ValueError:
+                    pass
+    return None
+
+
+async def call_with_retry(func: Callable, *args, policy: RetryPolicy, breaker: CircuitBreaker,
+                          metrics: RetryMetrics, **kwargs):
+    """
+    Call `func` (sync or async) under `policy`, retrying transient failures with jittered backoff
+    and failing fast with CircuitOpenError while `breaker` is open.
+    """
+    metrics.incr("calls")
+    deadline = time.monotonic() + policy.total_timeout
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            breaker.before_call()
+        except CircuitOpenError:
+            metrics.incr("circuit_rejections")
+            raise
+
+        remaining = deadline - time.monotonic()
+        timeout = min(policy.attempt_timeout, remaining)
+        metrics.incr("attempts")
+        try:
+            if inspect.iscoroutinefunction(func):
+                result = await asyncio.wait_for(func(*args, **kwargs), timeout=timeout)
+            else:
+                result = await asyncio.wait_for(asyncio.to_thread(func, *args, **kwargs), timeout=timeout)
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                metrics.incr("attempt_timeouts")
+            if counts_against_circuit(e):
+                breaker.record_failure()
+            else:
+                breaker.release_trial()
+
+            if not is_retryable(e) or attempt >= policy.max_attempts:
+                metrics.incr("failures")
+                raise
+
+            delay = policy.backoff(attempt)
+            server_delay = retry_after(e)
+            if server_delay is not None:
+                delay = max(delay, server_delay)
+            if time.monotonic() + delay >= deadline:
+                logging.warning(f"Not retrying {getattr(func, '__name__', func)}: backoff of {delay:.1f}s would pass the overall deadline")
+                metrics.incr("failures")
+                raise
+
+            logging.warning(f"Attempt {attempt} of {policy.max_attempts} failed ({type(e).__name__}: {e}); retrying in {delay:.1f}s")
+            metrics.incr("retries")
+            metrics.incr("backoff_wait_seconds", delay)
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            # Cancelled (e.g. the rerun was cut short) or interrupted: not a gateway failure, but a half-open
+            # trial must not stay claimed or the breaker would reject every call from then on.
+            breaker.release_trial()
+            raise
+
+        breaker.record_success()
+        return result
@@ -0,0 +1,115 @@
+import logging
+
+logging.getLogger(__name__)
+
+# Arbitrary key for pg_advisory_xact_lock so concurrent app processes don't apply the same migration twice.
+MIGRATION_LOCK_KEY = 74110119
+
+# Also run on its own by response_cache.PostgresResponseCache, which doesn't need the session tables
+RESPONSE_CACHE_DDL = [
+    '''CREATE TABLE IF NOT EXISTS response_cache (
+        key TEXT PRIMARY KEY,
+        response TEXT NOT NULL,
+        expires_at TIMESTAMPTZ NOT NULL,
+        last_access TIMESTAMPTZ NOT NULL
+    )''',
+    '''CREATE INDEX IF NOT EXISTS response_cache_last_access_idx ON response_cache (last_access DESC)''',
+    '''CREATE INDEX IF NOT EXISTS response_cache_expires_at_idx ON response_cache (expires_at)''',
+]
+
+# WHY: Schema changes are applied once, in order, and recorded in schema_migrations. Every step stays safe
+# on databases that were created by the old CREATE TABLE IF NOT EXISTS bootstrap code.
+MIGRATIONS = [
+    (1, "sessions and messages tables", [
+        '''CREATE TABLE IF NOT EXISTS sessions (
+            id SERIAL PRIMARY KEY,
+            name TEXT,
+            data TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            end_reason TEXT
+        )''',
+        # If upgrading from old schema, add columns if missing
+        '''ALTER TABLE sessions ADD COLUMN IF NOT EXISTS created_at TEXT''',
+        '''ALTER TABLE sessions ADD COLUMN IF NOT EXISTS updated_at TEXT''',
+        '''ALTER TABLE sessions ADD COLUMN IF NOT EXISTS end_reason TEXT''',
+        '''CREATE TABLE IF NOT EXISTS messages (
+            id SERIAL PRIMARY KEY,
+            session_id INTEGER REFERENCES sessions(id) ON DELETE CASCADE,
+            role TEXT,
+            content TEXT,
+            timestamp TEXT,
+            time_delta REAL
+        )''',
+    ]),
+    (2, "timestamptz/jsonb columns and lookup indexes", [
+        # Timestamps written without an offset are interpreted in the server's TimeZone (UTC on RDS).
+        '''DO $$
+        BEGIN
+            IF (SELECT data_type FROM information_schema.columns WHERE table_name='sessions' AND column_name='created_at') = 'text' THEN
+                ALTER TABLE sessions ALTER COLUMN created_at TYPE timestamptz USING NULLIF(created_at, '')::timestamptz;
+            END IF;
+            IF (SELECT data_type FROM information_schema.columns WHERE table_name='sessions' AND column_name='updated_at') = 'text' THEN
+                ALTER TABLE sessions ALTER COLUMN updated_at TYPE timestamptz USING NULLIF(updated_at, '')::timestamptz;
+            END IF;
+            IF (SELECT data_type FROM information_schema.columns WHERE table_name='sessions' AND column_name='data') = 'text' THEN
+                ALTER TABLE sessions ALTER COLUMN data TYPE jsonb USING NULLIF(data, '')::jsonb;
+            END IF;
+            IF (SELECT data_type FROM information_schema.columns WHERE table_name='messages' AND column_name='timestamp') = 'text' THEN
+                ALTER TABLE messages ALTER COLUMN timestamp TYPE timestamptz USING NULLIF(timestamp, '')::timestamptz;
+            END IF;
+        END$$''',
+        # list_sessions: ORDER BY updated_at DESC
+        '''CREATE INDEX IF NOT EXISTS sessions_updated_at_idx ON sessions (updated_at DESC)''',
+        # log_message's previous-message lookup and get_session_messages' ordered history
+        '''CREATE INDEX IF NOT EXISTS messages_session_id_id_idx ON messages (session_id, id)''',
+        '''ANALYZE sessions''',
+        '''ANALYZE messages''',
+    ]),
+    (3, "shared Gemini response cache", RESPONSE_CACHE_DDL),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    c = conn.cursor()
+    c.execute("SELECT to_regclass('schema_migrations')")
+    if c.fetchone()[0] is None:
+        conn.rollback()
+        return 0
+    c.execute('SELECT COALESCE(MAX(version), 0) FROM schema_migrations')
+    version = c.fetchone()[0]
+    conn.rollback()
+    return version
+
+
+def migrate(conn):
+    """
+    Apply every pending migration, each in its own transaction. Returns the resulting schema version.
+    """
+    version = current_version(conn)
+    if version >= LATEST_VERSION:
+        return version
+
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )''')
+    conn.commit()
+
+    for migration_version, description, statements in MIGRATIONS:
+        c.execute('SELECT pg_advisory_xact_lock(%s)', (MIGRATION_LOCK_KEY,))
+        c.execute('SELECT 1 FROM schema_migrations WHERE version=%s', (migration_version,))
+        if c.fetchone():
+            conn.commit()
+            continue
+        logging.info(f"Applying schema migration {migration_version}: {description}")
+        for statement in statements:
+            c.execute(statement)
+        c.execute('INSERT INTO schema_migrations (version, description) VALUES (%s, %s)', (migration_version, description))
+        conn.commit()
+        version = migration_version
+    return max(version, current_version(conn))
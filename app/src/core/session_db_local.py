@@ -0,0 +1,197 @@
+import os
+import re
+import json
+import uuid
+import shutil
+import threading
+from datetime import datetime
+from pathlib import Path
+import logging
+
+logging.getLogger(__name__)
+
+# WHY: DB-less deployments (SKIP_DB=true) need a real store. Each session gets its own directory holding the
+# session row and an append-only messages file, and an append-only index of session rows is replayed into
+# memory once per process. Lookups and appends touch a single session's files instead of scanning a shared log.
+# Every save appends to the index, so once it holds more than twice as many lines as live sessions (and at least
+# SESSION_LOCAL_INDEX_COMPACT_MIN lines) it is rewritten with one line per session.
+LOCAL_STORE_DIR = Path(
+    os.getenv("SESSION_LOCAL_STORE_DIR")
+    or Path(__file__).parent.parent.parent / "data" / "sessions" / "local"
+)
+INDEX_FILE = "index.jsonl"
+SESSION_FILE = "session.json"
+MESSAGES_FILE = "messages.jsonl"
+INDEX_COMPACT_MIN_LINES = int(os.getenv("SESSION_LOCAL_INDEX_COMPACT_MIN", 1000))
+
+_SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]+$")
+_lock = threading.RLock()
+_index = None  # session_id -> {"id", "name", "created_at", "updated_at"}
+_index_lines = 0  # Lines in index.jsonl, live or superseded
+_last_message = {}  # session_id -> (last message id, last timestamp)
+
+
+def _session_dir(session_id):
+    session_id = str(session_id)
+    if not _SESSION_ID_RE.match(session_id):
+        raise ValueError(f"Invalid local session id: {session_id!r}")
+    return LOCAL_STORE_DIR / session_id
+
+
+def _append_json(path, obj):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(obj, default=str) + "\n")
+
+
+def _load_index():
+    global _index, _index_lines
+    if _index is None:
+        index, lines = {}, 0
+        index_path = LOCAL_STORE_DIR / INDEX_FILE
+        if index_path.exists():
+            with open(index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get("deleted"):
+                        index.pop(entry["id"], None)
+                    else:
+                        index[entry["id"]] = entry
+        _index, _index_lines = index, lines
+    return _index
+
+
+def _append_index(entry):
+    # Callers hold _lock and have loaded the index
+    global _index_lines
+    _append_json(LOCAL_STORE_DIR / INDEX_FILE, entry)
+    _index_lines += 1
+    if _index_lines > max(INDEX_COMPACT_MIN_LINES, 2 * len(_index)):
+        _compact_index()
+
+
+def _compact_index():
+    global _index_lines
+    index_path = LOCAL_STORE_DIR / INDEX_FILE
+    tmp_path = index_path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for entry in _index.values():
+            f.write(json.dumps(entry, default=str) + "\n")
+    os.replace(tmp_path, index_path)  # Readers see the old index or the new one, never a partial file
+    _index_lines = len(_index)
+
+
+def ensure_sessions_table():
+    LOCAL_STORE_DIR.mkdir(parents=True, exist_ok=True)
+
+
+def save_session(session_name, session_data=None, session_db_id=None, end_reason=None):
+    now = datetime.now().isoformat()
+    if end_reason is None:
+        end_reason = "not captured"
+    with _lock:
+        ensure_sessions_table()
+        index = _load_index()
+        if session_db_id is None:
+            session_db_id = str(uuid.uuid4())
+        session_db_id = str(session_db_id)
+        session_dir = _session_dir(session_db_id)
+        session_dir.mkdir(exist_ok=True)
+
+        session_path = session_dir / SESSION_FILE
+        row = {}
+        if session_path.exists():
+            row = json.loads(session_path.read_text(encoding="utf-8"))
+        row.update({
+            "id": session_db_id,
+            "name": session_name,
+            "created_at": row.get("created_at", now),
+            "updated_at": now,
+            "end_reason": end_reason,
+        })
+        if session_data is not None:  # Shallow merge, like the jsonb || patch in the Postgres UPDATE
+            row["data"] = {**(row.get("data") or {}), **session_data}
+        tmp_path = session_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(row, default=str), encoding="utf-8")
+        os.replace(tmp_path, session_path)
+
+        entry = {"id": session_db_id, "name": session_name, "created_at": row["created_at"], "updated_at": now}
+        index[session_db_id] = entry
+        _append_index(entry)
+    return session_db_id
+
+
+def _last_message_for(session_id):
+    if session_id not in _last_message:
+        last = (0, None)
+        messages_path = _session_dir(session_id) / MESSAGES_FILE
+        if messages_path.exists():
+            # Only the first append to a session after a restart pays for this read.
+            with open(messages_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    last = tuple(json.loads(line)[k] for k in ("id", "timestamp"))
+        _last_message[session_id] = last
+    return _last_message[session_id]
+
+
+def log_message(session_id, role, content):
+    now = datetime.now().isoformat()
+    with _lock:
+        session_id = str(session_id)
+        session_dir = _session_dir(session_id)
+        session_dir.mkdir(parents=True, exist_ok=True)
+        last_id, last_ts = _last_message_for(session_id)
+        delta = None
+        if last_ts:
+            delta = (datetime.fromisoformat(now) - datetime.fromisoformat(last_ts)).total_seconds()
+        message_id = last_id + 1
+        _append_json(session_dir / MESSAGES_FILE, {
+            "id": message_id,
+            "role": role,
+            "content": content,
+            "timestamp": now,
+            "time_delta": delta,
+        })
+        _last_message[session_id] = (message_id, now)
+    return message_id, now, delta
+
+
+def get_session_messages(session_id):
+    messages_path = _session_dir(session_id) / MESSAGES_FILE
+    if not messages_path.exists():
+        return []
+    messages = []
+    with open(messages_path, "r", encoding="utf-8") as f:
+        for line in f:
+            msg = json.loads(line)
+            messages.append((msg["id"], msg["role"], msg["content"], msg["timestamp"], msg["time_delta"]))
+    return messages
+
+
+def list_sessions():
+    with _lock:
+        entries = list(_load_index().values())
+    entries.sort(key=lambda e: e.get("updated_at") or "", reverse=True)
+    return [(e["id"], e["name"], e["created_at"], e["updated_at"]) for e in entries]
+
+
+def load_session(session_id):
+    session_path = _session_dir(session_id) / SESSION_FILE
+    if not session_path.exists():
+        return None
+    return json.loads(session_path.read_text(encoding="utf-8")).get("data")
+
+
+def delete_session(session_id):
+    with _lock:
+        session_id = str(session_id)
+        session_dir = _session_dir(session_id)
+        if session_dir.exists():
+            shutil.rmtree(session_dir)
+        _load_index().pop(session_id, None)
+        _last_message.pop(session_id, None)
+        ensure_sessions_table()
+        _append_index({"id": session_id, "deleted": True})
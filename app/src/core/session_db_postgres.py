@@ -1,13 +1,20 @@
 import psycopg2
+import psycopg2.extras
 import json
 import os
 import uuid
 from datetime import datetime
-from pathlib import Path
 import logging
+import pg_pool
+import session_db_local
+import session_event_log
+import schema_migrations
 
 logging.getLogger(__name__)
 
+# Connection-level failures the writer retries (see session_store)
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
 def get_conn():
     # Connection info from environment variables (fail early if not set)
     try:
@@ -35,131 +42,131 @@ def get_conn():
         logging.error(f"Error connecting to PostgreSQL: {e}")
         raise
 
-def ensure_sessions_table():
-    conn = get_conn()
-    c = conn.cursor()
-    # Add created_at, updated_at, and end_reason columns
-    c.execute('''CREATE TABLE IF NOT EXISTS sessions (
-        id SERIAL PRIMARY KEY,
-        name TEXT,
-        data TEXT,
-        created_at TEXT,
-        updated_at TEXT,
-        end_reason TEXT
-    )''')
-    # If upgrading from old schema, add columns if missing
-    c.execute("""
-        DO $$
-        BEGIN
-            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='sessions' AND column_name='created_at') THEN
-                ALTER TABLE sessions ADD COLUMN created_at TEXT;
-            END IF;
-            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='sessions' AND column_name='updated_at') THEN
-                ALTER TABLE sessions ADD COLUMN updated_at TEXT;
-            END IF;
-            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='sessions' AND column_name='end_reason') THEN
-                ALTER TABLE sessions ADD COLUMN end_reason TEXT;
-            END IF;
-        END$$;
-    """)
-    conn.commit()  # Ensure sessions table is committed before creating messages table
-    ensure_messages_table()
-    conn.close()
-
-def ensure_messages_table():
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS messages (
-        id SERIAL PRIMARY KEY,
-        session_id INTEGER REFERENCES sessions(id) ON DELETE CASCADE,
-        role TEXT,
-        content TEXT,
-        timestamp TEXT,
-        time_delta REAL
-    )''')
-    conn.commit()
-    conn.close()
+def pooled_conn():
+    # WHY: Every call used to open (and close) its own connection, paying a TCP+auth handshake to RDS each time.
+    # The pool is process-wide, so all Streamlit sessions share the same warm connections.
+    return pg_pool.get_pool(get_conn).connection()
+
+def pool_stats():
+    # Checkout latency and saturation counters, useful for sizing DB_POOL_MAX under classroom load.
+    return pg_pool.get_pool(get_conn).stats()
+
+_schema_version = None
+
+def ensure_sessions_table(skip_db=False):
+    # WHY: Schema changes live in schema_migrations as numbered steps (typed timestamptz/jsonb columns, indexes)
+    # so existing databases are upgraded once instead of re-running ad hoc DDL.
+    global _schema_version
+    if skip_db:
+        session_db_local.ensure_sessions_table()
+        return
+    if _schema_version == schema_migrations.LATEST_VERSION:
+        return  # Already checked by this process
+    with pooled_conn() as conn:
+        _schema_version = schema_migrations.migrate(conn)
+    logging.debug(f"Session schema at version {_schema_version}")
+
+def ensure_messages_table(skip_db=False):
+    # The messages table is created by the same migrations as the sessions table.
+    ensure_sessions_table(skip_db=skip_db)
+
+UPDATE_SESSION_SQL = "UPDATE sessions SET name=%s, data=COALESCE(data, '{}'::jsonb) || COALESCE(%s::jsonb, '{}'::jsonb), updated_at=%s, end_reason=%s WHERE id=%s"
 
 def save_session(session_name, session_data=None, session_db_id=None, end_reason=None, skip_db=False):
     session_id_type = None
-    now = datetime.now().isoformat()
+    now = datetime.now().astimezone().isoformat()  # With UTC offset, for the timestamptz columns
     session_data_json = json.dumps(session_data) if session_data is not None else None
 
     # Default end_reason if not provided
     if end_reason is None:
         end_reason = "not captured"
 
-    # TODO: Add feature toggle or config option to disable this
-    # if skip_db is True, then skip saving to the database
-    if skip_db and session_db_id is None:
-        session_db_id = str(uuid.uuid4())
-        session_id_type = "uuid"
-
-    if not skip_db:
+    # if skip_db is True, save to the local file-backed store instead of the database
+    if skip_db:
+        logging.debug("Skipping database save for session, saving to local store")
+        if session_db_id is None:
+            session_id_type = "uuid"
+        session_db_id = session_db_local.save_session(session_name, session_data, session_db_id=session_db_id, end_reason=end_reason)
+    else:
         logging.debug("Saving session to database")
         try:
-            conn = get_conn()
-            c = conn.cursor()
-
-            if session_db_id:
-                c.execute('UPDATE sessions SET name=%s, data=COALESCE(%s, data), updated_at=%s, end_reason=%s WHERE id=%s',
-                        (session_name, session_data_json, now, end_reason, session_db_id))
-            else:
-                # Always insert a new session, do not check for existing by name
-                c.execute('INSERT INTO sessions (name, data, created_at, updated_at, end_reason) VALUES (%s, %s, %s, %s, %s) RETURNING id',
-                        (session_name, session_data_json, now, now, end_reason))
-                session_db_id = c.fetchone()[0]
-            conn.commit()
-            conn.close()    
+            with pooled_conn() as conn:
+                c = conn.cursor()
+
+                if session_db_id:
+                    # session_data is a patch (see session_snapshot.build_snapshot), merged into the stored jsonb
+                    # so the cost of a save does not grow with the session.
+                    c.execute(UPDATE_SESSION_SQL, (session_name, session_data_json, now, end_reason, session_db_id))
+                else:
+                    # Always insert a new session, do not check for existing by name
+                    c.execute('INSERT INTO sessions (name, data, created_at, updated_at, end_reason) VALUES (%s, %s::jsonb, %s, %s, %s) RETURNING id',
+                            (session_name, session_data_json, now, now, end_reason))
+                    session_db_id = c.fetchone()[0]
+                conn.commit()
             session_id_type = "db"  # Use "id" for SERIAL primary key
         except (psycopg2.DataError, psycopg2.DatabaseError) as e:
             logging.error(f"Failed to save session: {e}")
             session_db_id = uuid.uuid4() if session_db_id is None else session_db_id
-    else:
-        logging.debug("Skipping database save for session")
-    
-    # --- TEMPORARY: Write session data to a file for PostgreSQL debugging ---
-    # This is for development/debugging only. Remove before production.
-    from pathlib import Path
-    debug_file = Path(__file__).parent.parent.parent / "data" / "sessions" / "postgres_debug_session_write.jsonl"
-    session_json = {
-        "session_id": session_db_id,
-        "session_id_type": session_id_type,
-        "name": session_name,
-        "updated_at": now,
-        "data": session_data_json,
-        "end_reason": end_reason
-    }
-    with open(debug_file, "a") as f:
-        f.write(json.dumps(session_json) + "\n")
-    # --- END TEMPORARY ---
+
+    # Append-only event record (disable with SESSION_EVENT_LOG=false)
+    session_event_log.record(
+        "session",
+        session_id=session_db_id,
+        session_id_type=session_id_type,
+        name=session_name,
+        updated_at=now,
+        data=session_data_json,
+        end_reason=end_reason,
+    )
     # Return the session ID, which will be None if not saved to DB
     return session_db_id
 
-def list_sessions():
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute('SELECT id, name, created_at, updated_at FROM sessions ORDER BY updated_at DESC')
-    sessions = c.fetchall()
-    conn.close()
+def list_sessions(skip_db=False):
+    if skip_db:
+        return session_db_local.list_sessions()
+    with pooled_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT id, name, created_at, updated_at FROM sessions ORDER BY updated_at DESC')
+        sessions = c.fetchall()
     return sessions
 
-def load_session(session_id):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute('SELECT data FROM sessions WHERE id=%s', (session_id,))
-    row = c.fetchone()
-    conn.close()
-    if row:
-        return json.loads(row[0])
-    return None
-
-def delete_session(session_id):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute('DELETE FROM sessions WHERE id=%s', (session_id,))
-    conn.commit()
-    conn.close()
+def load_session_data(session_id):
+    # The stored snapshot; session_store.load_session adds the chat history
+    with pooled_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT data FROM sessions WHERE id=%s', (session_id,))
+        row = c.fetchone()
+    if not row or row[0] is None:
+        return None
+    # jsonb columns come back already decoded
+    return json.loads(row[0]) if isinstance(row[0], str) else row[0]
+
+def load_session(session_id, skip_db=False):
+    # Kept for callers of this module: the store's load_session sees queued writes and adds the chat history
+    import session_store
+    return session_store.get_store("postgres").load_session(session_id, skip_db=skip_db)
+
+def delete_session(session_id, skip_db=False):
+    if skip_db:
+        session_db_local.delete_session(session_id)
+        return
+    with pooled_conn() as conn:
+        c = conn.cursor()
+        c.execute('DELETE FROM sessions WHERE id=%s', (session_id,))
+        conn.commit()
+
+INSERT_MESSAGE_SQL = '''
+    INSERT INTO messages (session_id, role, content, timestamp, time_delta)
+    VALUES (
+        %(session_id)s, %(role)s, %(content)s, %(timestamp)s,
+        (SELECT EXTRACT(EPOCH FROM (%(timestamp)s::timestamptz - prev.timestamp::timestamptz))
+           FROM messages prev
+          WHERE prev.session_id = %(session_id)s
+          ORDER BY prev.id DESC
+          LIMIT 1)
+    )
+    RETURNING id, time_delta
+'''
 
 # Helper to log a message with timestamp and time delta
 def log_message(session_id, role, content, skip_db=False):
@@ -167,80 +174,63 @@ def log_message(session_id, role, content, skip_db=False):
     if session_id is None:
         raise RuntimeError("System error: log_message called without a valid session_id.")
     
-    now = datetime.now().isoformat()
+    now = datetime.now().astimezone().isoformat()
     delta = None  # Default to None if no previous message exists
 
     if not skip_db:
         try:
             logging.debug("Logging message to database")
-            conn = get_conn()
-            c = conn.cursor()
-            now = datetime.now().isoformat()
-            # Get last message timestamp for this session
-            c.execute('SELECT timestamp FROM messages WHERE session_id=%s ORDER BY id DESC LIMIT 1', (session_id,))
-            row = c.fetchone()
-            if row:
-                last_ts = datetime.fromisoformat(row[0])
-                delta = (datetime.fromisoformat(now) - last_ts).total_seconds()
-            c.execute(
-                'INSERT INTO messages (session_id, role, content, timestamp, time_delta) VALUES (%s, %s, %s, %s, %s) RETURNING id',
-                (session_id, role, content, now, delta)
-            )
-            new_message_id = c.fetchone()[0]
-            conn.commit()
-            conn.close()
+            with pooled_conn() as conn:
+                c = conn.cursor()
+                # WHY: time_delta is computed from the previous message inside the INSERT, so logging a message is
+                # one round trip. The (session_id, id) index turns the previous-message lookup into an index probe.
+                c.execute(INSERT_MESSAGE_SQL, {
+                    "session_id": session_id,
+                    "role": role,
+                    "content": content,
+                    "timestamp": now,
+                })
+                new_message_id, delta = c.fetchone()
+                conn.commit()
             message_id_type = "db"
         except (psycopg2.DataError, psycopg2.DatabaseError) as e:
             logging.error(f"Failed to log message to database: {e}")
             new_message_id = str(uuid.uuid4())
             message_id_type = "uuid"
     else:
-        logging.debug("Skipping database log for message")
-        new_message_id = str(uuid.uuid4())
-        message_id_type = "uuid"
-
-    # --- Write all messages for this session to the debug JSON file ---
-    debug_file = Path(__file__).parent.parent.parent / "data" / "sessions" / "postgres_debug_session_write.jsonl"
-    messages = get_session_messages(session_id, skip_db=skip_db)
-    messages_list = []
-    for msg in messages:
-        msg_id, msg_role, msg_content, msg_timestamp, msg_time_delta = msg
-        messages_list.append({
-            "id": msg_id,
-            "role": msg_role,
-            "content": msg_content,
-            "timestamp": msg_timestamp,
-            "time_delta": msg_time_delta
-        })
-
-    session_obj = {
-        "session_id": session_id,
-        "messages": messages_list if messages_list else [],
-        "last_message_id": new_message_id,
-        "message_id_type": message_id_type
-    }
-    with open(debug_file, "a") as f:
-        f.write(json.dumps(session_obj) + "\n")
-    # --- END DEBUG WRITE ---
+        logging.debug("Skipping database log for message, logging to local store")
+        new_message_id, now, delta = session_db_local.log_message(session_id, role, content)
+        message_id_type = "local"
+
+    # WHY: One record per message. This used to re-read the whole history from the DB and append all of it,
+    # making a session's writes O(N^2).
+    session_event_log.record(
+        "message",
+        session_id=session_id,
+        message_id=new_message_id,
+        message_id_type=message_id_type,
+        role=role,
+        content=content,
+        timestamp=now,
+        time_delta=delta,
+    )
 
 # Optionally, a function to get all messages for a session
 def get_session_messages(session_id, skip_db=False):
     if skip_db:
-        # Example: Read messages from a JSON file (implement as needed)
-        debug_file = Path(__file__).parent.parent.parent / "data" / "sessions" / "postgres_debug_session_write.jsonl"
-        messages = []
-        if debug_file.exists():
-            with open(debug_file, "r") as f:
-                for line in f:
-                    session_obj = json.loads(line)
-                    if session_obj.get("session_id") == session_id:
-                        messages = session_obj.get("messages", [])
-                        break
-        return messages
-    else:
-        conn = get_conn()
+        # Same row shape as the DB query, read from the session's own messages file
+        return session_db_local.get_session_messages(session_id)
+    with pooled_conn() as conn:
         c = conn.cursor()
         c.execute('SELECT id, role, content, timestamp, time_delta FROM messages WHERE session_id=%s ORDER BY id ASC', (session_id,))
         messages = c.fetchall()
-        conn.close()
-        return messages
+    return messages
+
+def write_batch(groups):
+    """Store queued writes for session_store's writer: (kind, [params, ...]) groups, in one transaction."""
+    with pooled_conn() as conn:
+        c = conn.cursor()
+        for kind, params in groups:
+            sql = INSERT_MESSAGE_SQL if kind == "message" else UPDATE_SESSION_SQL
+            psycopg2.extras.execute_batch(c, sql, params, page_size=100)
+        conn.commit()
@@ -1,66 +1,279 @@
 import sqlite3
 import json
+import os
+import uuid
+import threading
+from collections import deque
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
 import logging
+import session_db_local
+import session_event_log
 
 logging.getLogger(__name__)
 
-data_dir = Path(__file__).parent.parent / "data"
-db_path = data_dir / "sessions.db"
-
-def ensure_sessions_table():
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS sessions
-                 (id INTEGER PRIMARY KEY, name TEXT, timestamp TEXT, data TEXT)''')
-    conn.commit()
-    conn.close()
-
-def save_session(session_name, session_data, session_db_id=None):
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    now = datetime.now().isoformat()
-    session_data_json = json.dumps(session_data)
-    if session_db_id:
-        c.execute('UPDATE sessions SET name=?, data=?, timestamp=? WHERE id=?',
-                  (session_name, session_data_json, now, session_db_id))
+# WHY: Same functions and row shapes as session_db_postgres, so small deployments can run the app on a local
+# file (SESSION_DB_BACKEND=sqlite) without a database server. Connections come from a small process-wide pool
+# (Streamlit runs every rerun on a new thread, so per-thread connections were reopened each turn), in WAL mode
+# with synchronous=NORMAL; the SQL below is constant, so sqlite3's per-connection statement cache prepares each
+# statement once. The write-behind queue and read paths shared with Postgres live in session_store.
+data_dir = Path(__file__).parent.parent.parent / "data"
+db_path = Path(os.getenv("SQLITE_DB_PATH") or data_dir / "sessions.db")
+STATEMENT_CACHE_SIZE = 256
+SQLITE_POOL_MAX = int(os.getenv("SQLITE_POOL_MAX", 4))  # Idle connections kept open; more are opened on demand
+# "database is locked" and friends: the writer retries these (see session_store)
+TRANSIENT_ERRORS = (sqlite3.OperationalError,)
+
+def get_conn():
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    # check_same_thread=False: a pooled connection is used by one thread at a time, but not always the same one
+    conn = sqlite3.connect(db_path, timeout=10, cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')  # Readers don't block the writer thread and vice versa
+    conn.execute('PRAGMA synchronous=NORMAL')  # Durable at checkpoints; no fsync per commit in WAL mode
+    conn.execute('PRAGMA foreign_keys=ON')
+    conn.execute('PRAGMA busy_timeout=10000')
+    return conn
+
+_idle = deque()
+_pool_lock = threading.Lock()
+_pool_stats = {"checkouts": 0, "connections_created": 0, "connections_closed": 0, "in_use": 0, "peak_in_use": 0}
+
+@contextmanager
+def pooled_conn():
+    """Check out a pooled connection for a with-block; an unfinished transaction is rolled back on return."""
+    with _pool_lock:
+        conn = _idle.pop() if _idle else None
+        _pool_stats["checkouts"] += 1
+        _pool_stats["in_use"] += 1
+        _pool_stats["peak_in_use"] = max(_pool_stats["peak_in_use"], _pool_stats["in_use"])
+    try:
+        if conn is None:
+            conn = get_conn()
+            with _pool_lock:
+                _pool_stats["connections_created"] += 1
+        yield conn
+    finally:
+        keep = conn is not None
+        if keep and conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                keep = False
+        with _pool_lock:
+            _pool_stats["in_use"] -= 1
+            if keep and len(_idle) < SQLITE_POOL_MAX:
+                _idle.append(conn)
+                conn = None
+        if conn is not None:
+            conn.close()
+            with _pool_lock:
+                _pool_stats["connections_closed"] += 1
+
+def pool_stats():
+    with _pool_lock:
+        snapshot = dict(_pool_stats)
+        snapshot["idle"] = len(_idle)
+    snapshot["maxconn"] = SQLITE_POOL_MAX
+    return snapshot
+
+def _upgrade_legacy_columns(conn):
+    # Tables created by the old module only have (id, name, timestamp, data)
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(sessions)')}
+    for column in ("created_at", "updated_at", "end_reason"):
+        if column not in columns:
+            conn.execute(f'ALTER TABLE sessions ADD COLUMN {column} TEXT')
+    if "timestamp" in columns:
+        conn.execute(
+            "UPDATE sessions SET created_at = COALESCE(NULLIF(created_at, ''), timestamp), "
+            "updated_at = COALESCE(NULLIF(updated_at, ''), timestamp) "
+            "WHERE created_at IS NULL OR created_at = '' OR updated_at IS NULL OR updated_at = ''"
+        )
+
+# Versioned like schema_migrations, tracked in PRAGMA user_version. A step is a SQL statement or a function
+# taking the connection.
+MIGRATIONS = [
+    (1, [
+        '''CREATE TABLE IF NOT EXISTS sessions (
+            id INTEGER PRIMARY KEY,
+            name TEXT,
+            data TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            end_reason TEXT
+        )''',
+        '''CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            session_id INTEGER REFERENCES sessions(id) ON DELETE CASCADE,
+            role TEXT,
+            content TEXT,
+            timestamp TEXT,
+            time_delta REAL
+        )''',
+        _upgrade_legacy_columns,
+        '''CREATE INDEX IF NOT EXISTS sessions_updated_at_idx ON sessions (updated_at DESC)''',
+        '''CREATE INDEX IF NOT EXISTS messages_session_id_id_idx ON messages (session_id, id)''',
+    ]),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+_schema_version = None
+
+def ensure_sessions_table(skip_db=False):
+    global _schema_version
+    if skip_db:
+        session_db_local.ensure_sessions_table()
+        return
+    if _schema_version == LATEST_VERSION:
+        return  # Already checked by this process
+    with pooled_conn() as conn:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for migration_version, statements in MIGRATIONS:
+            if migration_version <= version:
+                continue
+            with conn:
+                for statement in statements:
+                    statement(conn) if callable(statement) else conn.execute(statement)
+                conn.execute(f'PRAGMA user_version={migration_version}')
+            version = migration_version
+    _schema_version = version
+    logging.debug(f"SQLite session schema at version {_schema_version}")
+
+def ensure_messages_table(skip_db=False):
+    # The messages table is created by the same migrations as the sessions table.
+    ensure_sessions_table(skip_db=skip_db)
+
+# json_patch merges the snapshot patch into the stored data, like jsonb || in the Postgres backend
+UPDATE_SESSION_SQL = "UPDATE sessions SET name=?, data=json_patch(COALESCE(data, '{}'), COALESCE(?, '{}')), updated_at=?, end_reason=? WHERE id=?"
+INSERT_SESSION_SQL = 'INSERT INTO sessions (name, data, created_at, updated_at, end_reason) VALUES (?, ?, ?, ?, ?)'
+
+def save_session(session_name, session_data=None, session_db_id=None, end_reason=None, skip_db=False):
+    session_id_type = None
+    now = datetime.now().astimezone().isoformat()
+    session_data_json = json.dumps(session_data) if session_data is not None else None
+
+    # Default end_reason if not provided
+    if end_reason is None:
+        end_reason = "not captured"
+
+    if skip_db:
+        logging.debug("Skipping database save for session, saving to local store")
+        if session_db_id is None:
+            session_id_type = "uuid"
+        session_db_id = session_db_local.save_session(session_name, session_data, session_db_id=session_db_id, end_reason=end_reason)
     else:
-        c.execute('SELECT id FROM sessions WHERE name=?', (session_name,))
-        row = c.fetchone()
-        if row:
-            session_db_id = row[0]
-            c.execute('UPDATE sessions SET name=?, data=?, timestamp=? WHERE id=?',
-                      (session_name, session_data_json, now, session_db_id))
-        else:
-            c.execute('INSERT INTO sessions (name, data, timestamp) VALUES (?, ?, ?)',
-                      (session_name, session_data_json, now))
-            session_db_id = c.lastrowid
-    conn.commit()
-    conn.close()
+        logging.debug("Saving session to SQLite")
+        try:
+            with pooled_conn() as conn, conn:
+                if session_db_id:
+                    conn.execute(UPDATE_SESSION_SQL, (session_name, session_data_json, now, end_reason, session_db_id))
+                else:
+                    cursor = conn.execute(INSERT_SESSION_SQL, (session_name, session_data_json, now, now, end_reason))
+                    session_db_id = cursor.lastrowid
+            session_id_type = "db"
+        except sqlite3.DatabaseError as e:
+            logging.error(f"Failed to save session: {e}")
+            session_db_id = uuid.uuid4() if session_db_id is None else session_db_id
+
+    session_event_log.record(
+        "session",
+        session_id=session_db_id,
+        session_id_type=session_id_type,
+        name=session_name,
+        updated_at=now,
+        data=session_data_json,
+        end_reason=end_reason,
+    )
     return session_db_id
 
-def list_sessions():
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute('SELECT id, name, timestamp FROM sessions ORDER BY timestamp DESC')
-    sessions = c.fetchall()
-    conn.close()
-    return sessions
-
-def load_session(session_id):
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute('SELECT data FROM sessions WHERE id=?', (session_id,))
-    row = c.fetchone()
-    conn.close()
-    if row:
-        return json.loads(row[0])
-    return None
-
-def delete_session(session_id):
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute('DELETE FROM sessions WHERE id=?', (session_id,))
-    conn.commit()
-    conn.close()
+def list_sessions(skip_db=False):
+    if skip_db:
+        return session_db_local.list_sessions()
+    with pooled_conn() as conn:
+        return conn.execute('SELECT id, name, created_at, updated_at FROM sessions ORDER BY updated_at DESC').fetchall()
+
+def load_session_data(session_id):
+    # The stored snapshot; session_store.load_session adds the chat history
+    with pooled_conn() as conn:
+        row = conn.execute('SELECT data FROM sessions WHERE id=?', (session_id,)).fetchone()
+    if not row or row[0] is None:
+        return None
+    return json.loads(row[0])
+
+def load_session(session_id, skip_db=False):
+    # Kept for callers of this module: the store's load_session sees queued writes and adds the chat history
+    import session_store
+    return session_store.get_store("sqlite").load_session(session_id, skip_db=skip_db)
+
+def delete_session(session_id, skip_db=False):
+    if skip_db:
+        session_db_local.delete_session(session_id)
+        return
+    with pooled_conn() as conn, conn:
+        conn.execute('DELETE FROM sessions WHERE id=?', (session_id,))  # Messages go with it (ON DELETE CASCADE)
+
+# time_delta is computed from the previous message inside the INSERT, as in the Postgres backend
+INSERT_MESSAGE_SQL = '''
+    INSERT INTO messages (session_id, role, content, timestamp, time_delta)
+    VALUES (
+        :session_id, :role, :content, :timestamp,
+        (SELECT (julianday(:timestamp) - julianday(prev.timestamp)) * 86400.0
+           FROM messages prev
+          WHERE prev.session_id = :session_id
+          ORDER BY prev.id DESC
+          LIMIT 1)
+    )
+'''
+
+def log_message(session_id, role, content, skip_db=False):
+    message_id_type = None
+    if session_id is None:
+        raise RuntimeError("System error: log_message called without a valid session_id.")
+
+    now = datetime.now().astimezone().isoformat()
+    delta = None
+
+    if not skip_db:
+        try:
+            with pooled_conn() as conn, conn:
+                cursor = conn.execute(INSERT_MESSAGE_SQL, {
+                    "session_id": session_id,
+                    "role": role,
+                    "content": content,
+                    "timestamp": now,
+                })
+                new_message_id = cursor.lastrowid
+                delta = conn.execute('SELECT time_delta FROM messages WHERE id=?', (new_message_id,)).fetchone()[0]
+            message_id_type = "db"
+        except sqlite3.DatabaseError as e:
+            logging.error(f"Failed to log message to SQLite: {e}")
+            new_message_id = str(uuid.uuid4())
+            message_id_type = "uuid"
+    else:
+        new_message_id, now, delta = session_db_local.log_message(session_id, role, content)
+        message_id_type = "local"
+
+    session_event_log.record(
+        "message",
+        session_id=session_id,
+        message_id=new_message_id,
+        message_id_type=message_id_type,
+        role=role,
+        content=content,
+        timestamp=now,
+        time_delta=delta,
+    )
+
+def get_session_messages(session_id, skip_db=False):
+    if skip_db:
+        # Same row shape as the DB query, read from the session's own messages file
+        return session_db_local.get_session_messages(session_id)
+    with pooled_conn() as conn:
+        return conn.execute(
+            'SELECT id, role, content, timestamp, time_delta FROM messages WHERE session_id=? ORDER BY id ASC', (session_id,)
+        ).fetchall()
+
+def write_batch(groups):
+    """Store queued writes for session_store's writer: (kind, [params, ...]) groups, in one transaction."""
+    with pooled_conn() as conn, conn:
+        for kind, params in groups:
+            conn.executemany(INSERT_MESSAGE_SQL if kind == "message" else UPDATE_SESSION_SQL, params)
@@ -0,0 +1,68 @@
+import os
+import json
+import threading
+from pathlib import Path
+import logging
+import logging.handlers
+
+logging.getLogger(__name__)
+
+# WHY: Replaces the temporary debug file that re-wrote a session's whole message history on every message.
+# Each session save or message is now one appended JSON line, and the file is rotated with a fixed size cap.
+EVENT_LOG_ENABLED = os.getenv("SESSION_EVENT_LOG", "true").lower() == "true"
+EVENT_LOG_PATH = Path(
+    os.getenv("SESSION_EVENT_LOG_PATH")
+    or Path(__file__).parent.parent.parent / "data" / "sessions" / "session_events.jsonl"
+)
+EVENT_LOG_MAX_BYTES = int(os.getenv("SESSION_EVENT_LOG_MAX_BYTES", 10 * 1024 * 1024))
+EVENT_LOG_BACKUPS = int(os.getenv("SESSION_EVENT_LOG_BACKUPS", 5))
+
+_logger = None
+_lock = threading.Lock()
+
+
+def _get_logger():
+    global _logger
+    if _logger is None:
+        with _lock:
+            if _logger is None:
+                EVENT_LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(
+                    EVENT_LOG_PATH,
+                    maxBytes=EVENT_LOG_MAX_BYTES,
+                    backupCount=EVENT_LOG_BACKUPS,
+                    encoding="utf-8",
+                )
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                event_logger = logging.getLogger("session_events")
+                event_logger.setLevel(logging.INFO)
+                event_logger.propagate = False  # Keep event records out of the app's stdout logs
+                event_logger.handlers = [handler]
+                _logger = event_logger
+    return _logger
+
+
+def record(event, **fields):
+    """Append one event record (e.g. "session" or "message") to the log, if enabled."""
+    if not EVENT_LOG_ENABLED:
+        return
+    try:
+        _get_logger().info(json.dumps({"event": event, **fields}, default=str))
+    except (OSError, TypeError, ValueError) as e:
+        logging.warning(f"Could not write session event log record: {e}")
+
+
+def read_events(event=None):
+    """Yield records from the rotated backups (oldest first) and then the current file."""
+    paths = [Path(f"{EVENT_LOG_PATH}.{i}") for i in range(EVENT_LOG_BACKUPS, 0, -1)] + [EVENT_LOG_PATH]
+    for path in paths:
+        if not path.exists():
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    obj = json.loads(line)
+                except ValueError:
+                    continue
+                if event is None or obj.get("event") == event:
+                    yield obj
@@ -0,0 +1,33 @@
+import logging
+
+logging.getLogger(__name__)
+
+# WHY: sessions.data used to receive dict(st.session_state): every widget key, the ~5 KB rendered system prompt
+# and the full chat history, which is already stored row by row in the messages table. Only these fields are
+# needed to restore a session; the prompt is stored as a reference to the template revision it was rendered from.
+SNAPSHOT_FIELDS = (
+    "session_title",
+    "level_chatapi",
+    "level_selected",
+    "selected_model_chatapi",
+)
+
+
+def prompt_reference(registry, template_name):
+    """Identify a rendered system prompt by its template name and content version."""
+    if not template_name:
+        return None
+    return {"template": template_name, "version": registry.version(template_name)}
+
+
+def build_snapshot(state, prompt_ref=None, previous=None):
+    """
+    Return the whitelisted fields of `state` as a patch to merge into the stored session data.
+    When `previous` (the last snapshot written) is given, only fields that changed since then are included.
+    """
+    snapshot = {key: state[key] for key in SNAPSHOT_FIELDS if key in state}
+    if prompt_ref is not None:
+        snapshot["prompt"] = prompt_ref
+    if previous:
+        snapshot = {key: value for key, value in snapshot.items() if previous.get(key) != value}
+    return snapshot
@@ -0,0 +1,185 @@
+import os
+import json
+import importlib
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+import session_db_local
+import session_event_log
+import turn_tracing
+import write_behind
+
+logging.getLogger(__name__)
+
+# SESSION_DB_BACKEND -> module with the backend's SQL
+BACKENDS = {
+    "postgres": "session_db_postgres",
+    "sqlite": "session_db_sqlite",
+}
+DEFAULT_BACKEND = "postgres"
+# Each call to one of these from the UI is a "db" span of the current rerun's trace (see turn_tracing)
+TRACED_FUNCTIONS = (
+    "ensure_sessions_table", "ensure_messages_table", "save_session", "list_sessions", "load_session",
+    "delete_session", "log_message", "get_session_messages", "enqueue_message", "enqueue_session_update",
+    "flush_writes",
+)
+
+
+class SessionStore:
+    """
+    What the UI and tools use to store sessions. A backend module (session_db_postgres, session_db_sqlite)
+    supplies the SQL: ensure_sessions_table, ensure_messages_table, save_session, log_message, list_sessions,
+    delete_session, get_session_messages, load_session_data, write_batch and TRANSIENT_ERRORS. The store adds
+    what is the same for every backend: the write-behind queue, reading your own queued writes, and rebuilding
+    a loaded session's chat history. Other backend attributes (e.g. pool_stats) pass through. The backend
+    modules keep their own load_session and skip_db arguments for code that imports them directly.
+
+    list_sessions rows are (id, name, created_at, updated_at) and get_session_messages rows are
+    (id, role, content, timestamp, time_delta). skip_db=True routes every call to session_db_local.
+    """
+
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.name = name
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    # --- Reads (see queued writes first) ---
+
+    def list_sessions(self, skip_db=False) -> List[Tuple]:
+        if skip_db:
+            return session_db_local.list_sessions()
+        self.flush_writes()
+        return self.backend.list_sessions()
+
+    def get_session_messages(self, session_id, skip_db=False) -> List[Tuple]:
+        if skip_db:
+            # Same row shape as the DB query, read from the session's own messages file
+            return session_db_local.get_session_messages(session_id)
+        self.flush_writes()  # Read your own queued writes
+        return self.backend.get_session_messages(session_id)
+
+    def load_session(self, session_id, skip_db=False) -> Optional[dict]:
+        if skip_db:
+            data = session_db_local.load_session(session_id)
+        else:
+            self.flush_writes()
+            data = self.backend.load_session_data(session_id)
+        if data is not None and "chat_messages" not in data:
+            # Snapshots no longer embed the chat history; rebuild it from the messages table
+            data["chat_messages"] = [
+                {"role": role, "content": content}
+                for _, role, content, _, _ in self.get_session_messages(session_id, skip_db=skip_db)
+            ]
+        return data
+
+    def delete_session(self, session_id, skip_db=False) -> None:
+        if skip_db:
+            session_db_local.delete_session(session_id)
+            return
+        self.flush_writes()  # Queued writes for this session would otherwise land after the delete
+        self.backend.delete_session(session_id)
+
+    # --- Write-behind logging ---
+    # WHY: log_message/save_session used to run inside the Streamlit script thread, so DB latency was added to
+    # every turn. The UI now only enqueues; a background thread stores each batch in a single transaction.
+
+    def _write_batch(self, ops):
+        # Consecutive writes of the same kind go out together, preserving overall order
+        groups = []
+        for kind, params in ops:
+            if groups and groups[-1][0] == kind:
+                groups[-1][1].append(params)
+            else:
+                groups.append((kind, [params]))
+        self.backend.write_batch(groups)
+
+    @staticmethod
+    def _record_failed_writes(ops, error):
+        # Keep a copy of writes that could not be stored so they can be recovered. The event log can be turned
+        # off (SESSION_EVENT_LOG=false), so the application log always gets them too.
+        for kind, params in ops:
+            logging.error(f"Lost queued {kind} write ({error}): {json.dumps(params, default=str)}")
+            session_event_log.record("write_failed", kind=kind, params=params, error=str(error))
+
+    def _get_writer(self):
+        if self._writer is None:
+            with self._writer_lock:
+                if self._writer is None:
+                    self._writer = write_behind.WriteBehindQueue(
+                        self._write_batch,
+                        name=f"session-{self.name}-writer",
+                        maxsize=int(os.getenv("DB_WRITE_QUEUE_SIZE", 1000)),
+                        batch_size=int(os.getenv("DB_WRITE_BATCH_SIZE", 100)),
+                        flush_interval=float(os.getenv("DB_WRITE_FLUSH_INTERVAL", 0.2)),
+                        transient_errors=self.backend.TRANSIENT_ERRORS,
+                        on_failure=self._record_failed_writes,
+                    )
+        return self._writer
+
+    def enqueue_message(self, session_id, role, content, skip_db=False) -> None:
+        """Queue a message to be logged in the background; same arguments as log_message."""
+        if session_id is None:
+            raise RuntimeError("System error: enqueue_message called without a valid session_id.")
+        if skip_db:
+            # The local store is a file append, there is no DB round trip to hide
+            self.backend.log_message(session_id, role, content, skip_db=True)
+            return
+        now = datetime.now().astimezone().isoformat()  # Captured now so time_delta reflects when it was sent
+        self._get_writer().put(("message", {"session_id": session_id, "role": role, "content": content, "timestamp": now}))
+        session_event_log.record("message", session_id=session_id, message_id=None, message_id_type="queued",
+                                 role=role, content=content, timestamp=now, time_delta=None)
+
+    def enqueue_session_update(self, session_name, session_data=None, session_db_id=None, end_reason=None, skip_db=False) -> Any:
+        """Queue an update of an existing session; creating a session (which needs its id) stays synchronous."""
+        if session_db_id is None or skip_db:
+            return self.backend.save_session(session_name, session_data, session_db_id=session_db_id,
+                                             end_reason=end_reason, skip_db=skip_db)
+        now = datetime.now().astimezone().isoformat()
+        session_data_json = json.dumps(session_data) if session_data is not None else None
+        end_reason = end_reason if end_reason is not None else "not captured"
+        self._get_writer().put(("session", (session_name, session_data_json, now, end_reason, session_db_id)))
+        session_event_log.record("session", session_id=session_db_id, session_id_type="queued", name=session_name,
+                                 updated_at=now, data=session_data_json, end_reason=end_reason)
+        return session_db_id
+
+    def flush_writes(self, timeout=None) -> None:
+        if self._writer is not None:
+            self._writer.flush(timeout)
+
+    def writer_stats(self) -> Dict[str, Any]:
+        # Queue depth and flush latency of the background writer
+        return self._get_writer().stats()
+
+
+def backend_name(backend=None):
+    name = (backend or os.getenv("SESSION_DB_BACKEND") or DEFAULT_BACKEND).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown SESSION_DB_BACKEND {name!r}; expected one of {', '.join(BACKENDS)}")
+    return name
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(backend=None) -> SessionStore:
+    """
+    Return the process-wide store for `backend`, or for SESSION_DB_BACKEND (default postgres), with its
+    calls traced when tracing is on. All callers share one write-behind queue per backend.
+    """
+    name = backend_name(backend)
+    store = _stores.get(name)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(name)
+            if store is None:
+                logging.debug(f"Using {name} session store")
+                module = importlib.import_module(BACKENDS[name])
+                store = turn_tracing.trace_calls(SessionStore(module, name), "db", TRACED_FUNCTIONS, label=module.__name__)
+                _stores[name] = store
+    return store
@@ -1,26 +1,26 @@
 import os
 import sys
 import json
-import asyncio
 import datetime
-import html
-import session_db_postgres as session_db
+import session_store
+import async_runner
 import logging
 import sentry_sdk
 import traceback
-import re
 import streamlit as st
-from pathlib import Path
 from gemini_pipeline import GeminiPipeline as Pipe
 from datetime import datetime
-from jinja2 import Template
+import prompt_registry
+import session_snapshot
+import chat_render
+import turn_tracing
 
 # Initialize Sentry for error tracking
 sentry_sdk.init(
     dsn="https://175659c068864530742625044e39cd9b@o291188.ingest.us.sentry.io/4509640390803457",
     send_default_pii=True,
-    traces_sample_rate=1.0, # Tracing captured
-    environment="digital-latin-streamlit-ui-dev"
+    environment="digital-latin-streamlit-ui-dev",
+    **turn_tracing.sentry_options(),  # Sampling set by TRACE_SAMPLE_RATE / TRACE_MAX_PER_MINUTE
 )
 
 logger = logging.getLogger()
@@ -39,13 +39,30 @@ stderr_handler.setFormatter(formatter)
 
 logger.handlers = [stdout_handler, stderr_handler]
 
-try:
-    logger.debug("Imported session_db_postgres")
-    os.environ["SESSION_DB_BACKEND"] = "postgres"
-    session_db.ensure_sessions_table()
+# WHY: Each rerun is one trace (if sampled); prompt rendering, pipeline phases and DB calls are spans in it,
+# tagged with session_db_id. rerun() below ends the trace before handing over to the next rerun.
+turn_tracing.begin_rerun(
+    session_db_id=st.session_state.get("session_db_id"),
+    messages=len(st.session_state.get("chat_messages", [])),
+    level=st.session_state.get("level_chatapi"),
+    llm_pending=bool(st.session_state.get("should_call_llm")),
+)
+
+def rerun(reason):
+    turn_tracing.end_rerun(f"rerun: {reason}")
+    st.rerun()
+
+# WHY: The backend (postgres or sqlite) comes from SESSION_DB_BACKEND; both expose the same SessionStore functions.
+session_db = session_store.get_store()
+
+@st.cache_resource(show_spinner=False)
+def bootstrap_session_db(skip_db, backend=session_store.backend_name()):
+    # WHY: Streamlit re-executes this script on every interaction. Schema setup runs once per server process
+    # (and the versioned migrations are a no-op when the schema is current), so reruns do no DDL.
+    # A failure is not cached, so the next rerun tries again.
+    session_db.ensure_sessions_table(skip_db=skip_db)
     logger.debug("Called ensure_sessions_table")
-except Exception as e:
-    logger.debug(f"Exception during DB setup: {e}")
+    return True
 
 ## TODO: 
 # - Possibly - Mount EFS for data storage.
@@ -68,6 +85,11 @@ except Exception as e:
 # Load environment variables handled in docker-compose, no need to load here.
 
 SKIP_DB = os.getenv("SKIP_DB", "false").lower() == "true"
+# WHY: Streaming renders the assistant reply as it is generated, so instructors see the first words in seconds
+# instead of waiting for the whole simplified passage behind a spinner.
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "true").lower() == "true"
+# Number of most recent messages rendered by default; older ones sit behind a "Show earlier messages" button (0 = all)
+CHAT_VISIBLE_MESSAGES = int(os.getenv("CHAT_VISIBLE_MESSAGES", 0))
 
 if st.session_state.get("clear_chat_input", False):
     st.session_state["chat_input_text"] = ""
@@ -86,16 +108,50 @@ except Exception as e:
 
 # Set up prompt template paths
 # WHY: Prompts are stored as Jinja2 templates for easy editing and reuse. This allows for level-specific instructions.
-PROMPTS_DIR = Path(__file__).parent.parent.parent / "prompts"
-LEVEL_1_PROMPT_JINJA = next(PROMPTS_DIR.glob("*level1*.jinja*"), None)
-LEVEL_2_PROMPT_JINJA = next(PROMPTS_DIR.glob("*level2*.jinja*"), None)
+# The registry is process-wide: templates are compiled once and rendered prompts are memoized across reruns.
+prompts = prompt_registry.get_registry()
+PROMPTS_DIR = prompts.prompts_dir
+LEVEL_1_PROMPT_JINJA = prompts.find("*level1*.jinja*")
+LEVEL_1_PROMPT_JINJA = PROMPTS_DIR / LEVEL_1_PROMPT_JINJA if LEVEL_1_PROMPT_JINJA else None
+LEVEL_2_PROMPT_JINJA = prompts.find("*level2*.jinja*")
+LEVEL_2_PROMPT_JINJA = PROMPTS_DIR / LEVEL_2_PROMPT_JINJA if LEVEL_2_PROMPT_JINJA else None
+
+def build_llm_messages():
+    system_prompt = st.session_state.get("system_prompt", "")
+    return [{"role": "system", "content": system_prompt}] + [
+        m for m in st.session_state["chat_messages"]
+    ]
+
+def record_assistant_response(response_content):
+    # Only append if not already present as the last assistant message
+    if not (
+        st.session_state["chat_messages"]
+        and st.session_state["chat_messages"][-1]["role"] == "assistant"
+        and st.session_state["chat_messages"][-1]["content"].strip() == response_content.strip()
+    ):
+        st.session_state["chat_messages"].append({"role": "assistant", "content": response_content})
+        session_db_id = st.session_state.get("session_db_id")
+        if session_db_id:
+            # WHY: Only enqueue; the background writer does the INSERT so DB latency isn't added before st.rerun().
+            session_db.enqueue_message(session_db_id, "assistant", response_content, skip_db=SKIP_DB)
+
+def session_snapshot_patch():
+    # WHY: Persist only whitelisted fields plus a reference to the prompt template version, and only what changed
+    # since the last save, instead of dict(st.session_state) with the rendered prompt and the whole chat.
+    level = st.session_state.get("level_chatapi")
+    jinja_path = LEVEL_1_PROMPT_JINJA if level == "Level I" else LEVEL_2_PROMPT_JINJA if level == "Level II" else None
+    prompt_ref = session_snapshot.prompt_reference(prompts, jinja_path.name if jinja_path else None)
+    previous = st.session_state.get("_saved_snapshot")
+    patch = session_snapshot.build_snapshot(st.session_state, prompt_ref=prompt_ref, previous=previous)
+    st.session_state["_saved_snapshot"] = {**(previous or {}), **patch}
+    return patch or None
 
 def render_jinja_prompt(jinja_path, context=None):
     # WHY: Allows dynamic rendering of prompt templates with context variables.
     rendered_prompt = ""
     if jinja_path and jinja_path.exists():
-        template = Template(jinja_path.read_text())
-        rendered_prompt = template.render(context or {})
+        with turn_tracing.span("prompt.render", jinja_path.name):
+            rendered_prompt = prompts.render(jinja_path.name, context)
     return rendered_prompt
 
 # --- GLOBAL SESSION STATE INITIALIZATION & PENDING LOAD HANDLING ---
@@ -109,7 +165,7 @@ def pad_label(label, width=30):
 def human_readable_time(ts):
     """Convert ISO timestamp to a more readable format for display."""
     try:
-        dt = datetime.fromisoformat(ts)
+        dt = ts if isinstance(ts, datetime) else datetime.fromisoformat(ts)  # timestamptz columns return datetimes
         return dt.strftime('%b %d, %Y %I:%M %p')
     except Exception:
         return ts
@@ -169,10 +225,12 @@ if "llm_busy" not in st.session_state:
 # os.environ["SESSION_DB_BACKEND"] = backend
 # session_db.ensure_sessions_table()
 #
-# --- Default to PostgreSQL ---
+# --- Backend from SESSION_DB_BACKEND (default PostgreSQL), see session_store ---
 
-os.environ["SESSION_DB_BACKEND"] = "postgres"
-session_db.ensure_sessions_table()
+try:
+    bootstrap_session_db(SKIP_DB)
+except Exception as e:
+    logger.debug(f"Exception during DB setup: {e}")
 
 # --- SIDEBAR ---
 # WHY: The sidebar provides navigation, settings, and session management. It is the main entry point for users to select models, levels, and manage their work.
@@ -189,9 +247,9 @@ with st.sidebar:
         session_db_id = st.session_state.get("session_db_id")
         session_title = st.session_state.get("session_title", "Untitled Session")
         if session_db_id:
-            session_db.save_session(session_title, dict(st.session_state), session_db_id=session_db_id, end_reason="new session started", skip_db=SKIP_DB)
+            session_db.enqueue_session_update(session_title, session_snapshot_patch(), session_db_id=session_db_id, end_reason="new session started", skip_db=SKIP_DB)
         st.session_state.clear()
-        st.rerun()
+        rerun("new session")
     # Style the sidebar New Session button to be dark grey with white text
     # st.markdown("""
     #     <style>
@@ -231,26 +289,35 @@ with st.sidebar:
     # Level selection: no default, starts with placeholder, only enabled if not already selected for this session.
     level_options = ["Select a level", "Level I", "Level II"]
     level_selected = st.session_state.get("level_selected", False)
+    # WHY: Streamlit drops the pending value of a widget that is disabled on the next run, so the level picked
+    # on the run that locks the selector (which then reruns) would fall back to the placeholder. The locked
+    # level is kept in its own key and written back before the selectbox is created on every run.
+    locked_level = st.session_state.get("locked_level")
+    level_restored = level_selected and locked_level in level_options
+    if level_restored:
+        st.session_state.level_chatapi = locked_level
     current_level = st.session_state.get("level_chatapi", "Select a level")
     level_disabled = level_selected and current_level in ["Level I", "Level II"]
     level = st.selectbox(
         "Select Level",
         level_options,
-        index=level_options.index(current_level) if current_level in level_options else 0,
+        # The index is only a default; passing one alongside a restored session_state value makes Streamlit warn
+        index=0 if level_restored or current_level not in level_options else level_options.index(current_level),
         key="level_chatapi",
         disabled=level_disabled
     )
     # Only allow selection if not disabled and a real level is chosen
     if level_selected is False and level in ["Level I", "Level II"]:
         st.session_state["level_selected"] = True
+        st.session_state["locked_level"] = level
 
         # Save a new session immediately when level is selected
         session_title = st.session_state.get("session_title", "Untitled Session")
-        session_data = dict(st.session_state)  # Capture current session state
-        session_data["messages"] = st.session_state.get("chat_messages", [])
-        session_db_id = session_db.save_session(session_title, session_data=session_data)
+        session_data = session_snapshot_patch()  # Whitelisted fields only; messages go to the messages table
+        session_db_id = session_db.save_session(session_title, session_data=session_data, skip_db=SKIP_DB)
         st.session_state["session_db_id"] = session_db_id
-        st.rerun()
+        turn_tracing.set_session(session_db_id)
+        rerun("level selected")
 
     # Show caption if a real level is selected and selector is disabled
     if (
@@ -325,35 +392,22 @@ with st.sidebar:
     st.caption(f"Model: {selected_model}")
 
 # --- LLM CALL TRIGGER BLOCK: MUST BE BEFORE ANY UI RENDERING ---
-if st.session_state.get("llm_busy", False) and st.session_state.get("should_call_llm", False):
+# (Non-streaming mode only; the streaming trigger runs right after the chat history so chunks render in place.)
+if not STREAM_RESPONSES and st.session_state.get("llm_busy", False) and st.session_state.get("should_call_llm", False):
     st.session_state.should_call_llm = False  # Prevent duplicate LLM calls on rerun
     try:
         with st.spinner("Assistant is thinking..."):
             selected_model = st.session_state.get("selected_model_chatapi", "gemini-2.5-pro")
-            system_prompt = st.session_state.get("system_prompt", "")
-            messages = [{"role": "system", "content": system_prompt}] + [
-                m for m in st.session_state["chat_messages"]
-            ]
-            response_content = asyncio.run(pipe.pipe({"model": selected_model, "messages": messages}, {}, lambda x: None, {}))
-            # Only append if not already present as the last assistant message
-            if not (
-                st.session_state["chat_messages"]
-                and st.session_state["chat_messages"][-1]["role"] == "assistant"
-                and st.session_state["chat_messages"][-1]["content"].strip() == response_content.strip()
-            ):
-                st.session_state["chat_messages"].append({"role": "assistant", "content": response_content})
-                session_db_id = st.session_state.get("session_db_id")
-                if session_db_id:
-                    session_db.log_message(session_db_id, "assistant", response_content)
-            else:
-                # Session title generation (do NOT append to chat history)
-                pass
+            messages = build_llm_messages()
+            # WHY: Submit to the process-wide background loop instead of asyncio.run, which built a new loop per turn.
+            response_content = async_runner.run(pipe.pipe({"model": selected_model, "messages": messages}, {}, lambda x: None, {}))
+            record_assistant_response(response_content)
     except Exception as e:
         error_info = f"Error: {e}\nRaw object type: {type(e.__context__ if e.__context__ else 'Unknown')}\nRaw object details: {response_content if 'response_content' in locals() else 'Not available'}"
         st.session_state["chat_messages"].append({"role": "assistant", "content": error_info})
     finally:
         st.session_state.llm_busy = False  # Not busy after response
-        st.rerun()  # Rerun to display the new assistant message and re-enable the button
+        rerun("assistant reply")  # Rerun to display the new assistant message and re-enable the button
     st.stop()  # Prevents any further UI rendering in this run
 
 # --- MAIN AREA ---
@@ -498,30 +552,53 @@ if session_title:
     st.markdown(f"<div style='font-size:1.1em; color:#555; margin-bottom:0.5em;'><b>Session Topic:</b> {session_title}</div>", unsafe_allow_html=True)
 
 # WHY: Deduplicate chat messages to avoid repeated entries after reruns or session loads.
-seen = set()
-deduped = []
-for msg in st.session_state["chat_messages"]:
-    msg_id = (msg.get("role"), msg.get("content"))
-    if msg_id not in seen:
-        seen.add(msg_id)
-        deduped.append(msg)
-st.session_state["chat_messages"] = deduped  # Always update to ensure deduplication
+# Only messages added since the last rerun are checked; the seen-set is kept in session_state.
+chat_render.dedupe_new_messages(st.session_state)
 
 # WHY: Render chat history using st.chat_message for a native chat UI experience.
-logger.debug(f"[Streamlit] Rendering chat history. Total messages: {len(st.session_state.get('chat_messages', []))}")
-for idx, msg in enumerate(st.session_state["chat_messages"]):
+# Message HTML/markdown comes from a per-process render cache, and older turns can be collapsed
+# (CHAT_VISIBLE_MESSAGES) so rerun cost doesn't grow with the length of the conversation.
+chat_messages = st.session_state["chat_messages"]
+logger.debug(f"[Streamlit] Rendering chat history. Total messages: {len(chat_messages)}")
+hidden_count = 0
+if CHAT_VISIBLE_MESSAGES and not st.session_state.get("show_older_turns", False):
+    hidden_count = max(0, len(chat_messages) - CHAT_VISIBLE_MESSAGES)
+if hidden_count:
+    if st.button(f"Show {hidden_count} earlier messages", key="show_older_turns_btn"):
+        st.session_state["show_older_turns"] = True
+        rerun("show earlier messages")
+for idx, msg in enumerate(chat_messages[hidden_count:], start=hidden_count):
+    rendered = chat_render.render_message(msg)
+    if rendered is None:
+        continue
     with st.chat_message(msg["role"]):
-        if msg["role"] == "user":
-            st.markdown(
-                f"<div style='background:#e3f2fd; color:#17416b; border-radius:8px; padding:16px 18px; margin-bottom:8px; font-size:1.05em; width:100%; max-width:648px; box-sizing:border-box; word-break:break-word; overflow-wrap:break-word;'>{html.escape(msg['content'])}</div>",
-                unsafe_allow_html=True
+        st.markdown(rendered, unsafe_allow_html=True)
+
+# --- STREAMING LLM CALL TRIGGER BLOCK: AFTER CHAT HISTORY, BEFORE THE INPUT ---
+# WHY: The reply is streamed into a new assistant bubble below the history; the rerun afterwards renders it normally.
+if STREAM_RESPONSES and st.session_state.get("llm_busy", False) and st.session_state.get("should_call_llm", False):
+    st.session_state.should_call_llm = False  # Prevent duplicate LLM calls on rerun
+    try:
+        selected_model = st.session_state.get("selected_model_chatapi", "gemini-2.5-pro")
+        messages = build_llm_messages()
+        with st.chat_message("assistant"):
+            response_content = st.write_stream(
+                # The pipeline bounds every chunk by its retry deadlines; the step timeout is only a backstop
+                async_runner.iterate(
+                    pipe.pipe_stream({"model": selected_model, "messages": messages}, {}, lambda x: None, {}),
+                    step_timeout=pipe.retry_policy.total_timeout + 30,
+                )
             )
-        elif msg["role"] == "assistant":
-            def style_code(text):
-                # Replace `code` with styled span
-                return re.sub(r'`([^`]+)`', r"<span style='color:#8c3f1a; font-weight:400;'>\1</span>", text)
-            styled_content = style_code(msg['content'].replace('\n', '  \n'))
-            st.markdown(styled_content, unsafe_allow_html=True)
+        if not isinstance(response_content, str):
+            response_content = "".join(str(chunk) for chunk in response_content)
+        record_assistant_response(response_content)
+    except Exception as e:
+        error_info = f"Error: {e}\nRaw object type: {type(e.__context__ if e.__context__ else 'Unknown')}\nRaw object details: {response_content if 'response_content' in locals() else 'Not available'}"
+        st.session_state["chat_messages"].append({"role": "assistant", "content": error_info})
+    finally:
+        st.session_state.llm_busy = False  # Not busy after response
+        rerun("assistant reply")  # Rerun to display the new assistant message and re-enable the button
+    st.stop()  # Prevents any further UI rendering in this run
 
 # --- RESTORE THE CHAT INPUT ---
 # WHY: The chat input box is always shown at the bottom, unless a system prompt is missing (e.g., before level selection).
@@ -586,10 +663,10 @@ if chat_enabled:
         st.session_state["chat_messages"].append({"role": "user", "content": user_text})
         session_db_id = st.session_state.get("session_db_id")
         if session_db_id:
-            session_db.log_message(session_db_id, "user", user_text, skip_db=SKIP_DB)
+            session_db.enqueue_message(session_db_id, "user", user_text, skip_db=SKIP_DB)
         st.session_state["clear_chat_input"] = True
         st.session_state["pending_llm"] = True  # New flag to trigger LLM on next rerun
-        st.rerun()
+        rerun("message sent")
     # Optionally, you can add a note for the user
     st.caption("Press the ➤ button to send your message.")
     
@@ -608,4 +685,6 @@ if st.session_state.get("pending_llm", False) and not st.session_state.get("llm_
     st.session_state["llm_busy"] = True
     st.session_state["should_call_llm"] = True
     st.session_state["pending_llm"] = False
-    st.rerun()
\ No newline at end of file
+    rerun("calling LLM")
+
+turn_tracing.end_rerun("complete")
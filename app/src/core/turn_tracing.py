@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import uuid
+import random
+import functools
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+import logging
+import logging.handlers
+
+logging.getLogger(__name__)
+
+# WHY: A slow turn could be the prompt render, the history window, the client, the Gemini call or a DB write,
+# and Sentry only saw the rerun as a whole. Each Streamlit rerun is now a trace with one span per phase,
+# tagged with session_db_id so the reruns of a conversation can be lined up. Spans opened on the background
+# event loop (the pipeline) attach to the rerun that submitted the work, because async_runner carries the
+# caller's contextvars over.
+#   TRACE_EXPORTER    sentry, local (JSON lines in TRACE_LOCAL_PATH), both as "sentry,local", or off
+#   TRACE_SAMPLE_RATE fraction of reruns traced while under TRACE_MAX_PER_MINUTE
+#   TRACE_MAX_PER_MINUTE  above this many reruns a minute the rate is lowered to keep traces at about this
+#                     many per minute (0 = fixed rate), so tracing stays cheap under classroom load
+TRACE_EXPORTERS = {
+    name.strip() for name in os.getenv("TRACE_EXPORTER", "sentry").lower().split(",") if name.strip()
+} - {"off", "none", "false"}
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 1.0))
+TRACE_MAX_PER_MINUTE = float(os.getenv("TRACE_MAX_PER_MINUTE", 120))
+TRACE_LOCAL_PATH = Path(
+    os.getenv("TRACE_LOCAL_PATH")
+    or Path(__file__).parent.parent.parent / "data" / "traces" / "turn_traces.jsonl"
+)
+TRACE_LOCAL_MAX_BYTES = int(os.getenv("TRACE_LOCAL_MAX_BYTES", 10 * 1024 * 1024))
+TRACE_LOCAL_BACKUPS = int(os.getenv("TRACE_LOCAL_BACKUPS", 3))
+
+# Streamlit ends a rerun early by raising these; a span they pass through still finished normally.
+_CONTROL_FLOW = {"RerunException", "StopException", "GeneratorExit", "CancelledError"}
+
+
+class AdaptiveSampler:
+    """
+    Traces a base_rate fraction of reruns until more than max_per_minute arrive in the sliding window,
+    then scales the rate down so about max_per_minute are traced.
+    """
+
+    def __init__(self, base_rate=TRACE_SAMPLE_RATE, max_per_minute=TRACE_MAX_PER_MINUTE, window=60.0):
+        self.base_rate = base_rate
+        self.max_per_minute = max_per_minute
+        self.window = window
+        self._seen = deque()
+        self._lock = threading.Lock()
+        self._rng = random.Random()
+
+    def rate(self):
+        now = time.monotonic()
+        with self._lock:
+            self._seen.append(now)
+            while self._seen[0] < now - self.window:
+                self._seen.popleft()
+            per_minute = len(self._seen) * 60.0 / self.window
+        if not self.max_per_minute or per_minute <= self.max_per_minute:
+            return self.base_rate
+        return min(self.base_rate, self.max_per_minute / per_minute)
+
+    def sample(self):
+        rate = self.rate()
+        return rate >= 1.0 or self._rng.random() < rate, rate
+
+
+_sampler = AdaptiveSampler()
+
+
+def traces_sampler(sampling_context):
+    """Sentry traces_sampler: follows an upstream decision, otherwise the adaptive rate."""
+    parent_sampled = sampling_context.get("parent_sampled")
+    if parent_sampled is not None:
+        return float(parent_sampled)
+    return _sampler.rate()
+
+
+def sentry_options():
+    """Tracing options for sentry_sdk.init: adaptive sampling, or none when Sentry isn't an exporter."""
+    return {"traces_sampler": traces_sampler} if "sentry" in TRACE_EXPORTERS else {}
+
+
+_local_logger = None
+_local_lock = threading.Lock()
+
+
+def _export_local(record):
+    # Same rotating JSON-lines layout as session_event_log
+    global _local_logger
+    try:
+        if _local_logger is None:
+            with _local_lock:
+                if _local_logger is None:
+                    TRACE_LOCAL_PATH.parent.mkdir(parents=True, exist_ok=True)
+                    handler = logging.handlers.RotatingFileHandler(
+                        TRACE_LOCAL_PATH, maxBytes=TRACE_LOCAL_MAX_BYTES, backupCount=TRACE_LOCAL_BACKUPS, encoding="utf-8"
+                    )
+                    handler.setFormatter(logging.Formatter("%(message)s"))
+                    trace_logger = logging.getLogger("turn_traces")
+                    trace_logger.setLevel(logging.INFO)
+                    trace_logger.propagate = False
+                    trace_logger.handlers = [handler]
+                    _local_logger = trace_logger
+        _local_logger.info(json.dumps(record, default=str))
+    except (OSError, TypeError, ValueError) as e:
+        logging.warning(f"Could not write local trace record: {e}")
+
+
+class _Trace:
+    """One traced rerun: its Sentry transaction (if exporting there) and the spans recorded for the local file."""
+
+    def __init__(self, name, session_db_id, rate, tags):
+        self.name = name
+        self.session_db_id = session_db_id
+        self.tags = dict(tags)
+        self.rate = rate
+        self.started = time.time()
+        self.t0 = time.perf_counter()
+        self.last_activity = self.t0
+        self.spans = []
+        self.trace_id = uuid.uuid4().hex
+        self.transaction = None
+        if "sentry" in TRACE_EXPORTERS:
+            try:
+                import sentry_sdk
+                self.transaction = sentry_sdk.start_transaction(op="streamlit.rerun", name=name, sampled=True)
+                self.trace_id = self.transaction.trace_id
+                self.transaction.set_tag("session_db_id", str(session_db_id))
+                for key, value in self.tags.items():
+                    self.transaction.set_data(key, value)
+            except Exception as e:
+                logging.warning(f"Could not start Sentry transaction: {e}")
+                self.transaction = None
+
+    def set_session(self, session_db_id):
+        self.session_db_id = session_db_id
+        if self.transaction is not None:
+            self.transaction.set_tag("session_db_id", str(session_db_id))
+
+    def finish(self, outcome, late=False):
+        # A trace finished late (see begin_rerun) ends where its last span ended, not now
+        end = self.last_activity if late else time.perf_counter()
+        if self.transaction is not None:
+            self.transaction.set_tag("outcome", outcome)
+            if late:
+                self.transaction.finish(end_timestamp=datetime.fromtimestamp(self.started + end - self.t0, timezone.utc))
+            else:
+                self.transaction.finish()
+        if "local" in TRACE_EXPORTERS:
+            _export_local({
+                "trace_id": self.trace_id,
+                "name": self.name,
+                "session_db_id": self.session_db_id,
+                "started_at": datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+                "duration_ms": round((end - self.t0) * 1000, 2),
+                "outcome": outcome,
+                "sample_rate": self.rate,
+                "tags": self.tags,
+                "spans": sorted(self.spans, key=lambda s: s["start_ms"]),
+            })
+
+
+class _Span:
+    def __init__(self, trace, op, description, data):
+        self._trace = trace
+        self.op = op
+        self.description = description
+        self.data = dict(data)
+        self._start = time.perf_counter()
+        self._sentry = None
+        if trace.transaction is not None:
+            self._sentry = trace.transaction.start_child(op=op, description=description)
+
+    def set_data(self, key, value):
+        self.data[key] = value
+
+    def finish(self, status="ok"):
+        end = time.perf_counter()
+        if self._sentry is not None:
+            for key, value in self.data.items():
+                self._sentry.set_data(key, value)
+            self._sentry.set_status(status)
+            self._sentry.finish()
+        trace = self._trace
+        trace.spans.append({
+            "op": self.op,
+            "description": self.description,
+            "start_ms": round((self._start - trace.t0) * 1000, 2),
+            "duration_ms": round((end - self._start) * 1000, 2),
+            "status": status,
+            "data": self.data,
+            "thread": threading.current_thread().name,
+        })
+        trace.last_activity = max(trace.last_activity, end)
+
+
+class _NoopSpan:
+    def set_data(self, key, value):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+_current = contextvars.ContextVar("turn_trace", default=None)
+_open = {}  # browser session -> trace not yet ended, in case a rerun was cut short before end_rerun
+
+
+def _rerun_owner():
+    # Streamlit runs each rerun on a new script thread, so a cut-short rerun is found by its browser session;
+    # outside Streamlit (tools, tests) the thread stands in for it.
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx(suppress_warning=True)
+    except ImportError:
+        ctx = None
+    return ctx.session_id if ctx is not None else f"thread-{threading.get_ident()}"
+
+
+def begin_rerun(name="rerun", session_db_id=None, **tags):
+    """Start tracing a rerun of this session (if sampled). tags (e.g. message count, level) go on the trace."""
+    if not TRACE_EXPORTERS:
+        return
+    owner = _rerun_owner()
+    previous = _open.pop(owner, None)
+    if previous is not None:
+        previous.finish("interrupted", late=True)
+    sampled, rate = _sampler.sample()
+    trace = _Trace(name, session_db_id, rate, tags) if sampled else None
+    if trace is not None:
+        _open[owner] = trace
+    _current.set(trace)
+
+
+def end_rerun(outcome="complete"):
+    """Finish this session's rerun trace; outcome says how it ended (e.g. "complete", "rerun: level selected")."""
+    trace = _open.pop(_rerun_owner(), None)
+    _current.set(None)
+    if trace is not None:
+        trace.finish(outcome)
+
+
+def set_session(session_db_id):
+    """Tag the current trace with a session id assigned during the rerun."""
+    trace = _current.get()
+    if trace is not None:
+        trace.set_session(session_db_id)
+
+
+@contextmanager
+def span(op, description=None, **data):
+    """
+    Time a phase of the current rerun. Yields a handle whose set_data() adds fields (token counts, row
+    counts...); a no-op when this rerun isn't traced.
+    """
+    trace = _current.get()
+    if trace is None:
+        yield _NOOP_SPAN
+        return
+    handle = _Span(trace, op, description, data)
+    try:
+        yield handle
+    except BaseException as e:
+        handle.finish("ok" if type(e).__name__ in _CONTROL_FLOW else "internal_error")
+        raise
+    handle.finish()
+
+
+def traced(op, description=None):
+    """Decorator: run the function inside span(op, description or its name)."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return func(*args, **kwargs)
+            with span(op, description or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _TracedCalls:
+    """Proxy for a module or object whose listed functions each run in a span; other attributes pass through."""
+
+    def __init__(self, target, op, names, label=None):
+        self._target = target
+        label = label or target.__name__
+        for name in names:
+            func = getattr(target, name, None)
+            if callable(func):
+                setattr(self, name, traced(op, f"{label}.{name}")(func))
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+
+def trace_calls(target, op, names, label=None):
+    """
+    Return target with the functions in names traced as op spans (described as "label.name", label defaulting
+    to the module's name), or target itself when tracing is off.
+    """
+    if not TRACE_EXPORTERS:
+        return target
+    return _TracedCalls(target, op, names, label)
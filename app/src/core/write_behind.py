@@ -0,0 +1,176 @@
+import time
+import queue
+import atexit
+import random
+import threading
+import logging
+
+logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """
+    Bounded queue drained by a background thread that hands batches of queued writes to `flush_batch`.
+
+    Items are flushed in the order they were enqueued. A batch that fails with one of `transient_errors` is
+    retried with backoff; after `max_retries` it is passed to `on_failure` and dropped so one bad batch
+    cannot block the queue. A batch that fails with any other error is split in halves and retried, so only
+    the items that fail on their own (e.g. a row violating a constraint) are passed to `on_failure`; this
+    relies on `flush_batch` writing a batch atomically. If the queue is full for `enqueue_timeout` seconds,
+    the write runs synchronously in the caller instead of being lost.
+    """
+
+    def __init__(self, flush_batch, name="write-behind", maxsize=1000, batch_size=100, flush_interval=0.2,
+                 enqueue_timeout=1.0, max_retries=5, retry_base=0.5, transient_errors=(Exception,), on_failure=None):
+        self._flush_batch = flush_batch
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.transient_errors = transient_errors
+        self._on_failure = on_failure
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "batches": 0,
+            "retries": 0,
+            "failed_items": 0,
+            "sync_fallbacks": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, item):
+        if self._closed:
+            self._write([item])
+            return
+        try:
+            self._queue.put(item, timeout=self.enqueue_timeout)
+        except queue.Full:
+            logging.warning("Write-behind queue is full; writing synchronously")
+            self._incr("sync_fallbacks")
+            self._write([item])
+            return
+        self._incr("enqueued")
+
+    def flush(self, timeout=None):
+        """Block until everything enqueued so far has been written (or dropped)."""
+        if self._closed:
+            return
+        done = threading.Event()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return  # Still full after `timeout`: give up like a timed-out wait
+        done.wait(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+    def close(self, timeout=10.0):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.error(f"Write-behind queue did not drain within {timeout}s; {self._queue.qsize()} items pending")
+
+    def stats(self):
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        snapshot["queue_depth"] = self._queue.qsize()
+        snapshot["avg_flush_ms"] = snapshot["total_flush_ms"] / snapshot["batches"] if snapshot["batches"] else 0.0
+        return snapshot
+
+    def _incr(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch, markers, stop = [], [], False
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    markers.append(item)
+                else:
+                    batch.append(item)
+                # A flush marker means a reader is waiting: write what we have instead of waiting out the interval
+                if stop or markers or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+            for marker in markers:
+                marker.set()
+            if stop:
+                # Drain anything that raced in behind the stop marker.
+                leftover = []
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if isinstance(item, threading.Event):
+                        item.set()
+                    elif item is not _STOP:
+                        leftover.append(item)
+                if leftover:
+                    self._write(leftover)
+                return
+
+    def _write(self, batch):
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                self._flush_batch(batch)
+            except self.transient_errors as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    logging.error(f"Dropping {len(batch)} queued writes after {self.max_retries} retries: {e}")
+                    self._incr("failed_items", len(batch))
+                    if self._on_failure is not None:
+                        self._on_failure(batch, e)
+                    return
+                delay = random.uniform(0, self.retry_base * (2 ** (attempt - 1)))
+                logging.warning(f"Queued write batch failed ({e}); retry {attempt} in {delay:.2f}s")
+                self._incr("retries")
+                time.sleep(delay)
+                continue
+            except Exception as e:
+                if len(batch) > 1:
+                    # Bisect to find the bad items; the rest of the batch (often other sessions' writes) is kept
+                    logging.warning(f"Queued write batch of {len(batch)} failed ({e}); retrying in halves")
+                    middle = len(batch) // 2
+                    self._write(batch[:middle])
+                    self._write(batch[middle:])
+                    return
+                logging.exception(f"Dropping a queued write after non-retryable error: {e}")
+                self._incr("failed_items")
+                if self._on_failure is not None:
+                    self._on_failure(batch, e)
+                return
+            elapsed_ms = (time.monotonic() - start) * 1000
+            with self._stats_lock:
+                self._stats["written"] += len(batch)
+                self._stats["batches"] += 1
+                self._stats["last_flush_ms"] = elapsed_ms
+                self._stats["max_flush_ms"] = max(self._stats["max_flush_ms"], elapsed_ms)
+                self._stats["total_flush_ms"] += elapsed_ms
+            return
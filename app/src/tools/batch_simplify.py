@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Simplify whole Latin texts passage by passage through GeminiPipeline.
+
+    python batch_simplify.py book4.txt --level 1 --output_dir out/
+    python batch_simplify.py texts/ --level 2 --concurrency 8 --rpm 60
+    python batch_simplify.py --level 1 --output_dir out/          # smoke test on u1.0_virgil_user.jinja2
+
+Each passage's result is written to its own markdown file in --output_dir, and progress is recorded in
+checkpoint.jsonl there, so an interrupted run picks up where it stopped when started again with the same
+arguments. --batch-api submits everything as one Gemini Batch API job instead (cheaper, not interactive);
+if the endpoint does not offer it the tool falls back to online requests.
+"""
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+from pathlib import Path
+import logging
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "core"))
+import prompt_registry
+from gemini_pipeline import GeminiPipeline
+
+logging.getLogger(__name__)
+
+DEFAULT_SOURCE_TEMPLATE = "u1.0_virgil_user.jinja2"
+TEXT_SUFFIXES = (".txt", ".md", ".jinja2")
+BATCH_DONE_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+_SENTENCE_END = re.compile(r'(?<=[.!?;:])\s+')
+
+
+def split_passages(text, max_lines=10, max_chars=1500):
+    """
+    Split a text into passages: blank lines always end a passage, verse is grouped max_lines at a time, and
+    prose lines longer than max_chars are split on sentence boundaries.
+    """
+    passages = []
+    for block in re.split(r'\n\s*\n', text):
+        lines = []
+        for line in (l.rstrip() for l in block.splitlines()):
+            if not line.strip():
+                continue
+            if len(line) <= max_chars:
+                lines.append(line)
+                continue
+            piece = ""
+            for sentence in _SENTENCE_END.split(line):
+                if piece and len(piece) + len(sentence) + 1 > max_chars:
+                    lines.append(piece)
+                    piece = ""
+                piece = f"{piece} {sentence}".strip()
+            if piece:
+                lines.append(piece)
+        current = []
+        for line in lines:
+            if current and (len(current) >= max_lines or sum(len(l) + 1 for l in current) + len(line) > max_chars):
+                passages.append("\n".join(current))
+                current = []
+            current.append(line)
+        if current:
+            passages.append("\n".join(current))
+    return passages
+
+
+def load_sources(inputs, registry):
+    """Return [(source name, text)] for the input files/directories, or the sample template if none."""
+    if not inputs:
+        return [(Path(DEFAULT_SOURCE_TEMPLATE).stem, registry.render(DEFAULT_SOURCE_TEMPLATE))]
+    sources = []
+    for item in inputs:
+        path = Path(item)
+        files = sorted(p for p in path.rglob("*") if p.suffix in TEXT_SUFFIXES) if path.is_dir() else [path]
+        for file in files:
+            text = file.read_text(encoding="utf-8")
+            if file.suffix == ".jinja2":
+                text = re.sub(r'\{#.*?#\}', '', text, flags=re.S)  # Template comments aren't part of the text
+            sources.append((file.stem, text))
+    return sources
+
+
+class RateLimiter:
+    """Spaces request starts at least 60/rpm seconds apart (rpm <= 0 disables it)."""
+
+    def __init__(self, rpm):
+        self.interval = 60.0 / rpm if rpm and rpm > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class Checkpoint:
+    """
+    Append-only record of finished passages in the output directory. A passage is done when its latest record
+    has status "ok" for the same request fingerprint (passage, model, system prompt) and its file exists.
+    """
+
+    def __init__(self, output_dir):
+        self.path = Path(output_dir) / "checkpoint.jsonl"
+        self.done = {}
+        if self.path.exists():
+            with self.path.open(encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.done[record["id"]] = record
+        self._fh = self.path.open("a", encoding="utf-8")
+
+    def is_done(self, passage_id, fingerprint, output_path):
+        record = self.done.get(passage_id)
+        return (
+            record is not None
+            and record.get("status") == "ok"
+            and record.get("fingerprint") == fingerprint
+            and Path(output_path).exists()
+        )
+
+    def record(self, passage_id, fingerprint, status, **fields):
+        record = {"id": passage_id, "fingerprint": fingerprint, "status": status, **fields}
+        self.done[passage_id] = record
+        self._fh.write(json.dumps(record) + "\n")
+        self._fh.flush()
+
+    def close(self):
+        self._fh.close()
+
+
+def write_output(path, source, index, level, passage, result):
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(
+        f"# {source}, passage {index}\n\n"
+        f"## Original\n\n{passage}\n\n"
+        f"## Simplified (Level {level})\n\n{result.strip()}\n",
+        encoding="utf-8",
+    )
+    os.replace(tmp, path)
+
+
+def build_jobs(args, registry):
+    level_template = registry.find(f"*level{args.level}*.jinja*")
+    if level_template is None:
+        raise SystemExit(f"No level {args.level} system prompt in {registry.prompts_dir}")
+    system_prompt = registry.render(level_template)
+    prompt_version = registry.version(level_template)
+
+    jobs = []
+    for source, text in load_sources(args.input, registry):
+        for index, passage in enumerate(split_passages(text, args.max_lines, args.max_chars), start=1):
+            passage_id = f"{source}-{index:04d}"
+            fingerprint = hashlib.sha256(
+                f"{args.model}\x00{prompt_version}\x00{passage}".encode("utf-8")
+            ).hexdigest()[:16]
+            body = {
+                "model": args.model,
+                "messages": [{"role": "system", "content": system_prompt}, {"role": "user", "content": passage}],
+                "temperature": args.temperature,
+            }
+            jobs.append({
+                "id": passage_id,
+                "source": source,
+                "index": index,
+                "passage": passage,
+                "fingerprint": fingerprint,
+                "body": body,
+                "output": Path(args.output_dir) / f"{passage_id}.md",
+            })
+    return jobs
+
+
+async def run_online(pipeline, jobs, checkpoint, args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limiter = RateLimiter(args.rpm)
+    counts = {"ok": 0, "failed": 0}
+
+    async def simplify(job):
+        async with semaphore:
+            await limiter.wait()
+            start = time.monotonic()
+            try:
+                result = await pipeline.complete(job["body"])
+            except Exception as e:
+                logging.error(f"{job['id']} failed: {e}")
+                checkpoint.record(job["id"], job["fingerprint"], "failed", error=str(e))
+                counts["failed"] += 1
+                return
+            write_output(job["output"], job["source"], job["index"], args.level, job["passage"], result)
+            checkpoint.record(job["id"], job["fingerprint"], "ok", seconds=round(time.monotonic() - start, 2))
+            counts["ok"] += 1
+            print(f"[{counts['ok'] + counts['failed']}/{len(jobs)}] {job['id']} done in {time.monotonic() - start:.1f}s")
+
+    await asyncio.gather(*(simplify(job) for job in jobs))
+    return counts
+
+
+async def run_batch_api(pipeline, jobs, checkpoint, args):
+    """
+    Submit the pending passages as one Batch API job (resuming a job already submitted for this output
+    directory), wait for it and write the results. Returns None if the endpoint has no Batch API.
+    """
+    client = pipeline._get_client()
+    job_file = Path(args.output_dir) / "batch_job.json"
+    requests = []
+    for job in jobs:
+        request = pipeline._prepare_request(job["body"], {}, None)
+        if isinstance(request, str):
+            raise SystemExit(f"{job['id']}: {request}")
+        _, model_id, contents, gen_config = request
+        requests.append({"contents": contents, "config": gen_config})
+
+    submitted = json.loads(job_file.read_text()) if job_file.exists() else None
+    if submitted is None or submitted.get("ids") != [job["id"] for job in jobs]:
+        try:
+            batch = await client.aio.batches.create(
+                model=args.model,
+                src=requests,
+                config={"display_name": f"batch-simplify-{Path(args.output_dir).name}"},
+            )
+        except Exception as e:
+            logging.warning(f"Batch API unavailable, falling back to online requests: {e}")
+            return None
+        submitted = {"name": batch.name, "ids": [job["id"] for job in jobs]}
+        job_file.write_text(json.dumps(submitted))
+        print(f"Submitted batch job {batch.name} with {len(jobs)} passages")
+
+    while True:
+        batch = await client.aio.batches.get(name=submitted["name"])
+        state = getattr(batch.state, "name", str(batch.state))
+        if state in BATCH_DONE_STATES:
+            break
+        print(f"Batch job {submitted['name']}: {state}")
+        await asyncio.sleep(args.poll_interval)
+    job_file.unlink()
+    if state != "JOB_STATE_SUCCEEDED":
+        raise SystemExit(f"Batch job {submitted['name']} ended in {state}: {getattr(batch, 'error', None)}")
+
+    counts = {"ok": 0, "failed": 0}
+    for job, response in zip(jobs, batch.dest.inlined_responses):
+        if getattr(response, "error", None) or response.response is None:
+            checkpoint.record(job["id"], job["fingerprint"], "failed", error=str(response.error))
+            counts["failed"] += 1
+            continue
+        result = pipeline._handle_standard_response(response.response)
+        write_output(job["output"], job["source"], job["index"], args.level, job["passage"], result)
+        checkpoint.record(job["id"], job["fingerprint"], "ok", batch=submitted["name"])
+        counts["ok"] += 1
+    return counts
+
+
+async def main_async(args):
+    registry = prompt_registry.get_registry()
+    Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+    jobs = build_jobs(args, registry)
+    checkpoint = Checkpoint(args.output_dir)
+    pending = [job for job in jobs if not checkpoint.is_done(job["id"], job["fingerprint"], job["output"])]
+    print(f"{len(jobs)} passages, {len(jobs) - len(pending)} already done, {len(pending)} to simplify")
+
+    pipeline = GeminiPipeline(input_data={})
+    start = time.monotonic()
+    try:
+        counts = None
+        if pending and args.batch_api:
+            counts = await run_batch_api(pipeline, pending, checkpoint, args)
+        if counts is None:
+            counts = await run_online(pipeline, pending, checkpoint, args) if pending else {"ok": 0, "failed": 0}
+    finally:
+        checkpoint.close()
+    elapsed = time.monotonic() - start
+    rate = counts["ok"] / (elapsed / 60) if elapsed > 0 else 0.0
+    print(
+        f"Simplified {counts['ok']} passages ({counts['failed']} failed) in {elapsed:.1f}s: "
+        f"{rate:.1f} passages/min. Output in {args.output_dir}"
+    )
+    return 1 if counts["failed"] else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simplify Latin texts passage by passage with Gemini.")
+    parser.add_argument("input", nargs="*", help=f"Text files or directories (default: the {DEFAULT_SOURCE_TEMPLATE} sample)")
+    parser.add_argument("--level", choices=["1", "2"], default="1", help="Simplification level prompt to use")
+    parser.add_argument("--model", default=os.getenv("BATCH_SIMPLIFY_MODEL", "gemini-2.5-pro"))
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--output_dir", default="batch_output", help="Directory for per-passage results and the checkpoint")
+    parser.add_argument("--max_lines", type=int, default=10, help="Maximum lines per passage")
+    parser.add_argument("--max_chars", type=int, default=1500, help="Maximum characters per passage")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight at once")
+    parser.add_argument("--rpm", type=float, default=30, help="Maximum requests started per minute (0 = unlimited)")
+    parser.add_argument("--batch-api", action="store_true", help="Submit a Gemini Batch API job instead of online requests")
+    parser.add_argument("--poll_interval", type=float, default=30, help="Seconds between Batch API status checks")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
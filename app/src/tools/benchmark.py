@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Offline benchmarks for the app's hot paths: pipeline request/response handling, the session stores, prompt
+rendering and full Streamlit reruns (AppTest with a stubbed pipeline). No network is needed; the Postgres
+suite runs only when DB_NAME/DB_USER/DB_PASSWORD point at a reachable server (e.g. a local container).
+
+    python benchmark.py                                  # all suites, compared with the stored baseline
+    python benchmark.py --suite pipeline --suite sqlite
+    python benchmark.py --save-baseline                  # record this run as the new baseline
+    python benchmark.py --fail-on-regression             # exit 1 if anything is slower than the threshold
+
+Results are written as JSON to --output (default app/data/benchmarks/results-<timestamp>.json).
+"""
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import asyncio
+import platform
+import argparse
+import statistics
+import subprocess
+import tempfile
+from pathlib import Path
+from datetime import datetime, timezone
+import logging
+
+CORE_DIR = Path(__file__).resolve().parent.parent / "core"
+sys.path.insert(0, str(CORE_DIR))
+
+from stats_util import percentile
+
+logging.getLogger(__name__)
+
+BENCH_DIR = Path(__file__).resolve().parent.parent.parent / "data" / "benchmarks"
+BASELINE_PATH = BENCH_DIR / "baseline.json"
+UI_SCRIPT = CORE_DIR / "streamlit_ui_chatapi.py"
+SUITES = ["pipeline", "prompts", "sqlite", "postgres", "rerun"]
+CANNED_REPLY = (
+    "Simplified passage:\n\nSed fatis incerta sum: Iuppiter fortasse non vult unam urbem esse Tyriis et Troianis.\n\n"
+    "Notes: `incerta` agrees with the speaker (Venus); `feror` is rendered with `sum`."
+)
+
+
+def conversation(turns, words=120):
+    """A synthetic chat history of `turns` user/assistant exchanges."""
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"Turn {i}: please simplify this passage. " + "arma virumque cano " * (words // 3)})
+        messages.append({"role": "assistant", "content": f"Reply {i}: " + "Troiae qui primus ab oris " * (words // 5)})
+    return messages
+
+
+class Bench:
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = {}
+        self.skipped = {}
+        self.failed = {}
+
+    def time(self, name, func, repeat=None, number=1):
+        """Run func `number` times per sample, `repeat` samples; store per-call statistics in ms."""
+        samples = []
+        for _ in range(repeat or self.repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            samples.append((time.perf_counter() - start) * 1000 / number)
+        self.record(name, samples)
+
+    def record(self, name, samples):
+        ordered = sorted(samples)
+        self.results[name] = {
+            "n": len(samples),
+            "min_ms": ordered[0],
+            "median_ms": statistics.median(ordered),
+            "mean_ms": statistics.fmean(ordered),
+            "p95_ms": percentile(ordered, 95),
+            "max_ms": ordered[-1],
+        }
+        print(f"  {name:<45} median {self.results[name]['median_ms']:9.3f} ms  (min {ordered[0]:.3f}, n={len(samples)})")
+
+    def skip(self, suite, reason):
+        self.skipped[suite] = reason
+        print(f"  skipped: {reason}")
+
+    def fail(self, suite, error):
+        # Recorded instead of aborting, so the other suites' results are still written
+        self.failed[suite] = f"{type(error).__name__}: {error}"
+        logging.error(f"Benchmark suite {suite} failed", exc_info=error)
+        print(f"  FAILED: {self.failed[suite]}")
+
+
+def bench_pipeline(bench, args):
+    from gemini_pipeline import GeminiPipeline
+
+    pipeline = GeminiPipeline(input_data={})
+    pipeline.log.setLevel(logging.WARNING)
+    system_prompt = (CORE_DIR.parent.parent / "prompts" / "level1_system_prompt.jinja2").read_text(encoding="utf-8")
+    for turns in (10, 100, 500):
+        messages = [{"role": "system", "content": system_prompt}] + conversation(turns)
+        bench.time(f"pipeline.prepare_content[{turns} turns]", lambda: pipeline._prepare_content(messages), number=10)
+    body = {"model": "gemini-2.5-pro", "messages": messages}
+    bench.time(
+        "pipeline.configure_generation",
+        lambda: pipeline._configure_generation(body, system_prompt, "gemini-2.5-pro", {}, None),
+        number=100,
+    )
+    part = types.SimpleNamespace(text=CANNED_REPLY * 20)
+    response = types.SimpleNamespace(
+        prompt_feedback=None,
+        candidates=[types.SimpleNamespace(finish_reason="STOP", content=types.SimpleNamespace(parts=[part] * 5))],
+    )
+    bench.time("pipeline.handle_standard_response", lambda: pipeline._handle_standard_response(response), number=100)
+
+    # A whole complete() call replayed from a cassette: everything the pipeline does for a turn except the network
+    import cassette
+    import async_runner
+    replay_body = {"model": "gemini-2.5-pro", "messages": [{"role": "system", "content": system_prompt}] + conversation(10)}
+    client, model_id, contents, gen_config = pipeline._prepare_request(replay_body, {}, None)
+    reply = {"candidates": [{"content": {"role": "model", "parts": [{"text": CANNED_REPLY}]}, "finishReason": "STOP"}]}
+    key = cassette.request_key("generate", model_id, contents, gen_config)
+    cassette.get_store().save(key, "generate", model_id, contents, gen_config, [reply], [0.0])
+    bench.time("pipeline.complete[cassette replay, 10 turns]", lambda: async_runner.run(pipeline.complete(replay_body)))
+
+
+def bench_prompts(bench, args):
+    import prompt_registry
+
+    def cold():
+        shutil.rmtree(os.environ["PROMPT_BYTECODE_CACHE_DIR"], ignore_errors=True)
+        prompt_registry.PromptRegistry().render("level1_system_prompt.jinja2", {})
+
+    bench.time("prompts.render[cold, no bytecode cache]", cold)
+    bench.time("prompts.render[new registry, bytecode cache]", lambda: prompt_registry.PromptRegistry().render("level1_system_prompt.jinja2", {}))
+    registry = prompt_registry.get_registry()
+    registry.render("level1_system_prompt.jinja2", {})
+    # render_jinja_prompt in the UI is a call to the shared registry
+    bench.time("prompts.render[warm registry]", lambda: registry.render("level1_system_prompt.jinja2", {}), number=100)
+
+
+def _bench_store(bench, prefix, store, messages_per_session=50):
+    store.ensure_sessions_table()
+    session_ids = []
+
+    def create():
+        session_ids.append(store.save_session("Benchmark Session", session_data={"session_title": "Benchmark Session", "level_chatapi": "Level I"}))
+
+    bench.time(f"{prefix}.save_session[insert]", create)
+    session_id = session_ids[0]
+    bench.time(f"{prefix}.save_session[update patch]", lambda: store.save_session("Benchmark Session", {"level_selected": True}, session_db_id=session_id))
+    bench.time(f"{prefix}.log_message", lambda: store.log_message(session_id, "user", "Salve! Quid agis?"), number=messages_per_session // 5 or 1)
+
+    def enqueue_burst():
+        for i in range(messages_per_session):
+            store.enqueue_message(session_id, "assistant", f"Bene valeo {i}.")
+        store.flush_writes()
+
+    bench.time(f"{prefix}.enqueue_message+flush[{messages_per_session}]", enqueue_burst)
+    bench.time(f"{prefix}.get_session_messages", lambda: store.get_session_messages(session_id), number=10)
+    bench.time(f"{prefix}.load_session", lambda: store.load_session(session_id), number=10)
+    bench.time(f"{prefix}.list_sessions", lambda: store.list_sessions(), number=10)
+    for sid in session_ids:
+        store.delete_session(sid)
+
+
+def bench_sqlite(bench, args):
+    import session_store
+    store = session_store.get_store("sqlite")
+    _bench_store(bench, "sqlite", store)
+    print(f"  pool: {store.pool_stats()}")
+
+
+def bench_postgres(bench, args):
+    if not all(os.getenv(name) for name in ("DB_NAME", "DB_USER", "DB_PASSWORD")):
+        bench.skip("postgres", "DB_NAME/DB_USER/DB_PASSWORD not set")
+        return
+    import session_db_postgres
+    try:
+        with session_db_postgres.pooled_conn() as conn:
+            conn.cursor().execute("SELECT 1")
+    except Exception as e:
+        bench.skip("postgres", f"Postgres not reachable: {e}")
+        return
+    import session_store
+    store = session_store.get_store("postgres")
+    _bench_store(bench, "postgres", store)
+    print(f"  pool: {store.pool_stats()}")
+
+
+class StubPipeline:
+    """Stands in for GeminiPipeline in the rerun suite: canned replies, no network."""
+
+    def __init__(self, input_data=None):
+        pass
+
+    async def pipe(self, body, __metadata__=None, __event_emitter__=None, __tools__=None):
+        await asyncio.sleep(0)
+        return CANNED_REPLY
+
+    async def pipe_stream(self, body, __metadata__=None, __event_emitter__=None, __tools__=None):
+        for line in CANNED_REPLY.splitlines(keepends=True):
+            await asyncio.sleep(0)
+            yield line
+
+
+def bench_rerun(bench, args):
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError as e:
+        bench.skip("rerun", f"streamlit AppTest unavailable: {e}")
+        return
+    import sentry_sdk
+
+    stub = types.ModuleType("gemini_pipeline")
+    stub.GeminiPipeline = StubPipeline
+    real_pipeline = sys.modules.get("gemini_pipeline")
+    real_sentry_init = sentry_sdk.init
+    sys.modules["gemini_pipeline"] = stub
+    sentry_sdk.init = lambda *a, **k: None  # Keep the benchmark offline
+    try:
+        at = AppTest.from_file(str(UI_SCRIPT), default_timeout=120)
+        bench.time("rerun.first_run", lambda: at.run(), repeat=1)
+        at.selectbox(key="level_chatapi").select("Level I")
+        bench.time("rerun.select_level", lambda: at.run(), repeat=1)
+        # Selecting a level saves the session and reruns; the chat input only exists if the level survived that
+        if at.exception or at.session_state["level_chatapi"] != "Level I" or "chat_input_text" not in [t.key for t in at.text_area]:
+            raise RuntimeError(
+                f"Level selection did not stick after its rerun (level {at.session_state['level_chatapi']!r}, "
+                f"exception {at.exception})"
+            )
+        turn_samples = []
+        for turn in range(args.turns):
+            at.text_area(key="chat_input_text").input(f"Turn {turn}: " + "arma virumque cano " * 20)
+            at.button(key="send_chat_btn").click()
+            start = time.perf_counter()
+            at.run()
+            turn_samples.append((time.perf_counter() - start) * 1000)
+            if at.exception:
+                raise RuntimeError(f"Script raised during turn {turn}: {at.exception}")
+        bench.record(f"rerun.send_turn[{args.turns} turns]", turn_samples)
+        bench.time(f"rerun.idle[{len(at.session_state['chat_messages'])} messages]", lambda: at.run())
+    finally:
+        sentry_sdk.init = real_sentry_init
+        if real_pipeline is not None:
+            sys.modules["gemini_pipeline"] = real_pipeline
+        else:
+            sys.modules.pop("gemini_pipeline", None)
+
+
+BENCHMARKS = {
+    "pipeline": bench_pipeline,
+    "prompts": bench_prompts,
+    "sqlite": bench_sqlite,
+    "postgres": bench_postgres,
+    "rerun": bench_rerun,
+}
+
+
+def compare(results, baseline, threshold):
+    """Print median ratios against the baseline; return the names that got slower than `threshold`."""
+    regressions = []
+    base = baseline.get("results", {})
+    print(f"\nCompared with baseline from {baseline.get('meta', {}).get('timestamp', 'unknown')}:")
+    for name, result in results.items():
+        if name not in base:
+            print(f"  {name:<45} (new)")
+            continue
+        ratio = result["median_ms"] / base[name]["median_ms"] if base[name]["median_ms"] else float("inf")
+        flag = ""
+        if ratio > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 / threshold:
+            flag = "  faster"
+        print(f"  {name:<45} {base[name]['median_ms']:9.3f} -> {result['median_ms']:9.3f} ms  x{ratio:.2f}{flag}")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=CORE_DIR, text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline benchmark suite.")
+    parser.add_argument("--suite", action="append", choices=SUITES, help="Suite to run (repeatable; default: all)")
+    parser.add_argument("--repeat", type=int, default=20, help="Samples per benchmark")
+    parser.add_argument("--turns", type=int, default=10, help="Chat turns driven through the rerun suite")
+    parser.add_argument("--output", default=None, help="Results JSON path")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH), help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Median slowdown ratio reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit 1 when a regression is found")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="digital-latin-bench-"))
+    # Everything the suites write goes to a scratch directory, never to app/data
+    os.environ["SESSION_EVENT_LOG"] = "false"
+    os.environ["SESSION_DB_BACKEND"] = "sqlite"
+    os.environ["SQLITE_DB_PATH"] = str(workdir / "sessions.db")
+    os.environ["SESSION_LOCAL_STORE_DIR"] = str(workdir / "local")
+    os.environ["PROMPT_BYTECODE_CACHE_DIR"] = str(workdir / "jinja")
+    os.environ.setdefault("GEMINI_RESPONSE_CACHE", "off")
+    os.environ["GEMINI_CASSETTE_MODE"] = "replay"  # The pipeline suite never reaches Gemini
+    os.environ["GEMINI_CASSETTE_DIR"] = str(workdir / "cassettes")
+    os.environ["GEMINI_CASSETTE_LATENCY"] = "off"
+    logging.basicConfig(level=logging.WARNING)
+
+    bench = Bench(args.repeat)
+    try:
+        for suite in args.suite or SUITES:
+            print(f"[{suite}]")
+            try:
+                BENCHMARKS[suite](bench, args)
+            except ImportError as e:
+                bench.skip(suite, f"missing dependency: {e}")
+            except Exception as e:
+                bench.fail(suite, e)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "results": bench.results,
+        "skipped": bench.skipped,
+        "failed": bench.failed,
+    }
+    output = Path(args.output or BENCH_DIR / f"results-{datetime.now().strftime('%Y%m%dT%H%M%S')}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"\nResults written to {output}")
+
+    regressions = []
+    baseline_path = Path(args.baseline)
+    if baseline_path.exists() and not args.save_baseline:
+        regressions = compare(bench.results, json.loads(baseline_path.read_text()), args.threshold)
+    elif not baseline_path.exists():
+        print(f"No baseline at {baseline_path}; run with --save-baseline to create one.")
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(report, indent=2))
+        print(f"Baseline saved to {baseline_path}")
+    if bench.failed:
+        print(f"\nFailed suites: {', '.join(bench.failed)}")
+        sys.exit(1)
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,39 @@
 import os
+import json
 import psycopg2
 from pathlib import Path
-import json
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
 import logging
 
 logging.getLogger(__name__)
 
+# WHY: Sessions and their messages are read with one server-side cursor: each row is a session with its
+# messages aggregated as JSON (a LATERAL lookup on messages_session_id_id_idx), fetched FETCH_SIZE rows at a
+# time. That replaces the old list_sessions() + two queries and two connections per session, and never holds
+# the whole export in memory.
+# Logging a message doesn't touch sessions.updated_at, so a session's last activity is the later of that and its
+# newest message; incremental exports filter and keep their watermark on it.
+EXPORT_QUERY = '''
+    SELECT s.id, s.name, NULLIF(s.data::text, '')::jsonb ->> 'level_chatapi', s.created_at, s.updated_at, s.end_reason,
+           COALESCE(m.messages, '[]'::json), GREATEST(s.updated_at, m.last_message_at)
+    FROM sessions s
+    LEFT JOIN LATERAL (
+        SELECT json_agg(json_build_object(
+                   'id', mm.id, 'role', mm.role, 'content', mm.content, 'timestamp', mm.timestamp, 'time_delta', mm.time_delta
+               ) ORDER BY mm.id) AS messages,
+               MAX(mm.timestamp) AS last_message_at
+        FROM messages mm
+        WHERE mm.session_id = s.id
+    ) m ON true
+    WHERE (%(since)s::timestamptz IS NULL OR GREATEST(s.updated_at, m.last_message_at) > %(since)s::timestamptz)
+    ORDER BY s.updated_at DESC, s.id DESC
+    OFFSET %(offset)s
+    LIMIT %(limit)s
+'''
+FETCH_SIZE = 200
+STATE_FILE = ".export_state.json"
+
 # Local Development Settings: Ensure the environment variables are set for PostgreSQL connection
 def get_conn():
     return psycopg2.connect(
@@ -16,81 +44,200 @@ def get_conn():
         port=os.getenv("POSTGRES_PORT", "5432")
     )
 
-def list_sessions():
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute('SELECT id, name, created_at, updated_at FROM sessions ORDER BY updated_at DESC')
-    sessions = c.fetchall()
-    conn.close()
-    return sessions
+def iter_sessions(conn, start=None, end=None, since=None, fetch_size=FETCH_SIZE):
+    """
+    Yield session dicts (with a "messages" list) newest first, optionally sliced by [start:end] positions
+    and limited to sessions with activity (a session update or a message) after `since`.
+    """
+    offset = start or 0
+    limit = None if end is None else max(0, end - offset)
+    c = conn.cursor(name="export_sessions")  # Named cursor = server-side, streamed in itersize batches
+    c.itersize = fetch_size
+    c.execute(EXPORT_QUERY, {"since": since, "offset": offset, "limit": limit})
+    for session_id, name, level, created_at, updated_at, end_reason, messages, last_activity in c:
+        yield {
+            "session_id": session_id,
+            "name": name,
+            "level": level,
+            "created_at": created_at,
+            "updated_at": updated_at,
+            "end_reason": end_reason,
+            "messages": json.loads(messages) if isinstance(messages, str) else messages,
+            "last_activity": last_activity,
+        }
+    c.close()
 
-def get_session_messages(session_id):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute('SELECT id, role, content, timestamp, time_delta FROM messages WHERE session_id=%s ORDER BY id ASC', (session_id,))
-    messages = c.fetchall()
-    conn.close()
-    return messages
+def session_markdown(session):
+    md_lines = [f"# Session: {session['name'] or 'Untitled'}\n",
+                f"- **Session ID:** {session['session_id']}",
+                f"- **Level Selected:** {session['level'] if session['level'] else 'Unknown'}",
+                f"- **Created:** {session['created_at']}",
+                f"- **Last Updated:** {session['updated_at']}",
+                "\n---\n"]
+    for msg in session["messages"]:
+        role_label = "**User**" if msg["role"] == "user" else "**Assistant**"
+        delta_str = f" _(Δ {msg['time_delta']:.1f}s)_" if msg["time_delta"] is not None else ""
+        md_lines.append(f"- {role_label} [{msg['timestamp']}]{delta_str}:\n\n    {msg['content']}\n")
+    return "\n".join(md_lines)
 
-def export_sessions_to_markdown(output_dir="../data/session_exports_md", start=None, end=None):
+def write_markdown(session, output_dir):
+    name = session["name"]
+    safe_name = name.replace(" ", "_").replace("/", "-") if name else "session"
+    # The id keeps sessions with the same title from overwriting each other
+    out_path = Path(output_dir) / f"{session['session_id']}_{safe_name}.md"
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.write(session_markdown(session))
+    logging.info(f"Exported session {session['session_id']} to {out_path}")
+
+def _json_record(session):
+    record = {key: value for key, value in session.items() if key != "last_activity"}
+    return {**record, "created_at": _iso(session["created_at"]), "updated_at": _iso(session["updated_at"])}
+
+def _iso(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+class JsonlWriter:
+    def __init__(self, path):
+        self.path = path
+        self._fh = open(path, "w", encoding="utf-8")
+
+    def write(self, session):
+        self._fh.write(json.dumps(_json_record(session), ensure_ascii=False, default=str) + "\n")
+
+    def close(self):
+        self._fh.close()
+
+class ParquetWriter:
+    """Writes sessions in row groups of `batch_size`, one row per session with its messages as a list column."""
+
+    def __init__(self, path, batch_size=FETCH_SIZE):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet output requires pyarrow (pip install pyarrow)")
+        self._pa = pa
+        self.path = path
+        self.batch_size = batch_size
+        message = pa.struct([
+            ("id", pa.int64()), ("role", pa.string()), ("content", pa.string()),
+            ("timestamp", pa.string()), ("time_delta", pa.float64()),
+        ])
+        self.schema = pa.schema([
+            ("session_id", pa.int64()), ("name", pa.string()), ("level", pa.string()),
+            ("created_at", pa.string()), ("updated_at", pa.string()), ("end_reason", pa.string()),
+            ("messages", pa.list_(message)),
+        ])
+        self._writer = pq.ParquetWriter(path, self.schema)
+        self._rows = []
+
+    def write(self, session):
+        record = _json_record(session)
+        record["created_at"], record["updated_at"] = str(record["created_at"]), str(record["updated_at"])
+        self._rows.append(record)
+        if len(self._rows) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            self._writer.write_table(self._pa.Table.from_pylist(self._rows, schema=self.schema))
+            self._rows = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+def load_watermark(output_dir, fmt):
+    path = Path(output_dir) / STATE_FILE
+    if not path.exists():
+        return None
+    return json.loads(path.read_text()).get(fmt)
+
+def save_watermark(output_dir, fmt, watermark):
+    path = Path(output_dir) / STATE_FILE
+    state = json.loads(path.read_text()) if path.exists() else {}
+    state[fmt] = watermark
+    path.write_text(json.dumps(state, indent=2))
+
+def export_sessions(output_dir="../data/session_exports_md", start=None, end=None, fmt="md", incremental=False,
+                    since=None, workers=4, fetch_size=FETCH_SIZE):
+    """
+    Export sessions as one markdown file per session (fmt="md", written by `workers` threads) or as a single
+    JSONL/Parquet file. With incremental=True only sessions with activity since the previous incremental run are
+    exported, and the newest activity seen (session update or message) is stored in output_dir/.export_state.json.
+    Returns the number of sessions exported.
+    """
     os.makedirs(output_dir, exist_ok=True)
-    sessions = list_sessions()
-    # If a range is specified, slice the sessions list
-    if start is not None or end is not None:
-        sessions = sessions[start:end]
-    for session in sessions:
-        session_id, name, created_at, updated_at = session
-        messages = get_session_messages(session_id)
-        # Try to extract level from session data
-        conn = get_conn()
-        c = conn.cursor()
-        c.execute('SELECT data FROM sessions WHERE id=%s', (session_id,))
-        row = c.fetchone()
-        level = None
-        if row:
-            try:
-                session_data = json.loads(row[0])
-                level = session_data.get("level_chatapi")
-            except Exception:
-                level = None
+    if incremental and since is None:
+        since = load_watermark(output_dir, fmt)
+        logging.info(f"Incremental export of sessions updated after {since}" if since else "No previous export; exporting everything")
+
+    suffix = f"_{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}" if incremental else ""
+    writer = None
+    if fmt == "jsonl":
+        writer = JsonlWriter(Path(output_dir) / f"sessions{suffix}.jsonl")
+    elif fmt == "parquet":
+        writer = ParquetWriter(Path(output_dir) / f"sessions{suffix}.parquet", batch_size=fetch_size)
+
+    count, newest = 0, None
+    conn = get_conn()
+    pool = ThreadPoolExecutor(max_workers=workers) if fmt == "md" and workers > 1 else None
+    pending = []
+    try:
+        for session in iter_sessions(conn, start=start, end=end, since=since, fetch_size=fetch_size):
+            if pool is not None:
+                pending.append(pool.submit(write_markdown, session, output_dir))
+                if len(pending) >= workers * 4:  # Bound the sessions held in memory waiting for a writer
+                    pending.pop(0).result()
+            elif writer is not None:
+                writer.write(session)
+            else:
+                write_markdown(session, output_dir)
+            count += 1
+            activity = session["last_activity"]
+            if activity is not None and (newest is None or activity > newest):
+                newest = activity
+        for future in pending:
+            future.result()
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True)
+        if writer is not None:
+            writer.close()
         conn.close()
-        md_lines = [f"# Session: {name or 'Untitled'}\n",
-                    f"- **Session ID:** {session_id}",
-                    f"- **Level Selected:** {level if level else 'Unknown'}",
-                    f"- **Created:** {created_at}",
-                    f"- **Last Updated:** {updated_at}",
-                    "\n---\n"]
-        for msg in messages:
-            msg_id, role, content, timestamp, time_delta = msg
-            role_label = "**User**" if role == "user" else "**Assistant**"
-            delta_str = f" _(Δ {time_delta:.1f}s)_" if time_delta is not None else ""
-            md_lines.append(f"- {role_label} [{timestamp}]{delta_str}:\n\n    {content}\n")
-        md_content = "\n".join(md_lines)
-        safe_name = name.replace(" ", "_").replace("/", "-") if name else f"session_{session_id}"
-        out_path = Path(output_dir) / f"{safe_name}.md"
-        with open(out_path, "w", encoding="utf-8") as f:
-            f.write(md_content)
-        logging.info(f"Exported session {session_id} to {out_path}")
+
+    if writer is not None:
+        logging.info(f"Exported {count} sessions to {writer.path}")
+    if incremental and newest is not None:
+        save_watermark(output_dir, fmt, _iso(newest))
+    return count
+
+def export_sessions_to_markdown(output_dir="../data/session_exports_md", start=None, end=None):
+    return export_sessions(output_dir=output_dir, start=start, end=end, fmt="md")
 
 if __name__ == "__main__":
     import argparse
-    parser = argparse.ArgumentParser(description="Export sessions to Markdown.")
-    parser.add_argument("--db", default="../data/sessions.db", help="Path to SQLite DB file")
-    parser.add_argument("--out", default="../data/sessions_export.md", help="Output Markdown file")
+    parser = argparse.ArgumentParser(description="Export sessions to Markdown, JSONL or Parquet.")
+    parser.add_argument("--output_dir", default="../data/session_exports_md", help="Directory for exported files")
+    parser.add_argument("--start", type=int, default=None, help="Index of the first session to export (newest first)")
+    parser.add_argument("--end", type=int, default=None, help="Index after the last session to export (exclusive)")
+    parser.add_argument("--format", choices=["md", "jsonl", "parquet"], default="md", help="Output format")
+    parser.add_argument("--incremental", action="store_true", help="Only export sessions with activity since the last incremental run")
+    parser.add_argument("--since", default=None, help="Only export sessions with activity after this ISO timestamp")
+    parser.add_argument("--workers", type=int, default=4, help="Threads writing markdown files")
+    parser.add_argument("--fetch_size", type=int, default=FETCH_SIZE, help="Rows fetched per round trip")
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.INFO)
-    logging.info(f"Exporting sessions from {args.db} to {args.out}")
-    # Interactive prompt if start/end not provided
-    if args.start is None or args.end is None:
-        sessions = list_sessions()
-        total = len(sessions)
-        logging.info(f"There are {total} sessions available (0 to {total-1}).")
-        if args.start is None:
-            start = input(f"Enter start index [0]: ")
-            args.start = int(start) if start.strip() else 0
-        if args.end is None:
-            end = input(f"Enter end index (exclusive) [{total}]: ")
-            args.end = int(end) if end.strip() else total
-
-    export_sessions_to_markdown(output_dir=args.output_dir, start=args.start, end=args.end)
+    logging.info(f"Exporting sessions to {args.output_dir} as {args.format}")
+    total = export_sessions(
+        output_dir=args.output_dir,
+        start=args.start,
+        end=args.end,
+        fmt=args.format,
+        incremental=args.incremental,
+        since=args.since,
+        workers=args.workers,
+        fetch_size=args.fetch_size,
+    )
+    logging.info(f"Exported {total} sessions.")
@@ -1,137 +1,259 @@
+import os
 import sqlite3
-import json
-import re
+import time
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
 import argparse
 
 logging.basicConfig(level=logging.INFO)
 
-DB_PATH = str(Path(__file__).parent / "sessions.db")
+DB_PATH = str(Path(__file__).resolve().parent.parent.parent / "data" / "sessions.db")
+CHUNK_SIZE = 1000
 
-def update_session_names_from_titles():
+# WHY: Each maintenance command is a WHERE predicate plus one set-based statement. JSON is read in the
+# database (json_extract / ->>), and the statement runs over keyset ranges of CHUNK_SIZE ids with a commit
+# after each range, so large cleanups neither pull every row into Python nor hold one huge transaction.
+
+
+class SqliteBackend:
+    name = "sqlite"
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA foreign_keys=ON')  # So deleting a session also deletes its messages
+
+    def sql(self, statement):
+        return statement
+
+    def columns(self):
+        return {row[1] for row in self.conn.execute('PRAGMA table_info(sessions)')}
+
+    def json_field(self, key):
+        return f"CASE WHEN json_valid(data) THEN json_extract(data, '$.{key}') END"
+
+    def has_json(self):
+        return "data IS NOT NULL AND json_valid(data)"
+
+    def name_is_timestamp(self):
+        # 'Session YYYY-MM-DD HH:MM:SS', optionally followed by anything
+        return "name GLOB 'Session [0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]*'"
+
+    def today_bounds(self):
+        # Timestamps are stored as local-time ISO strings, which compare correctly as text
+        start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        return start.isoformat(), (start + timedelta(days=1)).isoformat()
+
+    def close(self):
+        self.conn.close()
+
+
+class PostgresBackend:
+    name = "postgres"
+
+    def __init__(self):
+        import psycopg2  # Only needed for this backend
+        self.conn = psycopg2.connect(
+            dbname=os.getenv("POSTGRES_DB", "sessions"),
+            user=os.getenv("POSTGRES_USER", "postgres"),
+            password=os.getenv("POSTGRES_PASSWORD", "postgres"),
+            host=os.getenv("POSTGRES_HOST", "localhost"),
+            port=os.getenv("POSTGRES_PORT", "5432")
+        )
+
+    def sql(self, statement):
+        return statement.replace("?", "%s")
+
+    def columns(self):
+        c = self.conn.cursor()
+        c.execute("SELECT column_name FROM information_schema.columns WHERE table_name='sessions'")
+        columns = {row[0] for row in c.fetchall()}
+        self.conn.rollback()
+        return columns
+
+    def json_field(self, key):
+        return f"(data::text::jsonb ->> '{key}')"
+
+    def has_json(self):
+        return "data IS NOT NULL AND data::text <> ''"
+
+    def name_is_timestamp(self):
+        return "name ~ '^Session \\d{4}-\\d{2}-\\d{2} \\d{2}:\\d{2}:\\d{2}'"
+
+    def today_bounds(self):
+        start = datetime.now().astimezone().replace(hour=0, minute=0, second=0, microsecond=0)
+        return start, start + timedelta(days=1)
+
+    def close(self):
+        self.conn.close()
+
+
+def _created_today(db):
+    if db.name == "postgres":
+        created = "created_at::text::timestamptz"
+    else:
+        # Legacy SQLite tables only have `timestamp`; newer ones have created_at
+        columns = db.columns()
+        if "created_at" not in columns:
+            created = "timestamp"
+        elif "timestamp" in columns:
+            created = "COALESCE(NULLIF(created_at, ''), timestamp)"
+        else:
+            created = "created_at"
+    return f"{created} >= ? AND {created} < ?", db.today_bounds()
+
+
+def _update_names(db):
+    title = f"TRIM({db.json_field('session_title')})"
+    predicate = f"{db.name_is_timestamp()} AND {db.has_json()} AND COALESCE({title}, '') <> ''"
+    return predicate, (), f"UPDATE sessions SET name = {title}"
+
+
+def _delete_untitled(db):
+    title = f"TRIM({db.json_field('session_title')})"
+    return f"{db.has_json()} AND COALESCE({title}, '') = ''", (), "DELETE FROM sessions"
+
+
+def _delete_today(db):
+    predicate, params = _created_today(db)
+    return predicate, params, "DELETE FROM sessions"
+
+
+def _migrate_timestamps(db):
+    if "timestamp" not in db.columns():
+        return None  # Nothing to migrate from
+    predicate = (
+        "timestamp IS NOT NULL AND timestamp <> '' AND "
+        "(created_at IS NULL OR created_at = '' OR updated_at IS NULL OR updated_at = '')"
+    )
+    statement = (
+        "UPDATE sessions SET created_at = COALESCE(NULLIF(created_at, ''), timestamp), "
+        "updated_at = COALESCE(NULLIF(updated_at, ''), timestamp)"
+    )
+    return predicate, (), statement
+
+
+# name -> (description, builder). A builder returns (WHERE predicate, predicate params, UPDATE/DELETE
+# statement without its WHERE clause), or None when the command doesn't apply to this database.
+COMMANDS = {
+    "update-names": ("Update session names from session_title", _update_names),
+    "delete-untitled": ("Delete sessions without session_title", _delete_untitled),
+    "delete-today": ("Delete sessions created today", _delete_today),
+    "migrate-timestamps": ("Migrate timestamp to created_at and updated_at", _migrate_timestamps),
+}
+
+
+def run_command(db, command, dry_run=False, chunk_size=CHUNK_SIZE):
+    """
+    Count the rows `command` affects and, unless dry_run, apply it in keyset chunks of chunk_size ids,
+    committing and reporting progress after each chunk. Returns the number of rows affected (or matched).
+    """
+    description, builder = COMMANDS[command]
+    built = builder(db)
+    if built is None:
+        logging.info(f"{description}: not applicable to this {db.name} database")
+        return 0
+    predicate, params, statement = built
+    params = tuple(params)
+    c = db.conn.cursor()
+    c.execute(db.sql(f"SELECT COUNT(*) FROM sessions WHERE {predicate}"), params)
+    total = c.fetchone()[0]
+    if dry_run or total == 0:
+        db.conn.rollback()
+        logging.info(f"{description}: {total} sessions would be affected" if dry_run else f"{description}: nothing to do")
+        return total
+
+    done, last_id, started = 0, 0, time.monotonic()
+    bound_sql = db.sql(
+        f"SELECT MAX(id) FROM (SELECT id FROM sessions WHERE id > ? AND {predicate} ORDER BY id LIMIT ?) chunk"
+    )
+    apply_sql = db.sql(f"{statement} WHERE id > ? AND id <= ? AND {predicate}")
+    while True:
+        c.execute(bound_sql, (last_id, *params, chunk_size))
+        upper = c.fetchone()[0]
+        if upper is None:
+            break
+        c.execute(apply_sql, (last_id, upper, *params))
+        done += c.rowcount
+        db.conn.commit()
+        last_id = upper
+        elapsed = time.monotonic() - started
+        logging.info(f"{description}: {done}/{total} sessions ({done / elapsed if elapsed else 0:.0f}/s)")
+    logging.info(f"{description}: {done} sessions in {time.monotonic() - started:.1f}s")
+    return done
+
+
+def open_backend(backend, db_path=DB_PATH):
+    return PostgresBackend() if backend == "postgres" else SqliteBackend(db_path)
+
+
+def update_session_names_from_titles(db=None):
     """
     For each session where the name is in the format 'Session YYYY-MM-DD HH:MM:SS' (optionally followed by anything),
     update it to the session_title from the data JSON if available.
     """
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    session_ts_pattern = re.compile(r"^Session \d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}")
-    c.execute('SELECT id, name, data FROM sessions')
-    rows = c.fetchall()
-    updated = 0
-    for sid, name, data in rows:
-        if session_ts_pattern.match(name):
-            try:
-                session_data = json.loads(data)
-                session_title = session_data.get("session_title")
-                if session_title and session_title.strip():
-                    c.execute('UPDATE sessions SET name=? WHERE id=?', (session_title.strip(), sid))
-                    updated += 1
-            except Exception as e:
-                logging.warning(f"Exception updating session id {sid}: {e}")
-                continue
-    conn.commit()
-    conn.close()
-    logging.info(f"Updated {updated} session names.")
-
-def delete_sessions_without_title():
+    return _run_one("update-names", db)
+
+def delete_sessions_without_title(db=None):
     """
     Delete any session where the data JSON does not have a session_title.
     """
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT id, data FROM sessions')
-    rows = c.fetchall()
-    deleted = 0
-    for sid, data in rows:
-        try:
-            session_data = json.loads(data)
-            session_title = session_data.get("session_title")
-            if not session_title or not str(session_title).strip():
-                c.execute('DELETE FROM sessions WHERE id=?', (sid,))
-                deleted += 1
-        except Exception as e:
-            logging.warning(f"Exception deleting session id {sid}: {e}")
-            continue
-    conn.commit()
-    conn.close()
-    logging.info(f"Deleted {deleted} sessions without session_title.")
-
-def delete_sessions_created_today():
+    return _run_one("delete-untitled", db)
+
+def delete_sessions_created_today(db=None):
     """
-    Delete any session where the timestamp is today (local time).
+    Delete any session created today (local time).
     """
-    today = datetime.now().date()
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT id, timestamp FROM sessions')
-    rows = c.fetchall()
-    deleted = 0
-    for sid, ts in rows:
-        try:
-            session_date = datetime.fromisoformat(ts).date()
-            if session_date == today:
-                c.execute('DELETE FROM sessions WHERE id=?', (sid,))
-                deleted += 1
-        except Exception as e:
-            logging.warning(f"Exception deleting session id {sid}: {e}")
-            continue
-    conn.commit()
-    conn.close()
-    logging.info(f"Deleted {deleted} sessions created today.")
-
-def migrate_timestamp_to_created_and_updated():
+    return _run_one("delete-today", db)
+
+def migrate_timestamp_to_created_and_updated(db=None):
     """
     For all sessions, set created_at = timestamp and updated_at = timestamp if not already set.
     """
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT id, timestamp, created_at, updated_at FROM sessions')
-    rows = c.fetchall()
-    updated = 0
-    for sid, ts, created_at, updated_at in rows:
-        if ts:
-            set_created = created_at is None or created_at == ""
-            set_updated = updated_at is None or updated_at == ""
-            if set_created or set_updated:
-                if set_created and set_updated:
-                    c.execute('UPDATE sessions SET created_at=?, updated_at=? WHERE id=?', (ts, ts, sid))
-                elif set_created:
-                    c.execute('UPDATE sessions SET created_at=? WHERE id=?', (ts, sid))
-                elif set_updated:
-                    c.execute('UPDATE sessions SET updated_at=? WHERE id=?', (ts, sid))
-                updated += 1
-    conn.commit()
-    conn.close()
-    logging.info(f"Migrated {updated} sessions' timestamp to created_at and updated_at.")
+    return _run_one("migrate-timestamps", db)
+
+def _run_one(command, db):
+    own = db is None
+    db = db or SqliteBackend()
+    try:
+        return run_command(db, command)
+    finally:
+        if own:
+            db.close()
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Fix session data JSON files.")
-    parser.add_argument("--dir", default="../data/sessions", help="Directory containing session JSON files")
+    parser = argparse.ArgumentParser(description="Bulk maintenance for stored sessions.")
+    parser.add_argument("commands", nargs="*", help=f"Commands to run, in order: {', '.join(COMMANDS)} (default: choose interactively)")
+    parser.add_argument("--backend", choices=["sqlite", "postgres"], default=os.getenv("SESSION_DB_BACKEND", "sqlite"), help="Session store to operate on")
+    parser.add_argument("--db", default=DB_PATH, help="Path to the SQLite DB file")
+    parser.add_argument("--dry-run", action="store_true", help="Only report how many sessions each command would affect")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Sessions per committed chunk")
     args = parser.parse_args()
 
-    logging.basicConfig(level=logging.INFO)
-    logging.info(f"Fixing session data in directory: {args.dir}")
-
-    print("Select an operation to perform:")
-    print("1. Update session names from session_title")
-    print("2. Delete sessions without session_title")
-    print("3. Run both operations")
-    print("4. Delete sessions created today")
-    print("5. Migrate timestamp to created_at and updated_at")
-    choice = input("Enter 1, 2, 3, 4, or 5: ").strip()
-    if choice == "1":
-        update_session_names_from_titles()
-    elif choice == "2":
-        delete_sessions_without_title()
-    elif choice == "3":
-        update_session_names_from_titles()
-        delete_sessions_without_title()
-    elif choice == "4":
-        delete_sessions_created_today()
-    elif choice == "5":
-        migrate_timestamp_to_created_and_updated()
-    else:
-        print("Invalid selection.")
+    commands = args.commands
+    unknown = [command for command in commands if command not in COMMANDS]
+    if unknown:
+        parser.error(f"unknown command(s): {', '.join(unknown)}")
+    if not commands:
+        menu = {"1": ["update-names"], "2": ["delete-untitled"], "3": ["update-names", "delete-untitled"],
+                "4": ["delete-today"], "5": ["migrate-timestamps"]}
+        print("Select an operation to perform:")
+        print("1. Update session names from session_title")
+        print("2. Delete sessions without session_title")
+        print("3. Run both operations")
+        print("4. Delete sessions created today")
+        print("5. Migrate timestamp to created_at and updated_at")
+        choice = input("Enter 1, 2, 3, 4, or 5: ").strip()
+        if choice not in menu:
+            print("Invalid selection.")
+            raise SystemExit(1)
+        commands = menu[choice]
+
+    logging.info(f"Running {', '.join(commands)} on the {args.backend} session store" + (" (dry run)" if args.dry_run else ""))
+    db = open_backend(args.backend, args.db)
+    try:
+        for command in commands:
+            run_command(db, command, dry_run=args.dry_run, chunk_size=args.chunk_size)
+    finally:
+        db.close()
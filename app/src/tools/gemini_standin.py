@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Gemini endpoint, for load tests that must not hit the HUIT gateway.
+
+Speaks the REST wire format google.genai.Client uses, under any path prefix (so it works with the gateway-style
+GOOGLE_API_BASE_URL the app uses):
+
+    POST .../models/{model}:generateContent
+    POST .../models/{model}:streamGenerateContent?alt=sse
+    POST .../models/{model}:countTokens
+    GET  .../models
+    GET  /stats                                   (the stand-in's own counters)
+
+Run it and point the app at it:
+
+    python gemini_standin.py --port 8765 --latency lognormal:median=3,sigma=0.6 --error-rate 0.02 \\
+        --burst-every 60 --burst-duration 5
+    GOOGLE_API_BASE_URL=http://127.0.0.1:8765 GOOGLE_API_KEY=standin streamlit run ../core/streamlit_ui_chatapi.py
+
+Latency specs: fixed:SECONDS, uniform:LOW,HIGH, normal:mean=M,sd=S, lognormal:median=M,sigma=S.
+"""
+import re
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from urllib.parse import urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+
+logging.getLogger(__name__)
+
+CANNED_RESPONSES = [
+    "**Simplified passage (Level I)**\n\nSed fatis incerta sum. Nescio an Iuppiter velit unam urbem esse Tyriis "
+    "et Troianis, aut an probet populos misceri aut foedera iungi. Tu es coniunx eius; tibi licet animum eius "
+    "precando temptare. Perge, et ego sequar.\n\nTum regia Iuno sic respondit: \"Iste labor erit meus.\"",
+    "**Simplified passage (Level II)**\n\nFatis incerta feror, si Iuppiter velit unam urbem Tyriis Troianisque "
+    "esse, aut probet populos misceri aut foedera iungi. Tu coniunx es: tibi fas est animum eius precibus temptare. "
+    "Perge, sequar.\n\nTum Iuno: \"Mecum erit iste labor. Nunc paucis docebo quomodo id quod instat fieri possit.\"",
+    "**Notes on the simplification**\n\n- `feror` is replaced with `sum` for first-year readers.\n"
+    "- The indirect question `si Iuppiter ... velit` is made explicit with `nescio an`.\n"
+    "- `crastinus ortus` becomes `cras, cum sol oritur`.",
+    "Venatum Aeneas et miserrima Dido in silvam ire parant, ubi cras primum sol orietur et radiis suis orbem "
+    "terrarum aperiet. Iuno consilium suum paucis verbis explicabit.",
+]
+_MODEL_PATH = re.compile(r"/models/([^/:]+):(generateContent|streamGenerateContent|countTokens)$")
+
+
+def parse_distribution(spec):
+    """Turn a latency spec (see module docstring) into a function returning seconds."""
+    kind, _, params = spec.partition(":")
+    values = {}
+    positional = []
+    for item in filter(None, params.split(",")):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            values[key.strip()] = float(value)
+        else:
+            positional.append(float(item))
+    if kind == "fixed":
+        seconds = positional[0] if positional else values.get("seconds", 0.0)
+        return lambda rng: seconds
+    if kind == "uniform":
+        low, high = positional if len(positional) == 2 else (values.get("low", 0.0), values.get("high", 1.0))
+        return lambda rng: rng.uniform(low, high)
+    if kind == "normal":
+        mean, sd = values.get("mean", 1.0), values.get("sd", 0.2)
+        return lambda rng: max(0.0, rng.gauss(mean, sd))
+    if kind == "lognormal":
+        median, sigma = values.get("median", 1.0), values.get("sigma", 0.5)
+        return lambda rng: rng.lognormvariate(math.log(median), sigma)
+    raise ValueError(f"Unknown latency distribution: {spec!r}")
+
+
+class StandinState:
+    """Configuration, randomness and counters shared by all request threads."""
+
+    def __init__(self, latency="lognormal:median=2,sigma=0.5", error_rate=0.0, burst_every=0.0, burst_duration=0.0,
+                 stream_chunks=8, seed=None, retry_delay=2):
+        self.latency = parse_distribution(latency)
+        self.error_rate = error_rate
+        self.burst_every = burst_every
+        self.burst_duration = burst_duration
+        self.stream_chunks = stream_chunks
+        self.retry_delay = retry_delay
+        self.started = time.monotonic()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.stats = {"requests": 0, "streams": 0, "ok": 0, "errors_5xx": 0, "throttled_429": 0,
+                      "count_tokens": 0, "peak_in_flight": 0}
+
+    def sample(self, func):
+        with self._lock:
+            return func(self._rng)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def enter(self):
+        with self._lock:
+            self._in_flight += 1
+            self.stats["peak_in_flight"] = max(self.stats["peak_in_flight"], self._in_flight)
+
+    def leave(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def in_burst(self):
+        if not self.burst_every or not self.burst_duration:
+            return False
+        return (time.monotonic() - self.started) % self.burst_every < self.burst_duration
+
+    def snapshot(self):
+        with self._lock:
+            return {**self.stats, "in_flight": self._in_flight, "uptime_s": round(time.monotonic() - self.started, 1)}
+
+
+def _error_body(code, status, message, details=None):
+    error = {"code": code, "message": message, "status": status}
+    if details:
+        error["details"] = details
+    return {"error": error}
+
+
+def _response_body(model, text, prompt_tokens, finish_reason="STOP"):
+    candidate_tokens = max(1, len(text) // 4)
+    return {
+        "candidates": [{
+            "content": {"role": "model", "parts": [{"text": text}]},
+            "finishReason": finish_reason,
+            "index": 0,
+        }],
+        "usageMetadata": {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": candidate_tokens,
+            "totalTokenCount": prompt_tokens + candidate_tokens,
+        },
+        "modelVersion": model,
+    }
+
+
+def _prompt_tokens(request):
+    chars = len(json.dumps(request.get("contents", []))) + len(json.dumps(request.get("systemInstruction", "")))
+    return max(1, chars // 4)
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real gateway
+    state: StandinState = None
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+    def _send_json(self, code, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path.endswith("/stats"):
+            self._send_json(200, self.state.snapshot())
+        elif path.endswith("/models"):
+            self._send_json(200, {"models": [
+                {"name": "models/gemini-2.5-pro", "displayName": "Gemini 2.5 Pro (stand-in)",
+                 "supportedGenerationMethods": ["generateContent", "countTokens"]},
+                {"name": "models/gemini-2.5-flash", "displayName": "Gemini 2.5 Flash (stand-in)",
+                 "supportedGenerationMethods": ["generateContent", "countTokens"]},
+            ]})
+        else:
+            self._send_json(404, _error_body(404, "NOT_FOUND", f"Unknown path {path}"))
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        match = _MODEL_PATH.search(parsed.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not match:
+            # e.g. cachedContents: report it unsupported so the app's fallbacks are exercised
+            self._send_json(404, _error_body(404, "NOT_FOUND", f"{parsed.path} is not supported by the stand-in"))
+            return
+        model, method = match.groups()
+        if method == "countTokens":
+            self.state.incr("count_tokens")
+            self._send_json(200, {"totalTokens": _prompt_tokens(request)})
+            return
+
+        state = self.state
+        state.incr("requests")
+        state.enter()
+        try:
+            if state.in_burst():
+                state.incr("throttled_429")
+                time.sleep(state.sample(lambda rng: rng.uniform(0.01, 0.05)))
+                self._send_json(
+                    429,
+                    _error_body(429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (stand-in burst).", [{
+                        "@type": "type.googleapis.com/google.rpc.RetryInfo",
+                        "retryDelay": f"{state.retry_delay}s",
+                    }]),
+                    headers={"Retry-After": str(state.retry_delay)},
+                )
+                return
+            latency = state.sample(state.latency)
+            if state.sample(lambda rng: rng.random()) < state.error_rate:
+                time.sleep(latency / 2)
+                state.incr("errors_5xx")
+                self._send_json(503, _error_body(503, "UNAVAILABLE", "The model is overloaded (stand-in error)."))
+                return
+            text = state.sample(lambda rng: rng.choice(CANNED_RESPONSES))
+            if method == "streamGenerateContent":
+                state.incr("streams")
+                self._stream(model, text, request, latency)
+            else:
+                time.sleep(latency)
+                self._send_json(200, _response_body(model, text, _prompt_tokens(request)))
+            state.incr("ok")
+        finally:
+            state.leave()
+
+    def _stream(self, model, text, request, latency):
+        """Server-sent events: the first chunk after ~40% of the latency, the rest spread over the remainder."""
+        count = max(1, self.state.stream_chunks)
+        size = math.ceil(len(text) / count)
+        pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        prompt_tokens = _prompt_tokens(request)
+        for i, piece in enumerate(pieces):
+            time.sleep(latency * 0.4 if i == 0 else latency * 0.6 / max(1, len(pieces) - 1))
+            finish = "STOP" if i == len(pieces) - 1 else None
+            body = _response_body(model, piece, prompt_tokens, finish_reason=finish)
+            if finish is None:
+                del body["candidates"][0]["finishReason"]
+            event = f"data: {json.dumps(body)}\r\n\r\n".encode("utf-8")
+            self.wfile.write(f"{len(event):X}\r\n".encode("ascii") + event + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def make_server(host="127.0.0.1", port=8765, **state_options):
+    """Build (but don't start) a stand-in server; port 0 picks a free port (see server.server_address)."""
+    handler = type("Handler", (StandinHandler,), {"state": StandinState(**state_options)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.state = handler.state
+    return server
+
+
+def start_in_thread(**options):
+    """Start a stand-in on a background thread; returns (server, base_url)."""
+    server = make_server(**options)
+    threading.Thread(target=server.serve_forever, name="gemini-standin", daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency", default="lognormal:median=2,sigma=0.5", help="Response latency distribution")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--burst-every", type=float, default=0.0, help="Seconds between 429 bursts (0 = none)")
+    parser.add_argument("--burst-duration", type=float, default=0.0, help="Seconds each 429 burst lasts")
+    parser.add_argument("--retry-delay", type=int, default=2, help="Retry delay advertised on 429 responses")
+    parser.add_argument("--stream-chunks", type=int, default=8, help="Chunks per streamed response")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible runs")
+
+
+def state_options(args):
+    return {
+        "latency": args.latency,
+        "error_rate": args.error_rate,
+        "burst_every": args.burst_every,
+        "burst_duration": args.burst_duration,
+        "retry_delay": args.retry_delay,
+        "stream_chunks": args.stream_chunks,
+        "seed": args.seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local Gemini stand-in server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = make_server(args.host, args.port, **state_options(args))
+    print(f"Gemini stand-in listening on http://{args.host}:{args.port} (set GOOGLE_API_BASE_URL to this)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.state.snapshot(), indent=2))
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Load generator: N simulated instructors driving streamlit_ui_chatapi.py end to end against the local Gemini
+stand-in (gemini_standin.py), stepping N up to find the app's saturation point.
+
+Each instructor is an AppTest session in its own process (AppTest can't run several sessions concurrently in
+one process), so unlike browser sessions on one Streamlit server they don't share the genai client, the DB
+pool or the write-behind queue; they do share the stand-in and the database. Each picks a level and sends
+--turns messages with --think-time seconds between them; a turn is timed from the button click to the end of
+the rerun that shows the reply. A level in which no turn completed is an error, not a result.
+
+    python load_test.py --sessions 1,5,10,20 --turns 5 --latency lognormal:median=2,sigma=0.5
+    python load_test.py --sessions 10,20,40 --error-rate 0.05 --burst-every 30 --burst-duration 3
+    python load_test.py --standin-url http://127.0.0.1:8765     # use a stand-in started separately
+
+The session store is SESSION_DB_BACKEND (default sqlite on a scratch file). With postgres, DB connection
+counts come from pg_stat_activity, sampled while each level runs; each instructor reports its own pool and
+write-behind counters. For
+repeatable runs, set GEMINI_CASSETTE_MODE=auto and a fixed GEMINI_CASSETTE_DIR: the first run records the
+stand-in's replies and later runs replay them (with GEMINI_CASSETTE_LATENCY=original, at the recorded pace).
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from pathlib import Path
+from datetime import datetime, timezone
+import logging
+
+CORE_DIR = Path(__file__).resolve().parent.parent / "core"
+sys.path.insert(0, str(CORE_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import gemini_standin
+from stats_util import percentile
+
+logging.getLogger(__name__)
+
+UI_SCRIPT = CORE_DIR / "streamlit_ui_chatapi.py"
+RESULTS_DIR = Path(__file__).resolve().parent.parent.parent / "data" / "benchmarks"
+PROMPTS = [
+    "Please simplify the next passage for a first-year class.",
+    "Make it a little harder: keep the subjunctives.",
+    "Add short notes on the vocabulary you changed.",
+    "Now do the following ten lines in the same way.",
+    "Can you explain the ablative absolute in the second sentence?",
+]
+
+
+class DbSampler:
+    """Samples Postgres connection counts on a background thread while a load level runs."""
+
+    def __init__(self, backend, interval=0.5):
+        self.backend = backend
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._conn = None
+
+    def _sample(self):
+        import session_db_postgres
+        if self._conn is None:
+            self._conn = session_db_postgres.get_conn()
+            self._conn.autocommit = True
+        with self._conn.cursor() as c:
+            c.execute("SELECT state, COUNT(*) FROM pg_stat_activity WHERE datname = current_database() GROUP BY state")
+            by_state = {state or "unknown": count for state, count in c.fetchall()}
+        return {
+            "t": time.monotonic(),
+            "server_connections": sum(by_state.values()) - 1,  # Not counting this sampler
+            "active": by_state.get("active", 1) - 1,
+        }
+
+    def _run(self):
+        if self.backend != "postgres":
+            return
+        while not self._stop.wait(self.interval):
+            try:
+                self.samples.append(self._sample())
+            except Exception as e:
+                logging.warning(f"DB sampling failed: {e}")
+                return
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name="db-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def summary(self):
+        if not self.samples:
+            return {}
+        return {
+            "server_connections_peak": max(s["server_connections"] for s in self.samples),
+            "active_peak": max(s["active"] for s in self.samples),
+        }
+
+
+def instructor(index, args, start_barrier, results):
+    """One simulated instructor, in its own process: open the app, pick a level, send args.turns messages."""
+    import sentry_sdk
+    from streamlit.testing.v1 import AppTest
+    import session_store
+
+    sentry_sdk.init = lambda *a, **k: None  # Don't send load-test traffic to Sentry
+    logging.basicConfig(level=logging.WARNING)
+    record = {"turns": [], "errors": []}
+    try:
+        start_barrier.wait()
+        time.sleep(index * args.ramp_up)
+        at = AppTest.from_file(str(UI_SCRIPT), default_timeout=args.timeout)
+        started = time.perf_counter()
+        at.run()
+        record["first_run_ms"] = (time.perf_counter() - started) * 1000
+        at.selectbox(key="level_chatapi").select(args.level)
+        at.run()
+        # Selecting a level saves the session and reruns; without the level there is no chat input to drive
+        if at.exception or at.session_state["level_chatapi"] != args.level or "chat_input_text" not in [t.key for t in at.text_area]:
+            raise RuntimeError(f"level {args.level!r} did not stick after selection (now {at.session_state['level_chatapi']!r})")
+        for turn in range(args.turns):
+            time.sleep(args.think_time)
+            at.text_area(key="chat_input_text").input(f"{PROMPTS[turn % len(PROMPTS)]} (instructor {index}, turn {turn})")
+            at.button(key="send_chat_btn").click()
+            started = time.perf_counter()
+            at.run()
+            elapsed = (time.perf_counter() - started) * 1000
+            if at.exception:
+                record["errors"].append(f"turn {turn}: {at.exception[0].message}")
+                continue
+            record["turns"].append({"ms": elapsed, "at": time.time()})
+        store = session_store.get_store()
+        store.flush_writes()
+        record["writer"] = store.writer_stats()
+        record["pool"] = store.pool_stats()
+    except Exception as e:
+        record["errors"].append(f"{type(e).__name__}: {e}")
+    results.put((index, record))
+
+
+def run_level(sessions, args, backend, standin):
+    # spawn: a fresh interpreter per instructor, since AppTest keeps per-process Streamlit runtime state
+    ctx = multiprocessing.get_context("spawn")
+    start_barrier = ctx.Barrier(sessions + 1)
+    queue = ctx.Queue()
+    processes = [
+        ctx.Process(target=instructor, args=(i, args, start_barrier, queue), name=f"instructor-{i}", daemon=True)
+        for i in range(sessions)
+    ]
+    for process in processes:
+        process.start()
+    before = standin.state.snapshot() if standin else None
+    results = {}
+    with DbSampler(backend) as sampler:
+        start_barrier.wait()
+        started = time.perf_counter()
+        # Results are read before joining, so a child never blocks on a full queue
+        deadline = time.monotonic() + args.timeout * (args.turns + 2) + args.turns * args.think_time + sessions * args.ramp_up
+        while len(results) < sessions and time.monotonic() < deadline:
+            try:
+                index, record = queue.get(timeout=1.0)
+            except Exception:
+                if not any(process.is_alive() for process in processes) and queue.empty():
+                    break
+                continue
+            results[index] = record
+        wall = time.perf_counter() - started
+    for i, process in enumerate(processes):
+        process.join(5)
+        if process.is_alive():
+            process.terminate()
+        if i not in results:
+            results[i] = {"turns": [], "errors": [f"instructor {i} exited without a result (exit code {process.exitcode})"]}
+
+    latencies = [turn["ms"] for record in results.values() for turn in record["turns"]]
+    errors = [error for record in results.values() for error in record["errors"]]
+    writers = [record["writer"] for record in results.values() if "writer" in record]
+    pools = [record["pool"] for record in results.values() if "pool" in record]
+    db = sampler.summary()
+    if writers:
+        db["writer_failed_items"] = sum(w["failed_items"] for w in writers)
+        db["writer_max_flush_ms"] = round(max(w["max_flush_ms"] for w in writers), 2)
+    if pools:
+        db["pool_peak_in_use"] = max(p.get("peak_in_use", 0) for p in pools)
+    level = {
+        "sessions": sessions,
+        "turns": len(latencies),
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "wall_s": round(wall, 2),
+        "turns_per_min": round(len(latencies) / wall * 60, 2) if wall else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "first_run_p95_ms": percentile([r["first_run_ms"] for r in results.values() if "first_run_ms" in r], 95),
+        "db": db,
+    }
+    if standin:
+        after = standin.state.snapshot()
+        level["standin"] = {key: after[key] - before[key] for key in ("requests", "ok", "errors_5xx", "throttled_429")}
+        level["standin"]["peak_in_flight"] = after["peak_in_flight"]
+    return level
+
+
+def find_saturation(levels, latency_factor, min_gain):
+    """
+    The first level where adding instructors stopped paying off: throughput grew by less than min_gain over
+    the previous level, or p95 turn latency exceeded latency_factor times the lightest level's p95.
+    """
+    if not levels or levels[0]["p95_ms"] is None:
+        return None
+    base_p95 = levels[0]["p95_ms"]
+    for previous, level in zip(levels, levels[1:]):
+        if level["p95_ms"] is None:
+            return level["sessions"]
+        if level["p95_ms"] > latency_factor * base_p95:
+            return level["sessions"]
+        if level["turns_per_min"] < previous["turns_per_min"] * (1 + min_gain):
+            return level["sessions"]
+    return None
+
+
+def print_level(level):
+    fmt = lambda ms: f"{ms:8.0f}" if ms is not None else "     n/a"
+    db = level["db"]
+    connections = (f"  db conns peak {db['server_connections_peak']} (active {db['active_peak']})"
+                   if "server_connections_peak" in db else "")
+    print(
+        f"  {level['sessions']:>4} sessions  p50 {fmt(level['p50_ms'])}  p95 {fmt(level['p95_ms'])}  "
+        f"p99 {fmt(level['p99_ms'])} ms  {level['turns_per_min']:7.1f} turns/min  "
+        f"errors {level['errors']}{connections}  writer max flush {db.get('writer_max_flush_ms', 'n/a')} ms, "
+        f"failed writes {db.get('writer_failed_items', 'n/a')}"
+    )
+    if "standin" in level:
+        s = level["standin"]
+        print(f"        stand-in: {s['requests']} requests, {s['errors_5xx']} 5xx, {s['throttled_429']} 429, "
+              f"peak in flight {s['peak_in_flight']}")
+    for error in level["error_samples"]:
+        print(f"        ! {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive concurrent instructor sessions through the Streamlit app.")
+    parser.add_argument("--sessions", default="1,5,10,20", help="Comma-separated concurrency levels to step through")
+    parser.add_argument("--turns", type=int, default=5, help="Messages each instructor sends")
+    parser.add_argument("--think-time", type=float, default=2.0, help="Seconds an instructor waits before each message")
+    parser.add_argument("--ramp-up", type=float, default=0.2, help="Seconds between instructors starting")
+    parser.add_argument("--level", default="Level I", choices=["Level I", "Level II"], help="Level each instructor picks")
+    parser.add_argument("--timeout", type=float, default=300, help="AppTest timeout per rerun, in seconds")
+    parser.add_argument("--standin-url", default=None, help="Use a running stand-in instead of starting one")
+    parser.add_argument("--latency-factor", type=float, default=2.0, help="p95 growth over the first level counted as saturation")
+    parser.add_argument("--min-gain", type=float, default=0.1, help="Throughput gain below which a level counts as saturated")
+    parser.add_argument("--output", default=None, help="Results JSON path (default app/data/benchmarks/load-<timestamp>.json)")
+    gemini_standin.add_arguments(parser)
+    args = parser.parse_args()
+    levels_to_run = [int(n) for n in args.sessions.split(",") if n.strip()]
+
+    try:
+        import streamlit.testing.v1  # noqa: F401
+    except ImportError as e:
+        parser.error(f"streamlit AppTest is required: {e}")
+
+    standin = None
+    if args.standin_url:
+        base_url = args.standin_url
+    else:
+        standin, base_url = gemini_standin.start_in_thread(port=0, **gemini_standin.state_options(args))
+
+    workdir = Path(tempfile.mkdtemp(prefix="digital-latin-load-"))
+    # The app must never reach the real gateway or write to app/data during a load test
+    os.environ["GOOGLE_API_BASE_URL"] = base_url
+    os.environ["GOOGLE_API_KEY"] = "standin"
+    os.environ.setdefault("GEMINI_RESPONSE_CACHE", "off")
+    os.environ.setdefault("SESSION_EVENT_LOG", "false")
+    os.environ["SESSION_LOCAL_STORE_DIR"] = str(workdir / "local")
+    backend = os.environ.setdefault("SESSION_DB_BACKEND", "sqlite")
+    if backend == "sqlite":
+        os.environ["SQLITE_DB_PATH"] = str(workdir / "sessions.db")
+    logging.basicConfig(level=logging.WARNING)
+
+    print(f"Stand-in at {base_url}; {backend} session store; {args.turns} turns per instructor")
+    levels = []
+    try:
+        for sessions in levels_to_run:
+            level = run_level(sessions, args, backend, standin)
+            levels.append(level)
+            print_level(level)
+            if not level["turns"]:
+                # Every instructor failed: any saturation figure or results file would be meaningless
+                raise SystemExit(f"No turns completed with {sessions} concurrent instructors; see the errors above.")
+    finally:
+        if standin:
+            standin.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    saturation = find_saturation(levels, args.latency_factor, args.min_gain)
+    if saturation:
+        print(f"\nSaturation at about {saturation} concurrent instructors "
+              f"(p95 over x{args.latency_factor} or throughput gain under {args.min_gain:.0%}).")
+    else:
+        print("\nNo saturation within the levels tried; add higher --sessions levels.")
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"load-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    report = {
+        "meta": {"timestamp": datetime.now(timezone.utc).isoformat(), "backend": backend, "args": vars(args)},
+        "levels": levels,
+        "saturation_sessions": saturation,
+    }
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
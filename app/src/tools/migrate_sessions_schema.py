@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
 import psycopg2
 import os
+import sys
+from pathlib import Path
 import logging
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "core"))
+import schema_migrations
+
 logging.getLogger(__name__)
 
 def get_conn():
@@ -15,44 +20,13 @@ def get_conn():
     )
 
 def migrate():
+    # Applies the same versioned migrations the app runs at startup (see core/schema_migrations.py)
     conn = get_conn()
-    c = conn.cursor()
-    # Create sessions table if not exists
-    c.execute('''CREATE TABLE IF NOT EXISTS sessions (
-        id SERIAL PRIMARY KEY,
-        name TEXT,
-        data TEXT,
-        created_at TEXT,
-        updated_at TEXT,
-        end_reason TEXT
-    )''')
-    # Add columns if missing
-    c.execute("""
-        DO $$
-        BEGIN
-            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='sessions' AND column_name='created_at') THEN
-                ALTER TABLE sessions ADD COLUMN created_at TEXT;
-            END IF;
-            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='sessions' AND column_name='updated_at') THEN
-                ALTER TABLE sessions ADD COLUMN updated_at TEXT;
-            END IF;
-            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='sessions' AND column_name='end_reason') THEN
-                ALTER TABLE sessions ADD COLUMN end_reason TEXT;
-            END IF;
-        END$$;
-    """)
-    # Create messages table if not exists
-    c.execute('''CREATE TABLE IF NOT EXISTS messages (
-        id SERIAL PRIMARY KEY,
-        session_id INTEGER REFERENCES sessions(id) ON DELETE CASCADE,
-        role TEXT,
-        content TEXT,
-        timestamp TEXT,
-        time_delta REAL
-    )''')
-    conn.commit()
+    before = schema_migrations.current_version(conn)
+    after = schema_migrations.migrate(conn)
     conn.close()
-    print("PostgreSQL migration complete.")
+    print(f"PostgreSQL migration complete (schema version {before} -> {after}).")
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     migrate()
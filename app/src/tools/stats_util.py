@@ -0,0 +1,9 @@
+"""Small statistics helpers shared by the benchmark, load-test and trace-report tools."""
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of samples (0-100), or None when there are none."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))]
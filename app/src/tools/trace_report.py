@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Summarize the local turn traces (TRACE_EXPORTER=local, see core/turn_tracing.py): where rerun time goes,
+phase by phase.
+
+    python trace_report.py                          # every trace in app/data/traces/turn_traces.jsonl*
+    python trace_report.py --session 42             # one conversation, rerun by rerun
+    python trace_report.py --slowest 5              # the five slowest reruns with their spans
+"""
+import sys
+import json
+import argparse
+from pathlib import Path
+from collections import defaultdict
+import logging
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "core"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import turn_tracing
+from stats_util import percentile
+
+logging.getLogger(__name__)
+
+
+def read_traces(path):
+    """Yield trace records from the rotated backups (oldest first) and then the current file."""
+    paths = [Path(f"{path}.{i}") for i in range(turn_tracing.TRACE_LOCAL_BACKUPS, 0, -1)] + [Path(path)]
+    for p in paths:
+        if not p.exists():
+            continue
+        with open(p, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def phase_key(span):
+    # DB spans are split by function; LLM and prompt spans by phase
+    return f"{span['op']} {span['description']}" if span["op"] == "db" else span["op"]
+
+
+def print_breakdown(traces):
+    phases = defaultdict(list)
+    for trace in traces:
+        for span in trace["spans"]:
+            phases[phase_key(span)].append(span["duration_ms"])
+    durations = [trace["duration_ms"] for trace in traces]
+    total = sum(durations)
+    print(f"{len(traces)} reruns, p50 {percentile(durations, 50):.1f} ms, p95 {percentile(durations, 95):.1f} ms\n")
+    print(f"  {'phase':<50} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'share':>6}")
+    for name, samples in sorted(phases.items(), key=lambda item: -sum(item[1])):
+        print(f"  {name:<50} {len(samples):>6} {percentile(samples, 50):>9.1f} {percentile(samples, 95):>9.1f} "
+              f"{sum(samples) / total if total else 0:>6.1%}")
+    tokens = [span["data"] for trace in traces for span in trace["spans"]
+              if span["op"] == "llm.request" and "prompt_token_count" in span["data"]]
+    if tokens:
+        print(f"\n  LLM requests with usage: {len(tokens)}, prompt tokens p50 "
+              f"{percentile([t['prompt_token_count'] for t in tokens], 50)}, output tokens p50 "
+              f"{percentile([t.get('candidates_token_count', 0) for t in tokens], 50)}")
+
+
+def print_trace(trace):
+    print(f"{trace['started_at']}  session {trace['session_db_id']}  {trace['duration_ms']:.1f} ms  ({trace['outcome']})")
+    for span in trace["spans"]:
+        data = ", ".join(f"{k}={v}" for k, v in span["data"].items())
+        print(f"    +{span['start_ms']:>9.1f} {span['duration_ms']:>9.1f} ms  {phase_key(span):<45} {data}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize local per-rerun traces.")
+    parser.add_argument("--path", default=str(turn_tracing.TRACE_LOCAL_PATH), help="Trace file (rotated backups are read too)")
+    parser.add_argument("--session", default=None, help="Only traces for this session_db_id, listed in order")
+    parser.add_argument("--slowest", type=int, default=0, help="Also list the N slowest reruns with their spans")
+    args = parser.parse_args()
+
+    traces = list(read_traces(args.path))
+    if args.session is not None:
+        traces = [t for t in traces if str(t.get("session_db_id")) == args.session]
+    if not traces:
+        print(f"No traces found in {args.path} (is TRACE_EXPORTER set to local?)")
+        return
+
+    print_breakdown(traces)
+    if args.session is not None:
+        print()
+        for trace in traces:
+            print_trace(trace)
+    if args.slowest:
+        print(f"\nSlowest {args.slowest} reruns:")
+        for trace in sorted(traces, key=lambda t: -t["duration_ms"])[:args.slowest]:
+            print_trace(trace)
+
+
+if __name__ == "__main__":
+    main()
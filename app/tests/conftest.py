@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# The app runs as `streamlit run src/core/streamlit_ui_chatapi.py`, so its modules import each other by bare name
+CORE_DIR = Path(__file__).resolve().parent.parent / "src" / "core"
+sys.path.insert(0, str(CORE_DIR))
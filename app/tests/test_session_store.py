@@ -0,0 +1,75 @@
+import logging
+
+import pytest
+
+import session_db_sqlite
+import session_event_log
+import session_store
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # A fresh SQLite file and pool for each test; a long flush interval so only a read can flush the queue
+    monkeypatch.setattr(session_db_sqlite, "db_path", tmp_path / "sessions.db")
+    monkeypatch.setattr(session_db_sqlite, "_schema_version", None)
+    monkeypatch.setattr(session_db_sqlite, "_idle", type(session_db_sqlite._idle)())
+    monkeypatch.setattr(session_event_log, "EVENT_LOG_ENABLED", False)
+    monkeypatch.setenv("DB_WRITE_FLUSH_INTERVAL", "30")
+    store = session_store.SessionStore(session_db_sqlite, "sqlite")
+    store.ensure_sessions_table()
+    yield store
+    if store._writer is not None:
+        store._writer.close()
+    while session_db_sqlite._idle:
+        session_db_sqlite._idle.pop().close()
+
+
+def test_reads_see_queued_messages(store):
+    session_id = store.save_session("test", {"level": "Level I"})
+    store.enqueue_message(session_id, "user", "Salve")
+    store.enqueue_message(session_id, "assistant", "Salve, discipule")
+
+    messages = store.get_session_messages(session_id)
+
+    assert [(role, content) for _, role, content, _, _ in messages] == [
+        ("user", "Salve"),
+        ("assistant", "Salve, discipule"),
+    ]
+    assert messages[1][4] is not None  # time_delta computed from the previous message
+
+
+def test_load_session_sees_queued_update_and_rebuilds_history(store):
+    session_id = store.save_session("test", {"level": "Level I"})
+    store.enqueue_message(session_id, "user", "Salve")
+    store.enqueue_session_update("renamed", {"level": "Level II"}, session_db_id=session_id, end_reason="closed")
+
+    data = store.load_session(session_id)
+
+    assert data["level"] == "Level II"
+    assert data["chat_messages"] == [{"role": "user", "content": "Salve"}]
+    assert [(row[0], row[1]) for row in store.list_sessions()] == [(session_id, "renamed")]
+
+
+def test_delete_session_writes_queued_messages_first(store):
+    session_id = store.save_session("test", {})
+    store.enqueue_message(session_id, "user", "Salve")
+
+    store.delete_session(session_id)
+
+    assert store.list_sessions() == []
+    assert session_db_sqlite.get_session_messages(session_id) == []
+
+
+def test_failed_write_is_logged_and_the_rest_of_the_batch_is_kept(store, caplog):
+    session_id = store.save_session("test", {})
+    store.enqueue_message(session_id, "user", "first")
+    store.enqueue_message(999, "user", "orphan")  # No such session: violates the messages foreign key
+    store.enqueue_message(session_id, "user", "second")
+
+    with caplog.at_level(logging.ERROR):
+        messages = store.get_session_messages(session_id)
+
+    assert [content for _, _, content, _, _ in messages] == ["first", "second"]
+    assert store.writer_stats()["failed_items"] == 1
+    lost = [record.getMessage() for record in caplog.records if "Lost queued message write" in record.getMessage()]
+    assert len(lost) == 1 and '"orphan"' in lost[0]
@@ -0,0 +1,109 @@
+import threading
+
+import pytest
+
+import write_behind
+
+
+class TransientError(Exception):
+    pass
+
+
+class FakeBackend:
+    """flush_batch stand-in that writes a batch atomically, like a DB transaction."""
+
+    def __init__(self, bad=(), transient_failures=0):
+        self.bad = set(bad)
+        self.transient_failures = transient_failures
+        self.written = []
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def flush_batch(self, batch):
+        with self.lock:
+            self.calls.append(list(batch))
+            if self.transient_failures:
+                self.transient_failures -= 1
+                raise TransientError("database is locked")
+            bad = [item for item in batch if item in self.bad]
+            if bad:
+                raise ValueError(f"constraint violated by {bad}")
+            self.written.extend(batch)
+
+
+@pytest.fixture
+def make_queue():
+    queues = []
+
+    def make(backend, **kwargs):
+        failures = []
+        options = dict(flush_interval=30.0, retry_base=0.001, transient_errors=(TransientError,),
+                       on_failure=lambda batch, error: failures.append((list(batch), error)))
+        options.update(kwargs)
+        queue = write_behind.WriteBehindQueue(backend.flush_batch, **options)
+        queues.append(queue)
+        return queue, failures
+
+    yield make
+    for queue in queues:
+        queue.close()
+
+
+def test_failing_batch_is_bisected_down_to_the_bad_items(make_queue):
+    backend = FakeBackend(bad={3, 6})
+    queue, failures = make_queue(backend)
+    for item in range(8):
+        queue.put(item)
+    queue.flush(timeout=5)
+
+    assert sorted(backend.written) == [0, 1, 2, 4, 5, 7]
+    assert sorted(batch[0] for batch, _ in failures) == [3, 6]
+    assert all(len(batch) == 1 and isinstance(error, ValueError) for batch, error in failures)
+    stats = queue.stats()
+    assert stats["written"] == 6
+    assert stats["failed_items"] == 2
+
+
+def test_bisecting_keeps_the_order_of_the_good_items(make_queue):
+    backend = FakeBackend(bad={0})
+    queue, _ = make_queue(backend)
+    for item in range(5):
+        queue.put(item)
+    queue.flush(timeout=5)
+
+    assert backend.written == [1, 2, 3, 4]
+
+
+def test_transient_errors_are_retried_without_splitting_the_batch(make_queue):
+    backend = FakeBackend(transient_failures=2)
+    queue, failures = make_queue(backend)
+    for item in range(4):
+        queue.put(item)
+    queue.flush(timeout=5)
+
+    assert backend.written == [0, 1, 2, 3]
+    assert [len(batch) for batch in backend.calls] == [4, 4, 4]
+    assert failures == []
+    assert queue.stats()["retries"] == 2
+
+
+def test_batch_is_dropped_after_max_retries(make_queue):
+    backend = FakeBackend(transient_failures=10)
+    queue, failures = make_queue(backend, max_retries=2)
+    for item in range(3):
+        queue.put(item)
+    queue.flush(timeout=5)
+
+    assert backend.written == []
+    assert [batch for batch, _ in failures] == [[0, 1, 2]]
+    assert queue.stats()["failed_items"] == 3
+
+
+def test_flush_writes_queued_items_before_the_interval(make_queue):
+    backend = FakeBackend()
+    queue, _ = make_queue(backend, flush_interval=30.0)
+    queue.put("a")
+    queue.put("b")
+    queue.flush(timeout=5)
+
+    assert backend.written == ["a", "b"]